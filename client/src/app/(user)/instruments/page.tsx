@@ -5,6 +5,7 @@ import type React from "react"
 import { motion } from "framer-motion"
 import { useUser } from "@clerk/nextjs"
 import Link from "next/link"
+import { fetchAnalysis } from "@/lib/analysis"
 
 const instruments = [
   { name: "Sitar", image: "/sitar.png" },
@@ -257,12 +258,7 @@ export default function InstrumentsPage() {
       setLoading(true)
 
       // Call the process-audio endpoint
-      const processResponse = await fetch(`${API_URL}/process-audio/${user.id}`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-      })
+      const processResponse = await fetchAnalysis(API_URL, `/process-audio/${user.id}`)
 
       if (!processResponse.ok) {
         throw new Error(`Server responded with ${processResponse.status}: ${processResponse.statusText}`)
@@ -281,12 +277,7 @@ export default function InstrumentsPage() {
         })
 
         // Call the analyze-music endpoint
-        const musicAnalysisResponse = await fetch(`${API_URL}/analyze-instruments/${user.id}`, {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          },
-        })
+        const musicAnalysisResponse = await fetchAnalysis(API_URL, `/analyze-instruments/${user.id}`)
 
         if (!musicAnalysisResponse.ok) {
           throw new Error("Music analysis failed")
@@ -3,6 +3,7 @@ import React, { useState, useRef, useEffect } from "react";
 import { AnimatePresence, motion } from "framer-motion";
 import { useUser } from "@clerk/nextjs";
 import Link from "next/link";
+import { fetchAnalysis } from "@/lib/analysis";
 
 interface AudioProcessingResponse {
   message: string;
@@ -151,12 +152,7 @@ export default function UploadAnalyzePage() {
       }
       
       // Call the process-audio endpoint
-      const processResponse = await fetch(`${API_URL}/process-audio/${userId}`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-      });
+      const processResponse = await fetchAnalysis(API_URL, `/process-audio/${userId}`);
       
       if (!processResponse.ok) {
         throw new Error(`Server responded with ${processResponse.status}: ${processResponse.statusText}`);
@@ -175,12 +171,7 @@ export default function UploadAnalyzePage() {
         });
   
         // Call the analyze-music endpoint
-        const musicAnalysisResponse = await fetch(`${API_URL}/analyze-instruments/${userId}`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-        });
+        const musicAnalysisResponse = await fetchAnalysis(API_URL, `/analyze-instruments/${userId}`);
   
         if (!musicAnalysisResponse.ok) {
           throw new Error("Music analysis failed");
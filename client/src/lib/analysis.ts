@@ -0,0 +1,50 @@
+// src/lib/analysis.ts
+
+import { sleep } from "@/lib/utils";
+
+const POLL_INTERVAL_MS = 1000;
+const POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
+// POST to an analysis endpoint, waiting out its background job.
+//
+// Uploads are analysed in the background: while the analysis is queued or
+// running the endpoint answers 202 with a status_url. Poll that job until it
+// is done, then POST again for the stored results.
+export async function fetchAnalysis(apiUrl: string | undefined, path: string): Promise<Response> {
+  const deadline = Date.now() + POLL_TIMEOUT_MS;
+  let response = await postJson(`${apiUrl}${path}`);
+
+  while (response.status === 202) {
+    const pending = await response.json();
+    await waitForJob(apiUrl, pending.status_url, deadline);
+    response = await postJson(`${apiUrl}${path}`);
+  }
+  return response;
+}
+
+async function waitForJob(apiUrl: string | undefined, statusUrl: string, deadline: number) {
+  while (Date.now() < deadline) {
+    await sleep(POLL_INTERVAL_MS);
+    const jobResponse = await fetch(`${apiUrl}${statusUrl}`);
+    if (!jobResponse.ok) {
+      throw new Error(`Analysis job status failed with ${jobResponse.status}`);
+    }
+    const job = await jobResponse.json();
+    if (job.status === "done") {
+      return;
+    }
+    if (job.status === "failed") {
+      throw new Error(`Analysis failed: ${job.error || "Unknown error"}`);
+    }
+  }
+  throw new Error("Timed out waiting for the analysis");
+}
+
+function postJson(url: string) {
+  return fetch(url, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+  });
+}
@@ -0,0 +1,204 @@
+import hashlib
+import librosa
+import numpy as np
+import logging
+from StreamingExtractor import audio_duration, STREAMING_MIN_SECONDS
+from Metrics import timed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('AnalysisContext')
+
+# Analysis parameters shared by every analyzer
+SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+# Seconds decoded up front for long files whose genre features are streamed
+STREAMING_HEAD_SECONDS = 30
+
+
+class AudioAnalysisContext:
+    """
+    Decoded audio plus the spectral representations derived from it.
+
+    The file is decoded and resampled once, and a single magnitude STFT is
+    computed lazily. Genre, instrument and key/tempo analysis all read
+    excerpts and derived features from the same context instead of calling
+    librosa.load and librosa.stft on their own.
+
+    The instrument and key/tempo analyzers used to decode with librosa's
+    default (soxr_hq) resampler; the shared decode uses kaiser_fast, like
+    genre feature extraction always has. Their inputs are unchanged for
+    audio already at SAMPLE_RATE and differ slightly for other rates.
+
+    Files of at least STREAMING_MIN_SECONDS are only decoded for their first
+    STREAMING_HEAD_SECONDS (enough for instrument and key/tempo analysis);
+    `truncated` is set and DataExtractor streams the whole file instead.
+    """
+
+    def __init__(self, path=None, y=None, sr=SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH):
+        """
+        Args:
+            path (str): Path to the audio file to decode
+            y (np.ndarray): Already decoded mono signal (used instead of path)
+            sr (int): Sample rate to resample to
+            n_fft (int): FFT size of the shared STFT
+            hop_length (int): Hop length of the shared STFT
+        """
+        self.truncated = False
+        if y is None:
+            if path is None:
+                raise ValueError("Either path or y must be provided")
+            total_duration = audio_duration(path)
+            head = None
+            if total_duration is not None and total_duration >= STREAMING_MIN_SECONDS:
+                head = STREAMING_HEAD_SECONDS
+                self.truncated = True
+            # Use res_type='kaiser_fast' for faster loading with slight quality reduction
+            with timed('decode'):
+                y, sr = librosa.load(path, sr=sr, res_type='kaiser_fast', duration=head)
+            logger.info(f"Decoded {path}: {len(y)} samples at {sr} Hz"
+                        + (f" (first {head}s of {total_duration:.0f}s)" if self.truncated else ""))
+
+        self.path = path
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        # Derived features, keyed by name; DataExtractor shares this dict
+        self.cache = {}
+
+    @property
+    def duration(self):
+        return len(self.y) / float(self.sr)
+
+    @property
+    def content_hash(self):
+        """SHA-256 of the source file's bytes (or of the samples when built from an array)"""
+        if 'content_hash' not in self.cache:
+            self.cache['content_hash'] = hash_file(self.path) if self.path else \
+                hashlib.sha256(np.ascontiguousarray(self.y).tobytes()).hexdigest()
+        return self.cache['content_hash']
+
+    def _is_excerpt(self, duration):
+        """Whether `duration` seconds is shorter than the decoded signal"""
+        return duration is not None and int(duration * self.sr) < len(self.y)
+
+    def excerpt(self, duration=None):
+        """Return the first `duration` seconds of the signal (all of it if None)"""
+        if duration is None:
+            return self.y
+        return self.y[:int(duration * self.sr)]
+
+    def complex_stft(self):
+        """Complex STFT of the whole signal (kept for spectrogram-domain HPSS)"""
+        if 'stft_complex' not in self.cache:
+            self.cache['stft_complex'] = librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length)
+        return self.cache['stft_complex']
+
+    def stft(self, duration=None):
+        """Magnitude STFT, optionally limited to the first `duration` seconds"""
+        if 'stft' not in self.cache:
+            self.cache['stft'] = np.abs(self.complex_stft())
+        if not self._is_excerpt(duration):
+            return self.cache['stft']
+
+        key = f'stft_{duration}'
+        if key not in self.cache:
+            self.cache[key] = self._excerpt_stft(duration)
+        return self.cache[key]
+
+    def _excerpt_stft(self, duration):
+        """
+        Frames of the shared STFT covering the first `duration` seconds.
+
+        The last few frames, whose analysis window runs past the end of the
+        excerpt, are recomputed with the zero padding a truncated
+        librosa.load(duration=...) would have, so excerpt features match a
+        truncated decode of the same samples.
+        """
+        num_samples = int(duration * self.sr)
+        num_frames = 1 + num_samples // self.hop_length
+        pad = self.n_fft // 2
+
+        S = self.stft()[:, :num_frames].copy()
+        first_edge = max(0, (num_samples - pad) // self.hop_length + 1)
+        if first_edge < num_frames:
+            padded = np.pad(self.y[:num_samples], (pad, pad))
+            segment = padded[first_edge * self.hop_length:(num_frames - 1) * self.hop_length + self.n_fft]
+            S[:, first_edge:] = np.abs(librosa.stft(
+                segment, n_fft=self.n_fft, hop_length=self.hop_length, center=False
+            ))
+        return S
+
+    def power(self, duration=None):
+        """Power spectrogram (|STFT|**2)"""
+        if self._is_excerpt(duration):
+            return self.stft(duration) ** 2
+        if 'power' not in self.cache:
+            self.cache['power'] = self.stft() ** 2
+        return self.cache['power']
+
+    def mel_basis(self, n_mels=128):
+        key = f'mel_basis_{n_mels}'
+        if key not in self.cache:
+            self.cache[key] = librosa.filters.mel(sr=self.sr, n_fft=self.n_fft, n_mels=n_mels)
+        return self.cache[key]
+
+    def melspectrogram(self, duration=None, n_mels=128):
+        """Mel power spectrogram computed from the shared STFT"""
+        if self._is_excerpt(duration):
+            return self.mel_basis(n_mels).dot(self.power(duration))
+        key = f'mel_{n_mels}'
+        if key not in self.cache:
+            self.cache[key] = self.mel_basis(n_mels).dot(self.power())
+        return self.cache[key]
+
+    def log_melspectrogram(self, duration=None, n_mels=128):
+        """Mel spectrogram in dB, referenced to 1.0 like librosa.power_to_db defaults"""
+        # power_to_db clips top_db below the signal's own peak, so excerpts
+        # are converted from their own mel spectrogram to match a truncated load
+        if self._is_excerpt(duration):
+            return librosa.power_to_db(self.melspectrogram(duration, n_mels=n_mels))
+        key = f'log_mel_{n_mels}'
+        if key not in self.cache:
+            self.cache[key] = librosa.power_to_db(self.melspectrogram(n_mels=n_mels))
+        return self.cache[key]
+
+    def mfcc(self, duration=None, n_mfcc=20):
+        """MFCCs derived from the 128-band log-mel spectrogram"""
+        if self._is_excerpt(duration):
+            return librosa.feature.mfcc(S=self.log_melspectrogram(duration), n_mfcc=n_mfcc)
+        key = f'mfcc_{n_mfcc}'
+        if key not in self.cache:
+            self.cache[key] = librosa.feature.mfcc(S=self.log_melspectrogram(), n_mfcc=n_mfcc)
+        return self.cache[key]
+
+    def chroma(self, duration=None):
+        """Chromagram from the shared power spectrogram"""
+        # Tuning estimation and normalisation look at the whole input, so
+        # excerpts get their own chromagram rather than a slice
+        if self._is_excerpt(duration):
+            return librosa.feature.chroma_stft(
+                S=self.power(duration), sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length
+            )
+        if 'chroma' not in self.cache:
+            self.cache['chroma'] = librosa.feature.chroma_stft(
+                S=self.power(), sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length
+            )
+        return self.cache['chroma']
+
+    def tempo(self, duration=None):
+        """Tempo estimate from an onset envelope built on the shared mel spectrogram"""
+        log_mel = self.log_melspectrogram(duration)
+        onset_env = librosa.onset.onset_strength(S=log_mel, sr=self.sr, hop_length=self.hop_length)
+        return librosa.feature.tempo(onset_envelope=onset_env, sr=self.sr, hop_length=self.hop_length)[0]
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
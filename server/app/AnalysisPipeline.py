@@ -0,0 +1,374 @@
+import os
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import torch
+import BlobCache
+import PlotRenderer
+import Metrics
+from AnalysisContext import AudioAnalysisContext
+from DataExtractor import DataExtractor, feature_names
+from GenreAnalysis import predict_genre
+from InstrumentAnalysis import InstrumentAnalyzer
+from JobQueue import JobQueue, JobRejected, QUEUED, RUNNING, DONE, FAILED
+from ModelPool import INFERENCE_THREADS
+from ModelRegistry import Registry
+from Metrics import timed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('AnalysisPipeline')
+
+# Processes analysing files, each with its own models, so decoding,
+# feature extraction and plotting run in parallel instead of taking turns
+# on the app's GIL. 0 analyses in the job threads instead.
+ANALYSIS_PROCESSES = int(os.environ.get('ANALYSIS_PROCESSES', '2'))
+# Analyses run concurrently across all users; each job thread keeps one process busy
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', str(max(1, ANALYSIS_PROCESSES))))
+# Queued plus running analyses a single user may have outstanding
+ANALYSIS_MAX_PENDING_PER_USER = int(os.environ.get('ANALYSIS_MAX_PENDING_PER_USER', '8'))
+# Models each analysis process loads; the app process never needs them when there are processes
+WORKER_MODELS = ('genre', 'instrument')
+# Plot redraws of analysed files whose plots were evicted. They have their
+# own queue, so they neither wait behind analyses nor count against a
+# user's analyses; each running redraw occupies an analysis process.
+REDRAW_WORKERS = int(os.environ.get('REDRAW_WORKERS', '1'))
+REDRAW_MAX_PENDING_PER_USER = int(os.environ.get('REDRAW_MAX_PENDING_PER_USER', '8'))
+
+
+@timed('analysis')
+def analyze_file(file_path, gridfs_id):
+    """
+    Full analysis of one file: features, genre, instrument, key/tempo and plots.
+
+    The file is decoded once and every analyzer shares the context. Plots
+    are queued in the render processes and not waited for (in an analysis
+    process they are drawn in place); their URLs are returned and the
+    images appear once rendered.
+
+    Args:
+        file_path (str): Local path of the audio
+        gridfs_id (ObjectId): GridFS id of the file, for logging
+
+    Returns:
+        dict: Analysis results, BSON/JSON serialisable
+
+    Raises:
+        RuntimeError: If a model was unavailable; the job fails and is retried on request
+    """
+    context = AudioAnalysisContext(file_path)
+
+    data_extractor = DataExtractor()
+    data_extractor.load_context(context)
+    data_extractor.plot_waveform()
+    data_extractor.plot_harmonic_percussive()
+
+    # PoolTimeout propagates and fails the job
+    genre_result = predict_genre(file_path, context=context)
+    try:
+        instrument_analysis = InstrumentAnalyzer.analyze_instrument(file_path, context=context)
+    except Exception as e:
+        # Model failed to load: keep the other results, like analyze_instrument's own errors
+        logger.error(f"Instrument analysis of {gridfs_id} failed: {str(e)}")
+        instrument_analysis = {'status': 'error', 'error': str(e), 'analysis_type': 'instrument'}
+    if instrument_analysis == -1:
+        raise RuntimeError('No available models to process instrument')
+    key_tempo_analysis = InstrumentAnalyzer.analyze_key_tempo(file_path, context=context)
+
+    return {
+        'file_path': file_path,
+        'genre': genre_result['genre'],
+        'genre_probabilities': genre_result['probabilities'],
+        'instrument': instrument_analysis,
+        'key_tempo': key_tempo_analysis,
+        'tempo': float(data_extractor.tempo),
+        'features': {
+            name: [float(value) for value in row]
+            for name, row in zip(feature_names(data_extractor.n_mfcc), data_extractor.features)
+        },
+        'content_hash': context.content_hash,
+        'plot_urls': PlotRenderer.plot_urls(context.content_hash),
+    }
+
+
+@timed('plot_redraw')
+def redraw_plots(file_path, content_hash):
+    """
+    Draw the plots of an analysed file again, e.g. after they were evicted.
+
+    Only decodes and separates the audio: no features, no models. Like in
+    analyze_file the drawing is queued in the render processes (or done in
+    place in an analysis process).
+
+    Args:
+        file_path (str): Local path of the audio
+        content_hash (str): Content hash stored with the analysis results, which names the plots
+    """
+    context = AudioAnalysisContext(file_path)
+    # Same bytes as when analysed; no need to hash them again
+    context.cache['content_hash'] = content_hash
+
+    data_extractor = DataExtractor()
+    data_extractor.load_context(context, extract=False)
+    data_extractor.plot_waveform()
+    data_extractor.plot_harmonic_percussive()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    """Load the analysis models once per analysis process"""
+    # Nothing else runs torch here, so always keep concurrent analyses off each other's cores
+    torch.set_num_threads(INFERENCE_THREADS)
+    PlotRenderer.render_in_process()
+    Metrics.collect_observations()
+    for name in WORKER_MODELS:
+        try:
+            Registry.get(name)
+        except Exception as e:
+            # Recorded in the worker's registry; analyses retry the load
+            logger.error(f"Analysis process {os.getpid()} could not load {name}: {str(e)}")
+
+
+def _call_in_worker(fn, *args):
+    """fn(*args) in an analysis process, returning its stage timings for the app's metrics"""
+    result = fn(*args)
+    return result, Metrics.drain_observations()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Never fork the app itself: its threads may hold locks the
+            # child would inherit. A fork server is a clean single-threaded
+            # process that imports the analysis modules once for every worker.
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['AnalysisPipeline'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=ANALYSIS_PROCESSES, mp_context=context,
+                                            initializer=_init_worker)
+        return _executor
+
+
+def start():
+    """Start the analysis processes now; their models load in the background"""
+    if ANALYSIS_PROCESSES > 0:
+        # Processes start on demand, one per task submitted while none is idle
+        executor = _get_executor()
+        for _ in range(ANALYSIS_PROCESSES):
+            executor.submit(int)
+
+
+def _run_in_process(fn, *args):
+    """fn(*args) in an analysis process, or in this thread if there are none"""
+    global _executor
+    if ANALYSIS_PROCESSES <= 0:
+        return fn(*args)
+
+    executor = _get_executor()
+    try:
+        result, observations = executor.submit(_call_in_worker, fn, *args).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory). Replace the pool for later
+        # jobs; this one fails and is requeued on the next request.
+        with _executor_lock:
+            if _executor is executor:
+                _executor = None
+        logger.error(f"Analysis process died running {fn.__name__}; restarting the pool")
+        raise
+    for stage, seconds in observations:
+        Metrics.record(stage, seconds)
+    return result
+
+
+def run_analysis(file_path, gridfs_id):
+    """
+    analyze_file in an analysis process, or in this thread if there are none.
+
+    Only the path is shipped to the process; it decodes the file itself.
+
+    Returns:
+        dict: Analysis results
+    """
+    return _run_in_process(analyze_file, file_path, gridfs_id)
+
+
+def _with_local_copy(fs, gridfs_id, filename, analyse):
+    """
+    Call `analyse(file_path)` on the blob cache's copy of a GridFS file.
+
+    The copy can be evicted between local_path() returning and the analysis
+    opening it; it is then fetched from GridFS again and the analysis
+    retried once.
+    """
+    file_path = BlobCache.local_path(fs, gridfs_id, filename)
+    try:
+        return analyse(file_path)
+    except FileNotFoundError:
+        if os.path.exists(file_path):
+            # Something else is missing
+            raise
+        logger.warning(f"Cached copy of {gridfs_id} was evicted before it was read; fetching it again")
+        return analyse(BlobCache.local_path(fs, gridfs_id, filename))
+
+
+def _run_analysis(store, fs, user_id, gridfs_id, filename, content_hash=None):
+    """Analyse one stored file and persist the results on its metadata document"""
+    try:
+        results = _with_local_copy(fs, gridfs_id, filename,
+                                   lambda file_path: run_analysis(file_path, gridfs_id))
+    except Exception as e:
+        store.update(gridfs_id, {
+            'analysis.status': FAILED,
+            'analysis.error': str(e),
+            'analysis.updated_at': datetime.utcnow(),
+        })
+        raise
+    finally:
+        if content_hash:
+            PlotRenderer.done_expecting(content_hash)
+
+    store.update(gridfs_id, {
+        'analysis.status': DONE,
+        'analysis.results': results,
+        'analysis.error': None,
+        'analysis.updated_at': datetime.utcnow(),
+    })
+    logger.info(f"Analysis of {gridfs_id} for {user_id} complete: {results['genre']}")
+    # Results live with the file; the job only reports completion
+    return None
+
+
+AnalysisQueue = JobQueue(
+    'analysis',
+    _run_analysis,
+    workers=ANALYSIS_WORKERS,
+    max_pending_per_user=ANALYSIS_MAX_PENDING_PER_USER
+)
+
+
+def _run_redraw(fs, user_id, gridfs_id, filename, content_hash):
+    """Draw the plots of one analysed file again"""
+    try:
+        _with_local_copy(fs, gridfs_id, filename,
+                         lambda file_path: _run_in_process(redraw_plots, file_path, content_hash))
+    finally:
+        PlotRenderer.done_expecting(content_hash)
+    logger.info(f"Redrew the plots of {gridfs_id} for {user_id}")
+    return None
+
+
+RedrawQueue = JobQueue(
+    'plot_redraw',
+    _run_redraw,
+    workers=REDRAW_WORKERS,
+    max_pending_per_user=REDRAW_MAX_PENDING_PER_USER
+)
+
+
+def submit_analysis(store, fs, file_doc):
+    """
+    Queue the analysis of an uploaded file and mark it pending on its metadata.
+
+    Args:
+        store (FileMetadataStore): Collection the file's metadata lives in
+        fs (gridfs.GridFS): GridFS holding the file
+        file_doc (dict): The file's metadata document
+
+    Returns:
+        dict: The pending analysis record ('status', 'job_id')
+
+    Raises:
+        JobRejected: If the user or the queue is at its limit
+    """
+    gridfs_id = file_doc['gridfs_id']
+    content_hash = file_doc.get('content_hash')
+    # Before submitting, so the job can't finish first; plot requests wait for it
+    if content_hash:
+        PlotRenderer.expect(content_hash)
+    try:
+        job_id = AnalysisQueue.submit(
+            file_doc['user_id'], store=store, fs=fs, user_id=file_doc['user_id'], gridfs_id=gridfs_id,
+            filename=file_doc.get('filename'), content_hash=content_hash
+        )
+    except JobRejected:
+        if content_hash:
+            PlotRenderer.done_expecting(content_hash)
+        raise
+
+    analysis = {'status': QUEUED, 'job_id': job_id}
+    # A fast job may already have stored its results; don't mark them pending again
+    store.update(gridfs_id, {
+        'analysis.status': QUEUED,
+        'analysis.job_id': job_id,
+        'analysis.updated_at': datetime.utcnow(),
+    }, unless={'analysis.status': DONE})
+    return analysis
+
+
+def submit_redraw(fs, file_doc, content_hash):
+    """
+    Queue drawing the plots of an analysed file again.
+
+    Args:
+        fs (gridfs.GridFS): GridFS holding the file
+        file_doc (dict): The file's metadata document
+        content_hash (str): Content hash stored with the analysis results
+
+    Returns:
+        str: Job id
+
+    Raises:
+        JobRejected: If the user or the queue is at its limit
+    """
+    # Plot requests wait for the redraw, and later lookups don't queue another
+    PlotRenderer.expect(content_hash)
+    try:
+        return RedrawQueue.submit(
+            file_doc['user_id'], fs=fs, user_id=file_doc['user_id'], gridfs_id=file_doc['gridfs_id'],
+            filename=file_doc.get('filename'), content_hash=content_hash
+        )
+    except JobRejected:
+        PlotRenderer.done_expecting(content_hash)
+        raise
+
+
+def current_analysis(store, fs, file_doc):
+    """
+    Stored analysis of a file, queueing one when none is done or in flight.
+
+    Files uploaded before analysis ran on upload, analyses lost with a
+    restart and failed analyses are (re)queued here. Done analyses whose
+    plots were evicted from the plot cache get a plot-only redraw; their
+    results are returned meanwhile.
+
+    Returns:
+        dict: The file's analysis record; 'results' is set once status is DONE,
+            otherwise 'status' is QUEUED or RUNNING with the 'job_id' to poll
+
+    Raises:
+        JobRejected: If a new analysis was needed but the queue is at its limit
+    """
+    analysis = file_doc.get('analysis') or {}
+    if analysis.get('status') == DONE:
+        content_hash = analysis['results'].get('content_hash')
+        if content_hash and not PlotRenderer.plots_available(content_hash):
+            try:
+                submit_redraw(fs, file_doc, content_hash)
+            except JobRejected as e:
+                logger.warning(f"Could not queue a redraw of the plots of {file_doc['gridfs_id']}: {str(e)}")
+        return analysis
+
+    job = AnalysisQueue.get(analysis['job_id']) if analysis.get('job_id') else None
+    if job is not None and job['status'] in (QUEUED, RUNNING):
+        return dict(analysis, status=job['status'], position=job.get('position'))
+
+    return submit_analysis(store, fs, file_doc)
@@ -0,0 +1,128 @@
+import threading
+import time
+import queue
+import logging
+from collections import Counter
+from concurrent.futures import Future
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('BatchScheduler')
+
+# Every scheduler created in this process, for stats reporting
+_schedulers = []
+_schedulers_lock = threading.Lock()
+
+
+class BatchScheduler:
+    """
+    Collects single inference requests from many threads into micro-batches.
+
+    Callers `submit()` one item and get a Future back. A background thread
+    waits for up to `max_wait_ms` after the first queued item (or until
+    `max_batch` items are queued), passes the whole batch to `run_batch`
+    in one call, and resolves each caller's Future with its own result.
+    """
+
+    def __init__(self, name, run_batch, max_batch=16, max_wait_ms=5.0):
+        """
+        Args:
+            name (str): Scheduler name used in logs and stats
+            run_batch (callable): Takes a list of items, returns a list of results in the same order
+            max_batch (int): Largest batch handed to run_batch
+            max_wait_ms (float): How long to hold the first item while waiting for more
+        """
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._batches = 0
+
+        with _schedulers_lock:
+            _schedulers.append(self)
+
+    def submit(self, item):
+        """Queue one item for the next batch and return a Future for its result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name=f"{self.name}-batcher", daemon=True
+                )
+                self._thread.start()
+                logger.info(f"Started {self.name} batch scheduler "
+                            f"(max_batch={self.max_batch}, max_wait={self.max_wait * 1000:.1f}ms)")
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
+                self._batches += 1
+
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logger.error(f"Error running {self.name} batch of {len(items)}: {str(e)}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def stats(self):
+        """Achieved batch sizes and queue depth"""
+        with self._stats_lock:
+            return {
+                'name': self.name,
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': self._batches,
+                'items': self._items,
+                'mean_batch_size': self._items / self._batches if self._batches else 0.0,
+                'batch_size_counts': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'queue_depth': self._queue.qsize(),
+            }
+
+
+def all_scheduler_stats():
+    """Stats for every BatchScheduler in this process, keyed by scheduler name"""
+    with _schedulers_lock:
+        schedulers = list(_schedulers)
+    return {scheduler.name: scheduler.stats() for scheduler in schedulers}
@@ -0,0 +1,93 @@
+import os
+import shutil
+import hashlib
+import threading
+import logging
+from DiskCache import DiskLRUCache
+from Metrics import timed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('BlobCache')
+
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('BLOB_CACHE_MAX_MB', '2048')) * 1024 * 1024
+
+# Shared by all users: a GridFS id always names the same bytes
+_store = DiskLRUCache('blobs', BLOB_CACHE_MAX_BYTES)
+
+# One fill per blob at a time, so concurrent misses fetch from GridFS once
+_fill_locks = {}
+_fill_locks_lock = threading.Lock()
+
+
+def blob_key(gridfs_id, filename=None):
+    """
+    Cache key for a GridFS file.
+
+    The id is hashed so entries spread evenly over the shard directories
+    (ObjectIds of the same period share their leading characters). The
+    original extension is kept because some decoders pick the format from it.
+    """
+    ext = os.path.splitext(filename or '')[1].lower()
+    return hashlib.sha256(str(gridfs_id).encode()).hexdigest() + ext
+
+
+def _fill_lock(key):
+    with _fill_locks_lock:
+        return _fill_locks.setdefault(key, threading.Lock())
+
+
+def local_path(fs, gridfs_id, filename=None):
+    """
+    Local path of a GridFS file, copying it into the cache on a miss.
+
+    Args:
+        fs (gridfs.GridFS): GridFS the file lives in
+        gridfs_id (ObjectId): File id
+        filename (str): Original filename, for its extension
+
+    Returns:
+        str: Path to a local copy of the file
+
+    Raises:
+        gridfs.NoFile: If the file is not in GridFS
+    """
+    key = blob_key(gridfs_id, filename)
+    path = _store.get_path(key)
+    if path is not None:
+        return path
+
+    with _fill_lock(key):
+        # Filled by another request while we waited
+        if os.path.exists(_store.path_for(key)):
+            return _store.path_for(key)
+
+        grid_out = fs.get(gridfs_id)
+        with timed('gridfs_restore'), _store.writer(key) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                # One GridFS chunk in memory at a time
+                shutil.copyfileobj(grid_out, f, grid_out.chunk_size)
+        logger.info(f"Cached GridFS file {gridfs_id} ({grid_out.length} bytes)")
+
+    with _fill_locks_lock:
+        _fill_locks.pop(key, None)
+    return _store.path_for(key)
+
+
+def put_stream(gridfs_id, filename, stream):
+    """
+    Seed the cache with a file that was just stored in GridFS.
+
+    Args:
+        gridfs_id (ObjectId): Id the file was stored under
+        filename (str): Original filename, for its extension
+        stream: Readable file object positioned at the start of the content
+
+    Returns:
+        str: Path to the cached copy
+    """
+    key = blob_key(gridfs_id, filename)
+    with _store.writer(key) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+    return _store.path_for(key)
@@ -1,24 +1,20 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import os
 import librosa
-import librosa.display
-from functools import lru_cache
 from xgboost import XGBClassifier
 import torch
 from torch import nn
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
 import scipy
+from AnalysisContext import AudioAnalysisContext
+from ModelPool import ModelPool, PoolTimeout, INFERENCE_THREADS, LIMIT_TORCH_THREADS
+import FeatureCache
+import StreamingExtractor
+import PlotRenderer
+from Metrics import timed
 
-processor = AutoProcessor.from_pretrained("facebook/musicgen-small")
-model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small")
+GenreModelPool=ModelPool('extractor_genre')
 
-GenreModels=[]
-GenreBusy=[]
-
-InstrumentModels=[]
-InstrumentBusy=[]
+InstrumentModelPool=ModelPool('instrument')
 
 GenreDict={0:"Bengali",
            1:"Bhangra",
@@ -41,32 +37,82 @@ InstrumentDict={0:"Dhol",
 
 chroma_to_key = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
+# Harmonic/percussive separation settings.
+#   'stft' - median-filter the context's shared complex STFT (same result as
+#            librosa.effects.hpss with default settings, one STFT fewer)
+#   'full' - librosa.effects.hpss on the decoded signal (original behaviour)
+# SEPARATION_EXCERPT_SECONDS limits separation to the middle of long
+# tracks; the default 0 analyses the whole track, as the genre model was
+# trained. Only enable an excerpt (and change SEPARATION_KERNEL, the median
+# filter length, librosa's default is 31) after checking the genre model
+# with server/benchmarks/separation_parity.py. Streamed files always
+# separate an excerpt, 120 s unless set.
+SEPARATION_MODE = os.environ.get('SEPARATION_MODE', 'stft')
+SEPARATION_EXCERPT_SECONDS = float(os.environ.get('SEPARATION_EXCERPT_SECONDS', '0'))
+SEPARATION_KERNEL = int(os.environ.get('SEPARATION_KERNEL', '31'))
+
+def feature_names(n_mfcc=20):
+    """Row labels of the feature matrix, in model input order"""
+    return ['tempo', 'y_harmoic', 'y_percussive', 'tonnetz', 'cstft', 'srms', 'specband',
+            'speccent', 'rolloff', 'zero_crossing_rate'] + [f'mfcc_{i}' for i in range(n_mfcc)]
+
+def _reduce_into(x, out):
+    """Write (min, mean, max, var) over every element of x into out"""
+    out[0] = x.min()
+    out[1] = x.mean()
+    out[2] = x.max()
+    out[3] = x.var()
+
+def _reduce_rows_into(x, out):
+    """Write per-row (min, mean, max, var) of a (rows, frames) matrix into out[rows, 4]"""
+    np.min(x, axis=1, out=out[:, 0])
+    np.mean(x, axis=1, out=out[:, 1])
+    np.max(x, axis=1, out=out[:, 2])
+    np.var(x, axis=1, out=out[:, 3])
+
 class DataExtractor:
-    def __init__(self, n_mfcc=20, base_output_dir=None):
+    def __init__(self, n_mfcc=20, base_output_dir=None, separation_mode=None,
+                 separation_excerpt=None, separation_kernel=None):
         self.n_mfcc = n_mfcc
         self.base_output_dir = base_output_dir or 'outputs'
+        self.separation_mode = separation_mode or SEPARATION_MODE
+        self.separation_excerpt = SEPARATION_EXCERPT_SECONDS if separation_excerpt is None else separation_excerpt
+        self.separation_kernel = separation_kernel or SEPARATION_KERNEL
+        if self.separation_mode not in ('stft', 'full'):
+            raise ValueError(f"Unknown separation mode: {self.separation_mode}")
         self.user_id = None
         self.output_dir = None
+        self.context = None
+        self.features = None
+        self._features_df = None
         # Store computed features to avoid recalculation
         self._feature_cache = {}
 
     def load_data(self, y, sr, user_id=None):
-        self.y = y
-        self.sr = sr
-        self.user_id = user_id
-        self._setup_output_dir()
-        # Clear cache when loading new data
-        self._feature_cache = {}
-        self.feature_extract()
+        self.load_context(AudioAnalysisContext(y=y, sr=sr), user_id=user_id)
 
     def load_file(self, filename, user_id=None):
-        # Use res_type='kaiser_fast' for faster loading with slight quality reduction
-        self.y, self.sr = librosa.load(filename, res_type='kaiser_fast')
+        self.load_context(AudioAnalysisContext(filename), user_id=user_id)
+
+    def load_context(self, context, user_id=None, extract=True):
+        """
+        Extract features from an already decoded AudioAnalysisContext.
+
+        With extract=False the context is only bound, e.g. to draw its plots.
+        """
+        self._bind(context)
         self.user_id = user_id
         self._setup_output_dir()
-        # Clear cache when loading new file
-        self._feature_cache = {}
-        self.feature_extract()
+        if extract:
+            self.feature_extract()
+
+    def _bind(self, context):
+        self.context = context
+        self.y = context.y
+        self.sr = context.sr
+        # Share the context's cache so features computed by other analyzers
+        # on the same request (STFT, mel, HPSS...) are reused
+        self._feature_cache = context.cache
         
     def _setup_output_dir(self):
         if self.user_id:
@@ -75,172 +121,213 @@ class DataExtractor:
         else:
             self.output_dir = self.base_output_dir
 
-    @lru_cache(maxsize=1)
+    def _separation_frames(self):
+        """STFT frame range [start, stop) of the excerpt used for separation"""
+        n_frames = 1 + len(self.y) // self.context.hop_length
+        if not self.separation_excerpt:
+            return 0, n_frames
+        excerpt_frames = int(self.separation_excerpt * self.sr) // self.context.hop_length
+        if excerpt_frames >= n_frames:
+            return 0, n_frames
+        start = (n_frames - excerpt_frames) // 2
+        return start, start + excerpt_frames
+
+    def _separation_key(self):
+        return f'{self.separation_mode}_{self.separation_excerpt}_{self.separation_kernel}'
+
     def _get_harmonic_percussive(self):
         """Cache harmonic and percussive separation which is computationally expensive"""
-        return librosa.effects.hpss(self.y)
+        key = f'hpss_{self._separation_key()}'
+        if key in self._feature_cache:
+            return self._feature_cache[key]
+
+        start, stop = self._separation_frames()
+        hop_length = self.context.hop_length
+        whole_track = start == 0 and stop == 1 + len(self.y) // hop_length
+
+        if self.separation_mode == 'full':
+            y = self.y if whole_track else self.y[start * hop_length:stop * hop_length]
+            with timed('hpss'):
+                separated = librosa.effects.hpss(y, kernel_size=self.separation_kernel)
+        else:
+            # Median-filter masks on the shared STFT, then invert only the
+            # excerpt's frames back to the time domain
+            D = self.context.complex_stft()[:, start:stop]
+            with timed('hpss'):
+                D_harmonic, D_percussive = librosa.decompose.hpss(D, kernel_size=self.separation_kernel)
+                length = len(self.y) if whole_track else (stop - start) * hop_length
+                separated = tuple(
+                    librosa.istft(D_part, hop_length=hop_length, n_fft=self.context.n_fft,
+                                  length=length, dtype=self.y.dtype)
+                    for D_part in (D_harmonic, D_percussive)
+                )
+
+        self._feature_cache[key] = separated
+        return separated
         
+    def _cache_key(self):
+        return FeatureCache.feature_key(
+            self.context.content_hash,
+            n_mfcc=self.n_mfcc,
+            sr=self.sr,
+            n_fft=self.context.n_fft,
+            hop_length=self.context.hop_length,
+            separation_mode=self.separation_mode,
+            separation_excerpt=self.separation_excerpt,
+            separation_kernel=self.separation_kernel,
+            streamed=self.context.truncated
+        )
+
+    @timed('features')
     def feature_extract(self):
-        features_list = {}
-        
-        # Compute tempo information (using hop_length for faster processing)
-        tempo = librosa.beat.tempo(y=self.y, sr=self.sr, hop_length=512)[0]
-        features_list['tempo'] = [tempo, tempo, tempo, 0]  # Min, mean, max, var
+        # Reuse features extracted earlier from the same audio content;
+        # this skips HPSS and every spectral feature on repeat analyses
+        cache_key = self._cache_key()
+        with timed('feature_cache'):
+            cached = FeatureCache.load(cache_key)
+        if cached is not None:
+            self.tempo = float(cached['tempo'])
+            self.features = cached['features'].astype(np.float32)
+            self._features_df = None
+            return
+
+        # One row of (min, mean, max, var) per feature, written in place
+        features = np.empty((len(feature_names(self.n_mfcc)), 4), dtype=np.float32)
         
+        if self.context.truncated:
+            # Long file: only its head was decoded, stream the whole track
+            self._extract_streaming(features)
+        else:
+            self._extract_in_memory(features)
+
+        self.features = features
+        self._features_df = None
+
+        FeatureCache.store(cache_key, features=features, tempo=np.float64(self.tempo))
+
+    def _separation_features(self, features):
+        """Fill the harmonic, percussive and tonnetz rows"""
         # Get harmonic and percussive components (cached)
         self.y_harmonic, self.y_percussive = self._get_harmonic_percussive()
+        _reduce_into(self.y_harmonic, features[1])
+        _reduce_into(self.y_percussive, features[2])
         
-        # Calculate basic stats using numpy's vectorized operations (faster than individual calls)
-        features_list['y_harmoic'] = [
-            np.min(self.y_harmonic), 
-            np.mean(self.y_harmonic), 
-            np.max(self.y_harmonic), 
-            np.var(self.y_harmonic)
-        ]
-        
-        features_list['y_percussive'] = [
-            np.min(self.y_percussive), 
-            np.mean(self.y_percussive), 
-            np.max(self.y_percussive), 
-            np.var(self.y_percussive)
-        ]
-        
-        # Use faster hop_length for spectral features
-        hop_length = 512
-        
-        # Compute tonnetz only if needed
-        if 'tonnetz' not in self._feature_cache:
-            self._feature_cache['tonnetz'] = librosa.feature.tonnetz(
-                y=self.y_harmonic, sr=self.sr, hop_length=hop_length
-            )
-        self.tonnetz = self._feature_cache['tonnetz']
-        features_list['tonnetz'] = [
-            np.min(self.tonnetz), 
-            np.mean(self.tonnetz), 
-            np.max(self.tonnetz), 
-            np.var(self.tonnetz)
-        ]
-
-        # Compute chroma features with reduced complexity
-        if 'cstft' not in self._feature_cache:
-            self._feature_cache['cstft'] = librosa.feature.chroma_stft(
-                y=self.y, sr=self.sr, hop_length=hop_length, n_fft=2048
-            )
-        cstft = self._feature_cache['cstft']
-        features_list['cstft'] = [np.min(cstft), np.mean(cstft), np.max(cstft), np.var(cstft)]
-
-        # Use vectorized operations for RMS
-        if 'srms' not in self._feature_cache:
-            self._feature_cache['srms'] = librosa.feature.rms(y=self.y, hop_length=hop_length)
-        srms = self._feature_cache['srms']
-        features_list['srms'] = [np.min(srms), np.mean(srms), np.max(srms), np.var(srms)]
-
-        # Use a single STFT computation for multiple spectral features
-        if 'stft' not in self._feature_cache:
-            self._feature_cache['stft'] = np.abs(librosa.stft(self.y, hop_length=hop_length, n_fft=2048))
-        
-        # Reuse STFT for spectral features
-        stft = self._feature_cache['stft']
-        
-        if 'specband' not in self._feature_cache:
-            self._feature_cache['specband'] = librosa.feature.spectral_bandwidth(
-                S=stft, sr=self.sr, hop_length=hop_length
-            )
-        specband = self._feature_cache['specband']
-        features_list['specband'] = [np.min(specband), np.mean(specband), np.max(specband), np.var(specband)]
-
-        if 'speccent' not in self._feature_cache:
-            self._feature_cache['speccent'] = librosa.feature.spectral_centroid(
-                S=stft, sr=self.sr, hop_length=hop_length
+        # Compute tonnetz only if needed (it depends on the separation settings)
+        tonnetz_key = f'tonnetz_{self._separation_key()}'
+        if tonnetz_key not in self._feature_cache:
+            with timed('tonnetz'):
+                self._feature_cache[tonnetz_key] = librosa.feature.tonnetz(
+                    y=self.y_harmonic, sr=self.sr, hop_length=self.context.hop_length
+                )
+        self.tonnetz = self._feature_cache[tonnetz_key]
+        _reduce_into(self.tonnetz, features[3])
+
+    def _extract_streaming(self, features):
+        """Fill the feature rows from a constant-memory block-by-block pass over the file"""
+        excerpt_seconds = self.separation_excerpt or SEPARATION_EXCERPT_SECONDS or 120
+        with timed('stream_features'):
+            streamed = StreamingExtractor.stream_features(
+                self.context.path,
+                sr=self.sr,
+                n_fft=self.context.n_fft,
+                hop_length=self.context.hop_length,
+                n_mfcc=self.n_mfcc,
+                excerpt_seconds=excerpt_seconds
             )
-        speccent = self._feature_cache['speccent']
-        features_list['speccent'] = [np.min(speccent), np.mean(speccent), np.max(speccent), np.var(speccent)]
 
-        if 'rolloff' not in self._feature_cache:
-            self._feature_cache['rolloff'] = librosa.feature.spectral_rolloff(
-                S=stft, sr=self.sr, hop_length=hop_length
-            )
-        rolloff = self._feature_cache['rolloff']
-        features_list['rolloff'] = [np.min(rolloff), np.mean(rolloff), np.max(rolloff), np.var(rolloff)]
+        self.tempo = tempo = streamed['tempo']
+        features[0] = (tempo, tempo, tempo, 0)  # Min, mean, max, var
 
-        # Optimize zero crossing rate calculation
-        if 'zero_crossing_rate' not in self._feature_cache:
-            self._feature_cache['zero_crossing_rate'] = librosa.feature.zero_crossing_rate(
-                y=self.y, hop_length=hop_length
-            )
-        zero_crossing_rate = self._feature_cache['zero_crossing_rate']
-        features_list['zero_crossing_rate'] = [
-            np.min(zero_crossing_rate), 
-            np.mean(zero_crossing_rate), 
-            np.max(zero_crossing_rate), 
-            np.var(zero_crossing_rate)
-        ]
-
-        # Compute MFCC with optimized parameters
-        if 'mfcc' not in self._feature_cache:
-            self._feature_cache['mfcc'] = librosa.feature.mfcc(
-                y=self.y, sr=self.sr, n_mfcc=self.n_mfcc, 
-                hop_length=hop_length, n_fft=2048
-            )
-        mfcc = self._feature_cache['mfcc']
+        # Separation and tonnetz need long-range context; they run in memory
+        # on the middle excerpt captured during streaming
+        excerpt = DataExtractor(
+            n_mfcc=self.n_mfcc,
+            separation_mode=self.separation_mode,
+            separation_excerpt=0,
+            separation_kernel=self.separation_kernel
+        )
+        excerpt._bind(AudioAnalysisContext(y=streamed['excerpt'], sr=self.sr))
+        excerpt._separation_features(features)
+        self.y_harmonic, self.y_percussive = excerpt.y_harmonic, excerpt.y_percussive
+        self.tonnetz = excerpt.tonnetz
+        # Plots of the separation show the analysed excerpt
+        self._feature_cache[f'hpss_{self._separation_key()}'] = (self.y_harmonic, self.y_percussive)
+
+        features[4] = streamed['stats']['cstft'][0]
+        features[5:10] = streamed['stats']['frame_features']
+        features[10:] = streamed['stats']['mfcc']
+
+    def _extract_in_memory(self, features):
+        """Fill the feature rows from the fully decoded signal"""
+        # Compute tempo information from the shared onset envelope
+        if 'tempo' not in self._feature_cache:
+            with timed('tempo'):
+                self._feature_cache['tempo'] = self.context.tempo()
+        self.tempo = tempo = self._feature_cache['tempo']
+        features[0] = (tempo, tempo, tempo, 0)  # Min, mean, max, var
+        
+        self._separation_features(features)
         
-        # Vectorized approach for MFCC features
-        for i in range(self.n_mfcc):
-            features_list[f'mfcc_{i}'] = [
-                np.min(mfcc[i]), 
-                np.mean(mfcc[i]), 
-                np.max(mfcc[i]), 
-                np.var(mfcc[i])
-            ]
-
-        # Create dataframe once at the end
-        self.features_df = pd.DataFrame(features_list).transpose()
-        self.features_df.columns = ['min', 'mean', 'max', 'var']
+        # Use faster hop_length for spectral features
+        hop_length = self.context.hop_length
+
+        # Chroma is computed from the shared power spectrogram
+        with timed('chroma'):
+            _reduce_into(self.context.chroma(), features[4])
+
+        # Frame-level features that share one time axis are stacked into a
+        # (5, frames) matrix and reduced along it in a single pass each
+        if 'frame_features' not in self._feature_cache:
+            # Reuse the context's single STFT for spectral features
+            with timed('spectral'):
+                stft = self.context.stft()
+                self._feature_cache['frame_features'] = np.vstack([
+                    librosa.feature.rms(y=self.y, hop_length=hop_length),
+                    librosa.feature.spectral_bandwidth(S=stft, sr=self.sr, hop_length=hop_length),
+                    librosa.feature.spectral_centroid(S=stft, sr=self.sr, hop_length=hop_length),
+                    librosa.feature.spectral_rolloff(S=stft, sr=self.sr, hop_length=hop_length),
+                    librosa.feature.zero_crossing_rate(y=self.y, hop_length=hop_length),
+                ])
+        _reduce_rows_into(self._feature_cache['frame_features'], features[5:10])
+
+        # MFCCs reuse the context's mel spectrogram; one reduction per statistic
+        with timed('mfcc'):
+            _reduce_rows_into(self.context.mfcc(n_mfcc=self.n_mfcc), features[10:])
+
+    @property
+    def features_df(self):
+        """Features as a labelled DataFrame, built on first access only"""
+        if self._features_df is None:
+            import pandas as pd
+            self._features_df = pd.DataFrame(
+                self.features,
+                index=feature_names(self.n_mfcc),
+                columns=['min', 'mean', 'max', 'var']
+            )
+        return self._features_df
 
     def get_data(self, data_print=False):
         # Print the data if requested
         if data_print:
             self.print_features()
 
-        # Vectorized reshape
-        np_data = self.features_df.to_numpy().reshape((120, 1))
-        return np_data
+        # Feature rows flattened to a (120, 1) column
+        return self.features.reshape((-1, 1))
 
     def print_features(self):
         print(f"Tempo: {self.tempo}")
         print(self.features_df)
 
-    def save_waveform(self, dpi=100):
-        # Generate output path
-        output_path = os.path.join(self.output_dir, 'waveform.png')
-        
-        # Plot with reduced dpi for faster saving
-        plt.figure(figsize=(14, 5))
-        librosa.display.waveshow(y=self.y, sr=self.sr)
-        plt.title("Waveform")
-        plt.tight_layout()
-        plt.savefig(output_path, dpi=dpi)
-        plt.close()
-        
-        return output_path
+    def plot_waveform(self, dpi=100):
+        """Queue the waveform plot in the render processes; returns a Future of the cached PNG path"""
+        return PlotRenderer.submit_waveform(self.context.content_hash, self.y, self.sr, dpi=dpi)
 
-    def save_harmonic_percussive(self, dpi=100):
-        # Generate output path
-        output_path = os.path.join(self.output_dir, 'harmonic_percussive.png')
-        
-        # Plot with reduced dpi for faster saving
-        fig = plt.figure(figsize=(14, 5))
-        ax1 = fig.add_subplot(111)
-        ax2 = ax1.twinx()
-
-        librosa.display.waveshow(self.y_harmonic, sr=self.sr, color='r', alpha=0.5, ax=ax1)
-        librosa.display.waveshow(self.y_percussive, sr=self.sr, color='b', alpha=0.5, ax=ax2)
-        ax1.set_title("Harmonic (red) and Percussive (blue) Components")
-        plt.tight_layout()
-        plt.savefig(output_path, dpi=dpi)
-        plt.close()
-        
-        return output_path
+    def plot_harmonic_percussive(self, dpi=100):
+        """Queue the harmonic/percussive plot; returns a Future of the cached PNG path"""
+        # Separation is computed here if the features came from the cache
+        y_harmonic, y_percussive = self._get_harmonic_percussive()
+        return PlotRenderer.submit_harmonic_percussive(self.context.content_hash, y_harmonic, y_percussive,
+                                                       self.sr, dpi=dpi)
 
 class InstrumentClassifier(nn.Module):
     def __init__(self, input_shape, num_classes):
@@ -283,96 +370,89 @@ class InstrumentClassifier(nn.Module):
     
 
 #it needs the  path to the audio file to be analysed
-def AnalyseGenre(path):
-    modelnum=-1
-    for i in range(len(GenreBusy)):
-        if(not GenreBusy[i]):
-            modelnum=i
-            break
-    
-    if(modelnum==-1):
-        return modelnum
-    
-    GenreBusy[modelnum]=1
-
+def AnalyseGenre(path, context=None):
     Extractor=DataExtractor()
-    Extractor.load_file(path)
-    Extractor.feature_extract()
+    Extractor.load_context(context or AudioAnalysisContext(path))
     features=Extractor.get_data()
     features=features.reshape(1,120)
-    genre=GenreModels[modelnum].predict(features)
-    GenreBusy[modelnum]=0
-    return GenreDict[genre[0]]
 
-def AnalyseInstrument(path):
+    try:
+        with GenreModelPool.acquire() as GenreModel:
+            genre=GenreModel.predict(features)
+    except PoolTimeout:
+        return -1
+    return GenreDict[genre[0]]
 
-    modelnum=-1
-    for i in range(len(InstrumentBusy)):
-        if(not InstrumentBusy[i]):
-            modelnum=i
-            break
-    
-    if(modelnum==-1):
-        return modelnum
-    
-    InstrumentBusy[modelnum]=1
-    
-    y,sr=librosa.load(path,duration=5)
-    mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128)
-    log_mel_spec = librosa.power_to_db(mel_spec)
-    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+def AnalyseInstrument(path, context=None):
+    context=context or AudioAnalysisContext(path)
+    log_mel_spec = librosa.power_to_db(context.melspectrogram(duration=5))
+    mfccs = context.mfcc(duration=5, n_mfcc=13)
     instrumentdata = torch.tensor(np.concatenate([log_mel_spec, mfccs], axis=0), dtype=torch.float32).unsqueeze(0)
 
+    try:
+        with InstrumentModelPool.acquire() as InstrumentModel:
+            output=InstrumentModel(instrumentdata).detach().cpu().numpy()[0]
+    except PoolTimeout:
+        return -1
+
     max=0
     maxval=0
-    for i,value in enumerate((InstrumentModels[modelnum])(instrumentdata).detach().cpu().numpy()[0]):
+    for i,value in enumerate(output):
         if(value>maxval):
             maxval=value
             max=i
 
     return InstrumentDict[max]
 
-def AnalyseKeyTempo(path):
-    y,sr=librosa.load(path,duration=10)
+def AnalyseKeyTempo(path, context=None):
+    context=context or AudioAnalysisContext(path)
 
-    chromagram = librosa.feature.chroma_stft(y=y, sr=sr)
+    chromagram = context.chroma(duration=10)
     mean_chroma = np.mean(chromagram, axis=1)
     estimated_key_index = np.argmax(mean_chroma)
     estimated_key = chroma_to_key[estimated_key_index]
 
-    return librosa.feature.tempo(y=y,sr=sr)[0].round(),estimated_key
+    return context.tempo(duration=10).round(),estimated_key
     
 def AnalyseMusic(path):
-    genre=AnalyseGenre(path)
-    instrument=AnalyseInstrument(path)
-    tempo,key=AnalyseKeyTempo(path)
+    # Decode once and share the spectrogram between all analyses
+    context=AudioAnalysisContext(path)
+    genre=AnalyseGenre(path, context)
+    instrument=AnalyseInstrument(path, context)
+    tempo,key=AnalyseKeyTempo(path, context)
 
     return [genre,instrument,key,tempo]
 
 def InitializeModels(num):
-    global Models,Busy
+    if LIMIT_TORCH_THREADS:
+        torch.set_num_threads(INFERENCE_THREADS)
 
-    for i in range(num):
-        GenreModel=XGBClassifier()  
+    # Shared pools only ever need a single instance
+    for i in range(GenreModelPool.target_size(num)-GenreModelPool.size):
+        GenreModel=XGBClassifier(n_jobs=INFERENCE_THREADS)  
         GenreModel.load_model("server/models/GenreModel.json")
-        GenreModels.append(GenreModel)
-        GenreBusy.append(0)
+        GenreModelPool.add(GenreModel)
         
+    for i in range(InstrumentModelPool.target_size(num)-InstrumentModelPool.size):
         InstrumentModel=InstrumentClassifier((141, 216),5)
-        InstrumentModel.load_state_dict(torch.load("server/models/InstrumentModel.pth"))
-        InstrumentModels.append(InstrumentModel)
-        InstrumentBusy.append(0)
+        InstrumentModel.load_state_dict(torch.load("server/models/InstrumentModel.pth", map_location='cpu'))
+        InstrumentModel.eval()
+        InstrumentModelPool.add(InstrumentModel)
 
 
 def GenerateMusic(prompt,duration,username):
+    # Shares the single MusicGen instance loaded by MusicGenerator
+    from MusicGenerator import musicgen, precision_context
+    processor, model = musicgen()
     inputs = processor(
     text=prompt,
     padding=True,
     return_tensors="pt",
     )
 
-    audio_values = model.generate(**inputs, max_new_tokens=int(256*(duration/5)))
+    with precision_context(model):
+        audio_values = model.generate(**inputs, max_new_tokens=int(256*(duration/5)))
 
     sampling_rate = model.config.audio_encoder.sampling_rate
 
-    scipy.io.wavfile.write("out/{name}.mp3".format(name=username), rate=sampling_rate, data=audio_values[0, 0].numpy())
\ No newline at end of file
+    scipy.io.wavfile.write("out/{name}.mp3".format(name=username), rate=sampling_rate, data=audio_values[0, 0].float().numpy())
\ No newline at end of file
@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+import tempfile
+import logging
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('DiskCache')
+
+# Root directory for all on-disk caches
+CACHE_ROOT = os.environ.get(
+    'CACHE_ROOT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+)
+
+# Caches are shared by every process using the same directory, so each
+# process re-counts the directory at least this often (seconds) to see
+# the others' writes
+DISK_CACHE_RESCAN_SECONDS = float(os.environ.get('DISK_CACHE_RESCAN_SECONDS', '60'))
+
+# Every cache created in this process, for stats reporting
+_caches = []
+_caches_lock = threading.Lock()
+
+
+class DiskLRUCache:
+    """
+    Content-addressed file store with least-recently-used size eviction.
+
+    Entries are files named after their key (sharded by the first two
+    characters). Writes go to a temporary file that is renamed into place,
+    so readers never see partial entries. Hits refresh the file's mtime,
+    which is what eviction orders by, so the cache survives restarts.
+    """
+
+    def __init__(self, name, max_bytes, directory=None, suffix='', rescan_seconds=None):
+        """
+        Args:
+            name (str): Cache name used in logs, stats and the default directory
+            max_bytes (int): Total size above which the oldest entries are evicted
+            directory (str): Where entries are stored; defaults to CACHE_ROOT/name
+            suffix (str): File extension appended to every entry
+            rescan_seconds (float): How often writes re-count the directory;
+                defaults to DISK_CACHE_RESCAN_SECONDS
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self.directory = directory or os.path.join(CACHE_ROOT, name)
+        self.suffix = suffix
+        self.rescan_seconds = DISK_CACHE_RESCAN_SECONDS if rescan_seconds is None else rescan_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._total_bytes = self._scan_size()
+        self._scanned_at = time.monotonic()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        with _caches_lock:
+            _caches.append(self)
+
+    def _scan_entries(self):
+        """(mtime, size, path) of every committed entry on disk"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if '.tmp' in filename:
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._scan_entries())
+
+    def path_for(self, key):
+        """Path where the entry for `key` lives (whether or not it exists)"""
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get_path(self, key):
+        """
+        Look up an entry.
+
+        Returns:
+            str or None: Path to the cached file, or None on a miss
+        """
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+        with self._lock:
+            self._stats['hits'] += 1
+        return path
+
+    @contextmanager
+    def writer(self, key):
+        """
+        Context manager yielding a temporary path to write the entry to.
+
+        The file is moved into place when the block exits without an error
+        and discarded otherwise.
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp' + self.suffix)
+        os.close(fd)
+        try:
+            yield tmp_path
+            self._commit(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def put_bytes(self, key, data):
+        """Store raw bytes under `key` and return the entry path"""
+        with self.writer(key) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        return self.path_for(key)
+
+    def _commit(self, tmp_path, path):
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            try:
+                self._total_bytes -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._total_bytes += size
+            self._stats['writes'] += 1
+            if time.monotonic() - self._scanned_at >= self.rescan_seconds:
+                # Pick up entries written and evicted by other processes
+                self._total_bytes = self._scan_size()
+                self._scanned_at = time.monotonic()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits. Caller holds the lock."""
+        entries = self._scan_entries()
+        # The walk sees every process's entries, so it is the true size
+        self._total_bytes = sum(size for _, size, _ in entries)
+        self._scanned_at = time.monotonic()
+
+        entries.sort()
+        # Evict down to 90% so we don't rescan on every write near the limit
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, path in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                os.unlink(path)
+                self._total_bytes -= size
+                self._stats['evictions'] += 1
+                evicted += 1
+            except FileNotFoundError:
+                # Already evicted by another process
+                self._total_bytes -= size
+            except OSError:
+                pass
+        if evicted:
+            logger.info(f"Evicted {self.name} cache down to {self._total_bytes / 1e6:.1f} MB")
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'name': self.name,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            })
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+def all_cache_stats():
+    """Stats for every DiskLRUCache in this process, keyed by cache name"""
+    with _caches_lock:
+        caches = list(_caches)
+    return {cache.name: cache.stats() for cache in caches}
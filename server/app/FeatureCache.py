@@ -0,0 +1,66 @@
+import os
+import hashlib
+import logging
+import numpy as np
+import librosa
+from DiskCache import DiskLRUCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('FeatureCache')
+
+FEATURE_CACHE_ENABLED = os.environ.get('FEATURE_CACHE', '1') == '1'
+FEATURE_CACHE_MAX_BYTES = int(os.environ.get('FEATURE_CACHE_MAX_MB', '256')) * 1024 * 1024
+# Bump when feature_extract changes in a way that alters its output
+FEATURE_VERSION = 2
+
+_store = DiskLRUCache('features', FEATURE_CACHE_MAX_BYTES, suffix='.npz')
+
+
+def feature_key(content_hash, **params):
+    """
+    Cache key for the features of some audio content.
+
+    Args:
+        content_hash (str): Hash of the audio bytes
+        **params: Extractor parameters that influence the output (n_mfcc, hop, n_fft...)
+
+    Returns:
+        str: Hex key combining the content hash, parameters and library versions
+    """
+    parts = [content_hash, f"v{FEATURE_VERSION}", f"librosa={librosa.__version__}"]
+    parts += [f"{name}={params[name]}" for name in sorted(params)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def load(key):
+    """
+    Fetch cached features.
+
+    Returns:
+        dict or None: Mapping of array name to np.ndarray, or None on a miss
+    """
+    if not FEATURE_CACHE_ENABLED:
+        return None
+    path = _store.get_path(key)
+    if path is None:
+        return None
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except Exception as e:
+        # Evicted between lookup and read, or a corrupt entry
+        logger.warning(f"Could not read cached features {key}: {str(e)}")
+        return None
+
+
+def store(key, **arrays):
+    """Persist named arrays under `key`"""
+    if not FEATURE_CACHE_ENABLED:
+        return
+    try:
+        with _store.writer(key) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+    except Exception as e:
+        logger.warning(f"Could not cache features {key}: {str(e)}")
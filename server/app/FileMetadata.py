@@ -0,0 +1,225 @@
+import os
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('FileMetadata')
+
+FILE_PAGE_SIZE = int(os.environ.get('FILE_PAGE_SIZE', '50'))
+FILE_PAGE_MAX = int(os.environ.get('FILE_PAGE_MAX', '200'))
+
+# Fields returned by the list endpoints
+LIST_PROJECTION = {'_id': 0, 'gridfs_id': 1, 'filename': 1, 'content_type': 1,
+                   'role': 1, 'uploaded_at': 1, 'created_at': 1}
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that was not produced by FileMetadataStore.page()"""
+
+
+class FileMetadataStore:
+    """
+    One document per stored audio file, in its own collection.
+
+    File references used to live in arrays on the user document, which grew
+    with every upload and had to be loaded and sorted in full to find the
+    latest file. Here every lookup is served by the compound index
+    (user_id, <time field>, _id): the latest file is a single indexed
+    find_one, and listings are keyset-paginated so a page costs the same
+    however many files the user has.
+    """
+
+    def __init__(self, collection, time_field):
+        """
+        Args:
+            collection (pymongo.collection.Collection): Collection holding the metadata
+            time_field (str): Timestamp the user's files are ordered by
+        """
+        self.collection = collection
+        self.time_field = time_field
+
+    def ensure_indexes(self):
+        """Create the indexes (a no-op when they already exist)"""
+        self.collection.create_index(
+            [('user_id', ASCENDING), (self.time_field, DESCENDING), ('_id', DESCENDING)],
+            name=f'user_id_{self.time_field}'
+        )
+        # One document per GridFS file; also makes the migration idempotent
+        self.collection.create_index('gridfs_id', unique=True, name='gridfs_id')
+
+    def add(self, user_id, gridfs_id, filename, content_type, **fields):
+        """
+        Record a file stored in GridFS.
+
+        Args:
+            user_id (str): Owner
+            gridfs_id (ObjectId): GridFS id of the file
+            filename (str): Stored filename
+            content_type (str): MIME type
+            **fields: Extra fields to store (role, file_path...); the time
+                field defaults to now
+
+        Returns:
+            dict: The stored document
+        """
+        doc = {
+            'user_id': user_id,
+            'gridfs_id': gridfs_id,
+            'filename': filename,
+            'content_type': content_type,
+        }
+        doc.update(fields)
+        doc.setdefault(self.time_field, datetime.utcnow())
+        self.collection.insert_one(doc)
+        return doc
+
+    def latest(self, user_id):
+        """Most recent file of the user, or None"""
+        return self.collection.find_one(
+            {'user_id': user_id},
+            sort=[(self.time_field, DESCENDING), ('_id', DESCENDING)]
+        )
+
+    def find(self, user_id, gridfs_id):
+        """The user's file with this GridFS id, or None if it is not theirs"""
+        return self.collection.find_one({'user_id': user_id, 'gridfs_id': gridfs_id})
+
+    def random(self, user_id):
+        """A random file of the user, or None"""
+        docs = list(self.collection.aggregate([
+            {'$match': {'user_id': user_id}},
+            {'$sample': {'size': 1}},
+        ]))
+        return docs[0] if docs else None
+
+    def all_for_user(self, user_id):
+        """Cursor over every file of the user (GridFS ids and filename only)"""
+        return self.collection.find({'user_id': user_id}, {'gridfs_id': 1, 'filename': 1, 'peaks.gridfs_id': 1})
+
+    def update(self, gridfs_id, fields, unless=None):
+        """
+        Set fields on a file's document.
+
+        Args:
+            gridfs_id (ObjectId): File to update
+            fields (dict): Field -> value, dotted paths allowed
+            unless (dict): Extra filter conditions, e.g. to skip documents
+                another writer already moved on
+
+        Returns:
+            bool: True if a document was updated
+        """
+        query = {'gridfs_id': gridfs_id}
+        if unless:
+            query.update({field: {'$ne': value} for field, value in unless.items()})
+        return self.collection.update_one(query, {'$set': fields}).matched_count > 0
+
+    def remove(self, user_id, gridfs_id):
+        """
+        Returns:
+            bool: True if the user owned a file with this id
+        """
+        return self.collection.delete_one({'user_id': user_id, 'gridfs_id': gridfs_id}).deleted_count > 0
+
+    def all(self, user_id):
+        """Every file of the user, newest first, for clients that don't paginate"""
+        return list(self.collection.find({'user_id': user_id}, LIST_PROJECTION)
+                    .sort([(self.time_field, DESCENDING), ('_id', DESCENDING)]))
+
+    def page(self, user_id, limit=None, cursor=None):
+        """
+        One page of the user's files, newest first.
+
+        Args:
+            user_id (str): Owner
+            limit (int): Page size, capped at FILE_PAGE_MAX
+            cursor (str): `next_cursor` of the previous page, or None for the first
+
+        Returns:
+            tuple: (files, next_cursor); next_cursor is None on the last page
+
+        Raises:
+            InvalidCursor: If the cursor cannot be decoded
+        """
+        limit = max(1, min(int(limit or FILE_PAGE_SIZE), FILE_PAGE_MAX))
+        query = {'user_id': user_id}
+        if cursor:
+            when, last_id = self._decode_cursor(cursor)
+            query['$or'] = [
+                {self.time_field: {'$lt': when}},
+                {self.time_field: when, '_id': {'$lt': last_id}},
+            ]
+
+        # _id is needed for the cursor and dropped from the response
+        projection = dict(LIST_PROJECTION, _id=1)
+        # One extra document tells whether there is a next page
+        docs = list(self.collection.find(query, projection)
+                    .sort([(self.time_field, DESCENDING), ('_id', DESCENDING)])
+                    .limit(limit + 1))
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            last = docs[-1]
+            next_cursor = f"{last[self.time_field].isoformat()}_{last['_id']}"
+        for doc in docs:
+            del doc['_id']
+        return docs, next_cursor
+
+    def _decode_cursor(self, cursor):
+        try:
+            when, last_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(when), ObjectId(last_id)
+        except Exception:
+            raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+
+def migrate_embedded_files(users, stores, unset=False):
+    """
+    Copy the file arrays embedded in user documents into metadata collections.
+
+    Safe to re-run: files already present (by GridFS id) are left untouched.
+
+    Args:
+        users (pymongo.collection.Collection): The users collection
+        stores (dict): Embedded array name -> FileMetadataStore
+        unset (bool): Remove the arrays from the user documents afterwards
+
+    Returns:
+        dict: Number of files copied per array
+    """
+    copied = {field: 0 for field in stores}
+    for store in stores.values():
+        store.ensure_indexes()
+
+    query = {'$or': [{field: {'$exists': True}} for field in stores]}
+    projection = {'id': 1, **{field: 1 for field in stores}}
+    for user in users.find(query, projection):
+        for field, store in stores.items():
+            for entry in user.get(field) or []:
+                gridfs_id = entry.get('gridfs_id')
+                if gridfs_id is None:
+                    continue
+                doc = dict(entry, user_id=user['id'])
+                if not doc.get(store.time_field):
+                    # The id's creation time is the best remaining estimate
+                    doc[store.time_field] = ObjectId(gridfs_id).generation_time.replace(tzinfo=None)
+                try:
+                    result = store.collection.update_one(
+                        {'gridfs_id': gridfs_id}, {'$setOnInsert': doc}, upsert=True
+                    )
+                except DuplicateKeyError:
+                    # Inserted concurrently (e.g. by the app during the migration)
+                    continue
+                if result.upserted_id is not None:
+                    copied[field] += 1
+
+        if unset:
+            users.update_one({'_id': user['_id']}, {'$unset': {field: '' for field in stores}})
+
+    logger.info(f"Migrated embedded file metadata: {copied}")
+    return copied
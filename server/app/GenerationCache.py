@@ -0,0 +1,126 @@
+import os
+import re
+import shutil
+import hashlib
+import logging
+import numpy as np
+from DiskCache import DiskLRUCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('GenerationCache')
+
+GENERATION_CACHE_ENABLED = os.environ.get('GENERATION_CACHE', '1') == '1'
+GENERATION_CACHE_MAX_BYTES = int(os.environ.get('GENERATION_CACHE_MAX_MB', '1024')) * 1024 * 1024
+# EnCodec codes of clips being continued; a minute of int16 codes is about 25 KB
+AUDIO_CODES_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CODES_CACHE_MAX_MB', '64')) * 1024 * 1024
+
+_store = DiskLRUCache('generations', GENERATION_CACHE_MAX_BYTES, suffix='.wav')
+_codes_store = DiskLRUCache('audio_codes', AUDIO_CODES_CACHE_MAX_BYTES, suffix='.npy')
+
+
+def normalize_prompt(prompt):
+    """Lowercase and collapse whitespace so trivially different prompts share an entry"""
+    return re.sub(r'\s+', ' ', prompt.strip().lower())
+
+
+def generation_key(prompt, duration, model_name, seed=None, **sampling):
+    """
+    Cache key for one generated clip.
+
+    Args:
+        prompt (str): Text description of the music
+        duration (float): Requested duration in seconds
+        model_name (str): Checkpoint the audio was generated with
+        seed (int): Random seed, or None for unseeded generation
+        **sampling: Sampling parameters that influence the output (temperature, top_k...)
+
+    Returns:
+        str: Hex key
+    """
+    parts = [normalize_prompt(prompt), f"duration={float(duration):.3f}", f"model={model_name}", f"seed={seed}"]
+    parts += [f"{name}={sampling[name]}" for name in sorted(sampling)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def contains(key):
+    """True if a clip is cached under `key`; doesn't count as a hit or refresh it"""
+    return GENERATION_CACHE_ENABLED and os.path.exists(_store.path_for(key))
+
+
+def copy_to(key, output_path):
+    """
+    Place the cached clip for `key` at `output_path`.
+
+    A hard link is used when the cache and output share a filesystem,
+    otherwise the file is copied.
+
+    Returns:
+        bool: True on a hit
+    """
+    if not GENERATION_CACHE_ENABLED:
+        return False
+    path = _store.get_path(key)
+    if path is None:
+        return False
+    try:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        try:
+            os.link(path, output_path)
+        except OSError:
+            shutil.copyfile(path, output_path)
+        return True
+    except OSError as e:
+        # Evicted between lookup and copy
+        logger.warning(f"Could not copy cached generation {key}: {str(e)}")
+        return False
+
+
+def store(key, audio_path):
+    """Add a generated file to the cache under `key`"""
+    if not GENERATION_CACHE_ENABLED:
+        return
+    try:
+        with _store.writer(key) as tmp_path:
+            shutil.copyfile(audio_path, tmp_path)
+    except Exception as e:
+        logger.warning(f"Could not cache generation {key}: {str(e)}")
+
+
+def codes_key(clip_id, model_name, **params):
+    """Cache key for the audio codes of a stored clip (GridFS id) under one encoder setting"""
+    parts = [str(clip_id), f"model={model_name}"]
+    parts += [f"{name}={params[name]}" for name in sorted(params)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def load_codes(key):
+    """
+    Fetch cached audio codes.
+
+    Returns:
+        np.ndarray or None: (codebooks, frames) integer codes, or None on a miss
+    """
+    if not GENERATION_CACHE_ENABLED:
+        return None
+    path = _codes_store.get_path(key)
+    if path is None:
+        return None
+    try:
+        return np.load(path)
+    except Exception as e:
+        logger.warning(f"Could not read cached codes {key}: {str(e)}")
+        return None
+
+
+def store_codes(key, codes):
+    """Persist (codebooks, frames) audio codes under `key`"""
+    if not GENERATION_CACHE_ENABLED:
+        return
+    try:
+        with _codes_store.writer(key) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, codes)
+    except Exception as e:
+        logger.warning(f"Could not cache codes {key}: {str(e)}")
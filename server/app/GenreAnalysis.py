@@ -1,16 +1,24 @@
 import os
+import threading
 import numpy as np
 from xgboost import XGBClassifier
 from DataExtractor import DataExtractor
+from AnalysisContext import AudioAnalysisContext
+from ModelPool import ModelPool, PoolTimeout, INFERENCE_THREADS
+from BatchScheduler import BatchScheduler
+from ModelRegistry import Registry
+from concurrent.futures import Future
+from Metrics import timed
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('GenreAnalysis')
 
-# Global variables
-Models = []
-Busy = []
+# Pool of loaded genre models shared by all request threads
+ModelsPool = ModelPool('genre')
+# Serializes pool growth so concurrent first requests don't double-load
+_init_lock = threading.Lock()
 
 # Genre dictionary mapping
 GenreDict = {
@@ -27,67 +35,190 @@ GenreDict = {
     10: "Assamese"
 }
 
-def AnalyseGenre(path):
+def _ensure_models():
+    # Loads the pool on first use unless the warm-up thread already did
+    Registry.get('genre')
+
+def extract_genre_features(path, context=None):
     """
-    Analyze the genre of an audio file at the given path.
+    Extract the 120-dim genre feature row for one audio file.
     
     Args:
         path (str): Path to the audio file
+        context (AudioAnalysisContext): Already decoded audio for this file;
+            decoded from path if not given
         
     Returns:
-        str or int: Genre name if successful, -1 if no models are available
+        np.ndarray: float32 array of shape (120,)
+    """
+    Extractor = DataExtractor()
+    Extractor.load_context(context or AudioAnalysisContext(path))
+    return Extractor.get_data().reshape(120).astype(np.float32)
+
+def predict_genre_probabilities(features):
+    """
+    Predict class probabilities for a batch of feature rows in one call.
+    
+    Uses Booster.inplace_predict directly, skipping the sklearn wrapper and
+    DMatrix construction that dominate the cost of single-row predictions.
+    
+    Args:
+        features (np.ndarray): Array of shape (N, 120)
+        
+    Returns:
+        np.ndarray: Array of shape (N, len(GenreDict)) with class probabilities
+        
+    Raises:
+        PoolTimeout: If no model became available within the pool timeout
+    """
+    _ensure_models()
+    features = np.ascontiguousarray(features, dtype=np.float32).reshape(-1, 120)
+    with ModelsPool.acquire() as model, timed('xgboost'):
+        probabilities = model.get_booster().inplace_predict(features)
+    return np.asarray(probabilities).reshape(len(features), len(GenreDict))
+
+def _genre_result(probabilities):
+    genre_index = int(np.argmax(probabilities))
+    return {
+        'genre': GenreDict[genre_index],
+        'probabilities': {GenreDict[i]: float(p) for i, p in enumerate(probabilities)}
+    }
+
+def _run_genre_batch(rows):
+    return list(predict_genre_probabilities(np.stack(rows)))
+
+# Coalesces single-file predictions from concurrent requests into one
+# inplace_predict call per batch
+GENRE_MAX_BATCH = int(os.environ.get('GENRE_MAX_BATCH', '64'))
+GENRE_MAX_WAIT_MS = float(os.environ.get('GENRE_MAX_WAIT_MS', '5'))
+GenreBatcher = BatchScheduler(
+    'genre',
+    _run_genre_batch,
+    max_batch=GENRE_MAX_BATCH,
+    max_wait_ms=GENRE_MAX_WAIT_MS
+)
+
+def submit_genre(path, context=None):
+    """
+    Queue-backed genre prediction for one file.
+    
+    Features are extracted on the calling thread; the model call is batched
+    with other queued requests.
+    
+    Returns:
+        concurrent.futures.Future: Resolves to a dict with 'genre' and 'probabilities'
     """
-    # Check if models are initialized
-    if len(Models) == 0:
-        logger.error("Models not initialized. Initializing now...")
-        InitializeModels(5)  # Initialize with 5 models
+    features = extract_genre_features(path, context)
+    future = GenreBatcher.submit(features)
+    result = Future()
     
-    modelnum = -1
-    for i in range(len(Busy)):
-        if not Busy[i]:
-            modelnum = i
-            break
+    def _done(batch_future):
+        try:
+            result.set_result(_genre_result(batch_future.result()))
+        except Exception as e:
+            result.set_exception(e)
     
-    if modelnum == -1:
-        logger.warning("No available models to process genre")
-        return modelnum
+    future.add_done_callback(_done)
+    return result
+
+def predict_genre(path, context=None):
+    """
+    Predict the genre of one audio file with full class probabilities.
     
-    try:
-        Busy[modelnum] = 1
-        logger.info(f"Using model {modelnum} to analyze file: {path}")
+    Returns:
+        dict: 'genre' (top genre name) and 'probabilities' (genre name -> probability)
         
-        Extractor = DataExtractor()
-        Extractor.load_file(path)
-        Extractor.feature_extract()
-        features = Extractor.get_data()
-        features = features.reshape(1, 120)
-        logger.info(f"Extracted features with shape: {features.shape}")
+    Raises:
+        PoolTimeout: If no model became available within the pool timeout
+    """
+    return submit_genre(path, context).result()
+
+def predict_genres(paths, batch_size=GENRE_MAX_BATCH):
+    """
+    Predict genres for many audio files, e.g. when re-tagging a catalogue.
+    
+    Feature rows are stacked and sent to the model `batch_size` at a time.
+    
+    Args:
+        paths (list): Paths to the audio files
+        batch_size (int): Rows per inplace_predict call
         
-        genre = Models[modelnum].predict(features)
-        logger.info(f"Predicted genre index: {genre[0]}")
+    Returns:
+        list: One dict per path, in order, containing:
+            - path: the input path
+            - status: 'success' or 'error'
+            - genre / probabilities on success, error on failure
+    """
+    results = []
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        rows = []
+        row_indices = []
+        chunk_results = [None] * len(chunk)
+        
+        for i, path in enumerate(chunk):
+            try:
+                rows.append(extract_genre_features(path))
+                row_indices.append(i)
+            except Exception as e:
+                logger.error(f"Error extracting genre features from {path}: {str(e)}")
+                chunk_results[i] = {'path': path, 'status': 'error', 'error': str(e)}
+        
+        if rows:
+            probabilities = predict_genre_probabilities(np.stack(rows))
+            for i, row in zip(row_indices, probabilities):
+                chunk_results[i] = {'path': chunk[i], 'status': 'success', **_genre_result(row)}
+        
+        results.extend(chunk_results)
+        logger.info(f"Predicted genres for {len(results)}/{len(paths)} files")
+    
+    return results
+
+def AnalyseGenre(path, context=None):
+    """
+    Analyze the genre of an audio file at the given path.
+    
+    Args:
+        path (str): Path to the audio file
+        context (AudioAnalysisContext): Already decoded audio for this file;
+            decoded from path if not given
         
-        Busy[modelnum] = 0
-        return GenreDict[genre[0]]
+    Returns:
+        str or int: Genre name if successful, -1 if no model became available
+            within the pool timeout
+    """
+    try:
+        result = predict_genre(path, context)
+        logger.info(f"Predicted genre: {result['genre']}")
+        return result['genre']
+    
+    except PoolTimeout as e:
+        logger.warning(f"No available models to process genre: {str(e)}")
+        return -1
     
     except Exception as e:
         logger.error(f"Error in genre analysis: {str(e)}")
-        Busy[modelnum] = 0  # Make sure to release the model
         raise
 
 def InitializeModels(num):
     """
-    Initialize multiple XGBoost models for genre classification.
+    Grow the genre model pool to `num` XGBoost models.
+    
+    Models already in the pool (possibly in use by other threads) are kept,
+    so calling this again never disturbs running requests. In shared mode a
+    single instance is loaded regardless of `num`.
     
     Args:
-        num (int): Number of models to initialize
+        num (int): Number of models the pool should hold
     """
-    global Models, Busy
-    
-    # Clear existing models if any
-    Models = []
-    Busy = []
+    with _init_lock:
+        _load_models(ModelsPool.target_size(num) - ModelsPool.size)
+
+def _load_models(missing):
+    if missing <= 0:
+        return
     
-    logger.info(f"Initializing {num} genre classification models")
+    logger.info(f"Initializing {missing} genre classification models")
     
     # Get correct path to model file
     # Assuming the model is in the 'models' directory at the same level as 'app'
@@ -112,21 +243,22 @@ def InitializeModels(num):
         else:
             raise FileNotFoundError(f"Model file not found at: {model_path} or {alternative_path}")
     
-    for i in range(num):
+    for i in range(missing):
         try:
-            GenreModel = XGBClassifier()
+            GenreModel = XGBClassifier(n_jobs=INFERENCE_THREADS)
             GenreModel.load_model(model_path)
-            Models.append(GenreModel)
-            Busy.append(0)
+            # inplace_predict bypasses the wrapper's n_jobs, so set it on the booster
+            GenreModel.get_booster().set_param({'nthread': INFERENCE_THREADS})
+            ModelsPool.add(GenreModel)
             logger.info(f"Model {i} initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize model {i}: {str(e)}")
             raise
 
-# Initialize models when the module is imported
-try:
-    InitializeModels(5)
-    logger.info("Models initialized successfully on module import")
-except Exception as e:
-    logger.error(f"Failed to initialize models on module import: {str(e)}")
+def _load_pool():
+    InitializeModels(5)  # Initialize with 5 models
+    return ModelsPool
+
+# Models load on first use or during the app's warm-up, not at import
+Registry.register('genre', _load_pool)
 
@@ -0,0 +1,111 @@
+import os
+import re
+from flask import Response, request
+
+# GridFS files never change under an id, so browsers may keep them this long
+GRIDFS_CACHE_MAX_AGE = int(os.environ.get('GRIDFS_CACHE_MAX_AGE', '86400'))
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def gridfs_etag(grid_out):
+    """Strong ETag from the stored md5 when present, else from the (immutable) file id and length"""
+    md5 = getattr(grid_out, 'md5', None)
+    return f'"{md5}"' if md5 else f'"{grid_out._id}-{grid_out.length}"'
+
+
+def parse_range(header, length):
+    """
+    Parse a single-range `Range: bytes=...` header.
+
+    Returns:
+        tuple or None or False: (start, end) inclusive, None to serve the
+            whole file (no/unsupported header), False if unsatisfiable
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges or other units: ignoring the header is allowed
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or length == 0:
+            return False
+        return max(0, length - suffix), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        return False
+    return start, end
+
+
+def _iter_range(grid_out, start, end):
+    """Yield the bytes start..end (inclusive) one GridFS chunk at a time"""
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = grid_out.read(min(grid_out.chunk_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def gridfs_response(grid_out, mimetype=None, as_attachment=True, download_name=None, max_age=GRIDFS_CACHE_MAX_AGE):
+    """
+    Stream a GridFS file with constant memory, honouring Range and If-None-Match.
+
+    Args:
+        grid_out (GridOut): Open GridFS file
+        mimetype (str): Content type; defaults to the file's stored content type
+        as_attachment (bool): Send Content-Disposition: attachment
+        download_name (str): Filename for Content-Disposition; defaults to the stored filename
+        max_age (int): Cache lifetime in seconds; None sends no-cache (for URLs whose file varies)
+
+    Returns:
+        flask.Response: 200, 206, 304 or 416
+    """
+    length = grid_out.length
+    etag = gridfs_etag(grid_out)
+
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': f'private, max-age={max_age}' if max_age is not None else 'no-cache',
+    }
+    if grid_out.upload_date is not None:
+        headers['Last-Modified'] = grid_out.upload_date.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    name = download_name or grid_out.filename
+    if name:
+        disposition = 'attachment' if as_attachment else 'inline'
+        headers['Content-Disposition'] = f'{disposition}; filename="{name}"'
+    mimetype = mimetype or grid_out.content_type or 'application/octet-stream'
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status=304, headers=headers)
+
+    byte_range = parse_range(request.headers.get('Range'), length)
+    # A range only applies to the representation the client already has
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{length}'
+        return Response(status=416, headers=headers)
+
+    if byte_range is None:
+        headers['Content-Length'] = str(length)
+        return Response(_iter_range(grid_out, 0, length - 1), status=200, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+
+    start, end = byte_range
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Content-Range'] = f'bytes {start}-{end}/{length}'
+    return Response(_iter_range(grid_out, start, end), status=206, mimetype=mimetype,
+                    headers=headers, direct_passthrough=True)
@@ -1,22 +1,52 @@
 import os
+import threading
 import librosa
 import numpy as np
 import torch
 import logging
-from DataExtractor import InstrumentModels, InstrumentBusy, InstrumentDict, InstrumentClassifier
+from DataExtractor import InstrumentModelPool, InstrumentDict, InstrumentClassifier
+from AnalysisContext import AudioAnalysisContext
+from ModelPool import PoolTimeout, INFERENCE_THREADS, LIMIT_TORCH_THREADS
+from BatchScheduler import BatchScheduler
+from ModelRegistry import Registry
+from Metrics import timed
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('InstrumentAnalysis')
 
+# Serializes pool growth so concurrent first requests don't double-load
+_init_lock = threading.Lock()
+
+# Micro-batching of CNN forward passes across concurrent requests
+INSTRUMENT_MAX_BATCH = int(os.environ.get('INSTRUMENT_MAX_BATCH', '16'))
+INSTRUMENT_MAX_WAIT_MS = float(os.environ.get('INSTRUMENT_MAX_WAIT_MS', '10'))
+
+def _run_instrument_batch(features):
+    """Run one batched forward pass over a list of (141, 216) feature arrays"""
+    batch = torch.from_numpy(np.stack(features).astype(np.float32))
+    with InstrumentModelPool.acquire() as model, torch.inference_mode(), timed('instrument_cnn'):
+        output = model(batch).cpu().numpy()
+    return list(output)
+
+InstrumentBatcher = BatchScheduler(
+    'instrument',
+    _run_instrument_batch,
+    max_batch=INSTRUMENT_MAX_BATCH,
+    max_wait_ms=INSTRUMENT_MAX_WAIT_MS
+)
+
 class InstrumentAnalyzer:
     @staticmethod
-    def analyze_instrument(path):
+    @timed('instrument')
+    def analyze_instrument(path, context=None):
         """
         Analyze the instrument in the given audio file, returning all probabilities.
         
         Args:
             path (str): Path to the audio file to analyze
+            context (AudioAnalysisContext): Already decoded audio for this file;
+                decoded from path if not given
             
         Returns:
             dict: Dictionary containing:
@@ -24,53 +54,27 @@ class InstrumentAnalyzer:
                 - probabilities: dictionary of all instrument probabilities
                 - features: dictionary of extracted features
                 - status: analysis status
-                or -1 if no models are available
+                or -1 if no model became available within the pool timeout
         """
-        # Check if models are initialized
-        if len(InstrumentModels) == 0:
-            logger.warning("Instrument models not initialized. Initializing now...")
-            InstrumentAnalyzer.initialize_models(5)
-        
-        modelnum = -1
-        for i in range(len(InstrumentBusy)):
-            if not InstrumentBusy[i]:
-                modelnum = i
-                break
-        
-        if modelnum == -1:
-            logger.warning("No available models to process instrument")
-            return -1
+        # Loads the pool on first use unless the warm-up thread already did
+        Registry.get('instrument')
         
         try:
-            InstrumentBusy[modelnum] = 1
-            logger.info(f"Using model {modelnum} to analyze instrument in file: {path}")
-            
-            # Load audio file (first 5 seconds only for efficiency)
-            y, sr = librosa.load(path, duration=5)
-            logger.debug(f"Audio loaded with shape: {y.shape}, sample rate: {sr}")
-            
-            # Extract features with fixed dimensions
-            n_fft = 2048
-            hop_length = 512
-            
-            # Mel spectrogram with fixed dimensions
-            mel_spec = librosa.feature.melspectrogram(
-                y=y, 
-                sr=sr, 
-                n_mels=128,
-                n_fft=n_fft,
-                hop_length=hop_length
-            )
+            logger.info(f"Analyzing instrument in file: {path}")
+            
+            if context is None:
+                context = AudioAnalysisContext(path)
+            
+            # Only the first 5 seconds are analyzed; slice them from the
+            # shared spectrogram instead of decoding the file again
+            duration = 5
+            
+            # Mel spectrogram (n_fft=2048, hop_length=512) with fixed dimensions
+            mel_spec = context.melspectrogram(duration=duration, n_mels=128)
             log_mel_spec = librosa.power_to_db(mel_spec)
             
             # MFCCs with fixed dimensions
-            mfccs = librosa.feature.mfcc(
-                y=y, 
-                sr=sr, 
-                n_mfcc=13,
-                n_fft=n_fft,
-                hop_length=hop_length
-            )
+            mfccs = context.mfcc(duration=duration, n_mfcc=13)
             
             # Ensure consistent shape by padding/truncating
             target_frames = 216  # Should match what the model expects
@@ -86,17 +90,14 @@ class InstrumentAnalyzer:
             
             logger.debug(f"Processed features shapes - mel: {log_mel_spec.shape}, mfcc: {mfccs.shape}")
             
-            # Prepare input tensor with correct dimensions
+            # Prepare input with correct dimensions (141, 216)
             combined_features = np.concatenate([log_mel_spec, mfccs], axis=0)
-            instrument_data = torch.tensor(
-                combined_features,
-                dtype=torch.float32
-            ).unsqueeze(0)  # Add batch dimension
             
-            logger.debug(f"Final input tensor shape: {instrument_data.shape}")
+            logger.debug(f"Final input shape: {combined_features.shape}")
             
-            # Get model prediction probabilities for all instruments
-            output = InstrumentModels[modelnum](instrument_data).detach().cpu().numpy()[0]
+            # Get model prediction probabilities for all instruments; the
+            # forward pass is batched with other concurrent requests
+            output = InstrumentBatcher.submit(combined_features).result()
             probabilities = {inst: float(prob) for inst, prob in zip(InstrumentDict.values(), output)}
             
             # Get the instrument with highest probability
@@ -130,6 +131,10 @@ class InstrumentAnalyzer:
             logger.info(f"Instrument analysis complete: {predicted_instrument}")
             return result
             
+        except PoolTimeout as e:
+            logger.warning(f"No available models to process instrument: {str(e)}")
+            return -1
+            
         except Exception as e:
             logger.error(f"Error in instrument analysis: {str(e)}")
             return {
@@ -137,26 +142,23 @@ class InstrumentAnalyzer:
                 'error': str(e),
                 'analysis_type': 'instrument'
             }
-            
-        finally:
-            if modelnum != -1:
-                InstrumentBusy[modelnum] = 0
-                logger.debug(f"Released model {modelnum}")
 
     @staticmethod
-    def analyze_key_tempo(path):
-        """Analyze key and tempo of audio file"""
+    @timed('key_tempo')
+    def analyze_key_tempo(path, context=None):
+        """Analyze key and tempo of audio file (first 10 seconds)"""
         try:
-            y, sr = librosa.load(path, duration=10)
+            if context is None:
+                context = AudioAnalysisContext(path)
             
             # Chroma features for key detection
-            chromagram = librosa.feature.chroma_stft(y=y, sr=sr)
+            chromagram = context.chroma(duration=10)
             mean_chroma = np.mean(chromagram, axis=1)
             estimated_key_index = np.argmax(mean_chroma)
             estimated_key = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'][estimated_key_index]
             
             # Tempo analysis
-            tempo = float(librosa.feature.tempo(y=y, sr=sr)[0].round())
+            tempo = float(context.tempo(duration=10).round())
             
             return {
                 'status': 'success',
@@ -175,22 +177,32 @@ class InstrumentAnalyzer:
     @staticmethod
     def initialize_models(num_models):
         """
-        Initialize instrument analysis models with correct input dimensions.
+        Grow the instrument model pool to `num_models` models with correct input dimensions.
+        
+        Models already in the pool (possibly in use by other threads) are kept.
+        In shared mode a single instance is loaded regardless of `num_models`.
         
         Args:
-            num_models (int): Number of models to initialize
+            num_models (int): Number of models the pool should hold
             
         Raises:
             FileNotFoundError: If model file is not found
             RuntimeError: If model initialization fails
         """
-        global InstrumentModels, InstrumentBusy
+        with _init_lock:
+            InstrumentAnalyzer._load_models(InstrumentModelPool.target_size(num_models) - InstrumentModelPool.size)
+
+    @staticmethod
+    def _load_models(missing):
+        if missing <= 0:
+            return
         
-        # Clear existing models if any
-        InstrumentModels = []
-        InstrumentBusy = []
+        logger.info(f"Initializing {missing} instrument classification models")
         
-        logger.info(f"Initializing {num_models} instrument classification models")
+        # torch's intra-op pool is process-wide; only cap it when asked to
+        # so MusicGen in the same process keeps its threads
+        if LIMIT_TORCH_THREADS:
+            torch.set_num_threads(INFERENCE_THREADS)
         
         # Get correct path to model file
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -216,26 +228,24 @@ class InstrumentAnalyzer:
                 logger.error(error_msg)
                 raise FileNotFoundError(error_msg)
         
-        for i in range(num_models):
+        for i in range(missing):
             try:
                 # Initialize with correct input dimensions (141, 216)
                 # 141 = 128 (mel) + 13 (mfcc)
                 # 216 = number of time frames
                 model = InstrumentClassifier((141, 216), 5)
-                model.load_state_dict(torch.load(model_path))
+                model.load_state_dict(torch.load(model_path, map_location='cpu'))
                 model.eval()  # Set to evaluation mode
-                InstrumentModels.append(model)
-                InstrumentBusy.append(0)
+                InstrumentModelPool.add(model)
                 logger.info(f"Instrument model {i} initialized successfully")
             except Exception as e:
                 error_msg = f"Failed to initialize instrument model {i}: {str(e)}"
                 logger.error(error_msg)
                 raise RuntimeError(error_msg)
 
-# Initialize models when the module is imported
-try:
+def _load_pool():
     InstrumentAnalyzer.initialize_models(5)
-    logger.info("Instrument models initialized successfully on module import")
-except Exception as e:
-    logger.error(f"Failed to initialize instrument models on module import: {str(e)}")
-    raise
+    return InstrumentModelPool
+
+# Models load on first use or during the app's warm-up, not at import
+Registry.register('instrument', _load_pool)
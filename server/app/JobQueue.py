@@ -0,0 +1,297 @@
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import deque, OrderedDict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('JobQueue')
+
+# Jobs run concurrently across all users
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', '1'))
+# Jobs of a single user that may run at the same time
+MAX_RUNNING_PER_USER = int(os.environ.get('MAX_RUNNING_PER_USER', '1'))
+# Queued plus running jobs a single user may have outstanding
+MAX_PENDING_PER_USER = int(os.environ.get('MAX_PENDING_PER_USER', '3'))
+# Queued jobs across all users before new submissions are rejected
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', '64'))
+# How long finished jobs stay queryable
+JOB_TTL_SECONDS = float(os.environ.get('JOB_TTL_SECONDS', '3600'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Every queue created in this process, for stats reporting
+_queues = []
+_queues_lock = threading.Lock()
+
+
+class JobRejected(RuntimeError):
+    """Raised when a submission would exceed the per-user or global queue limits"""
+
+
+class JobQueue:
+    """
+    Background job runner with per-user fairness.
+
+    Each user has their own FIFO. Workers take jobs round-robin across
+    users, skipping users already at `max_running_per_user`, so one user
+    submitting many jobs cannot starve the others. Finished jobs are kept
+    for `ttl` seconds so clients can poll their status and result.
+
+    With `run_batch`, a worker that picks a job also takes the next queued
+    job of other users whose `batch_key` matches (up to `max_batch` jobs)
+    and runs them in one call. Batches only form from jobs that are already
+    waiting, so merging never delays a job.
+    """
+
+    def __init__(self, name, run, workers=GENERATION_WORKERS,
+                 max_running_per_user=MAX_RUNNING_PER_USER,
+                 max_pending_per_user=MAX_PENDING_PER_USER,
+                 max_queued=MAX_QUEUED_JOBS, ttl=JOB_TTL_SECONDS,
+                 run_batch=None, batch_key=None, max_batch=1):
+        """
+        Args:
+            name (str): Queue name used in logs, thread names and stats
+            run (callable): Called as run(**params) for each job; its return value is the job result
+            workers (int): Number of worker threads
+            max_running_per_user (int): Concurrent jobs allowed per user
+            max_pending_per_user (int): Queued plus running jobs allowed per user
+            max_queued (int): Queued jobs allowed across all users
+            ttl (float): Seconds finished jobs are kept
+            run_batch (callable): Called with a list of params dicts, returns a list of results in the same order
+            batch_key (callable): Maps a job's params to a key; jobs with equal keys may share a batch, None never batches
+            max_batch (int): Largest number of jobs merged into one run_batch call
+        """
+        self.name = name
+        self.run = run
+        self.workers = max(1, int(workers))
+        self.max_running_per_user = max(1, int(max_running_per_user))
+        self.max_pending_per_user = max(1, int(max_pending_per_user))
+        self.max_queued = max(1, int(max_queued))
+        self.ttl = ttl
+        self.run_batch = run_batch
+        self.batch_key = batch_key
+        self.max_batch = max(1, int(max_batch)) if run_batch is not None else 1
+
+        self._cond = threading.Condition()
+        self._jobs = OrderedDict()  # job id -> job, in submission order
+        self._user_queues = OrderedDict()  # user -> deque of queued job ids, in round-robin order
+        self._running = {}  # user -> running job count
+        self._threads = []
+
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0,
+                       'batches': 0, 'batched_jobs': 0}
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._peak_queued = 0
+
+        with _queues_lock:
+            _queues.append(self)
+
+    def _ensure_started(self):
+        # Caller holds the condition
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._worker, name=f"{self.name}-worker-{len(self._threads)}", daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, user, **params):
+        """
+        Queue a job for `user`.
+
+        Returns:
+            str: Job id
+
+        Raises:
+            JobRejected: If the user or the queue is at its limit
+        """
+        with self._cond:
+            self._prune()
+            pending = self._running.get(user, 0) + len(self._user_queues.get(user, ()))
+            if pending >= self.max_pending_per_user:
+                self._stats['rejected'] += 1
+                raise JobRejected(f"User already has {pending} {self.name} jobs pending")
+            if self._queued_count() >= self.max_queued:
+                self._stats['rejected'] += 1
+                raise JobRejected(f"{self.name} queue is full")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'user': user,
+                'params': params,
+                'status': QUEUED,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self._user_queues.setdefault(user, deque()).append(job_id)
+            self._stats['submitted'] += 1
+            self._peak_queued = max(self._peak_queued, self._queued_count())
+
+            self._ensure_started()
+            self._cond.notify()
+
+        logger.info(f"Queued {self.name} job {job_id} for {user}")
+        return job_id
+
+    def _queued_count(self):
+        return sum(len(jobs) for jobs in self._user_queues.values())
+
+    def _pop(self, user):
+        """Take the head job of `user`, sending them to the back of the line. Caller holds the condition."""
+        jobs = self._user_queues.pop(user)
+        job = self._jobs[jobs.popleft()]
+        if jobs:
+            # Back of the line until every other user had a turn
+            self._user_queues[user] = jobs
+        job['status'] = RUNNING
+        job['started_at'] = time.time()
+        self._running[user] = self._running.get(user, 0) + 1
+        return job
+
+    def _next_batch(self):
+        """Start the next runnable job plus compatible jobs of other users, round-robin. Caller holds the condition."""
+        for user in list(self._user_queues):
+            if self._running.get(user, 0) >= self.max_running_per_user:
+                continue
+            batch = [self._pop(user)]
+            key = self.batch_key(batch[0]['params']) if self.batch_key else None
+            if key is None:
+                return batch
+
+            for other in list(self._user_queues):
+                if len(batch) >= self.max_batch:
+                    break
+                # A user's own jobs keep their turns instead of riding along
+                if other == user or self._running.get(other, 0) >= self.max_running_per_user:
+                    continue
+                head = self._jobs[self._user_queues[other][0]]
+                if self.batch_key(head['params']) == key:
+                    batch.append(self._pop(other))
+            return batch
+        return None
+
+    def _execute(self, batch):
+        """Run a batch outside the lock; returns a (result, error) pair per job"""
+        try:
+            if len(batch) == 1:
+                return [(self.run(**batch[0]['params']), None)]
+            results = self.run_batch([job['params'] for job in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(batch)} jobs")
+            return [(result, None) for result in results]
+        except Exception as e:
+            logger.error(f"{self.name} job(s) {', '.join(job['id'] for job in batch)} failed: {str(e)}")
+            return [(None, str(e))] * len(batch)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                while batch is None:
+                    self._cond.wait()
+                    batch = self._next_batch()
+                if len(batch) > 1:
+                    self._stats['batches'] += 1
+                    self._stats['batched_jobs'] += len(batch)
+
+            outcomes = self._execute(batch)
+
+            with self._cond:
+                finished_at = time.time()
+                for job, (result, error) in zip(batch, outcomes):
+                    job['finished_at'] = finished_at
+                    job['result'] = result
+                    job['error'] = error
+                    job['status'] = FAILED if error else DONE
+                    job['params'] = None  # Inputs can be large (audio, streamers); only results are kept
+                    self._stats['failed' if error else 'completed'] += 1
+                    self._wait_total += job['started_at'] - job['submitted_at']
+                    self._run_total += job['finished_at'] - job['started_at']
+
+                    self._running[job['user']] -= 1
+                    if not self._running[job['user']]:
+                        del self._running[job['user']]
+                # A slot for these users may unblock one of their queued jobs
+                self._cond.notify_all()
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL. Caller holds the condition."""
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Public view of a job.
+
+        Returns:
+            dict or None: Status, timestamps, queue position and result/error, or None if unknown
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            view = {name: job[name] for name in
+                    ('id', 'user', 'status', 'submitted_at', 'started_at', 'finished_at', 'result', 'error')}
+            if job['status'] == QUEUED:
+                view['position'] = self._position(job)
+            return view
+
+    def _position(self, job):
+        """Queued jobs submitted before `job`, an upper bound under round-robin. Caller holds the condition."""
+        submitted_at = job['submitted_at']
+        return sum(1 for other in self._jobs.values()
+                   if other['status'] == QUEUED and other['submitted_at'] < submitted_at)
+
+    def latest_for_user(self, user):
+        """Most recently submitted job of `user`, or None"""
+        with self._cond:
+            for job_id in reversed(self._jobs):
+                if self._jobs[job_id]['user'] == user:
+                    break
+            else:
+                return None
+        return self.get(job_id)
+
+    def stats(self):
+        """Queue depth, running jobs and timing counters"""
+        with self._cond:
+            finished = self._stats['completed'] + self._stats['failed']
+            stats = dict(self._stats)
+            stats.update({
+                'name': self.name,
+                'workers': self.workers,
+                'queued': self._queued_count(),
+                'peak_queued': self._peak_queued,
+                'running': sum(self._running.values()),
+                'users_queued': len(self._user_queues),
+                'mean_wait_seconds': self._wait_total / finished if finished else 0.0,
+                'mean_run_seconds': self._run_total / finished if finished else 0.0,
+                'max_running_per_user': self.max_running_per_user,
+                'max_pending_per_user': self.max_pending_per_user,
+                'max_queued': self.max_queued,
+                'max_batch': self.max_batch,
+                'mean_batch_size': (self._stats['batched_jobs'] / self._stats['batches']
+                                    if self._stats['batches'] else 1.0),
+            })
+        return stats
+
+
+def all_queue_stats():
+    """Stats for every JobQueue in this process, keyed by queue name"""
+    with _queues_lock:
+        queues = list(_queues)
+    return {queue.name: queue.stats() for queue in queues}
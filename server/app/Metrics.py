@@ -0,0 +1,226 @@
+import os
+import math
+import time
+import threading
+import functools
+import contextvars
+import logging
+from ModelPool import all_pool_stats
+from BatchScheduler import all_scheduler_stats
+from JobQueue import all_queue_stats
+from DiskCache import all_cache_stats
+from ModelRegistry import Registry, READY
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('Metrics')
+
+# Add a Server-Timing header with per-stage durations to every response
+TIMING_HEADERS = os.environ.get('TIMING_HEADERS', '0') == '1'
+METRICS_PREFIX = os.environ.get('METRICS_PREFIX', 'music')
+
+# Seconds; stages range from cache lookups to minutes-long generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Stats keys that only ever increase, exported as counters
+_COUNTER_KEYS = {
+    'pool': {'acquired', 'timeouts', 'rejected', 'total_wait_seconds'},
+    'scheduler': {'batches', 'items'},
+    'queue': {'submitted', 'rejected', 'completed', 'failed', 'batches', 'batched_jobs'},
+    'cache': {'hits', 'misses', 'writes', 'evictions'},
+}
+
+# Stage durations of the request being handled, if one is
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+# Every stage duration observed in this process, when collected for another process
+_observations = None
+_observations_lock = threading.Lock()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format, one series per label set"""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def summary(self):
+        """Count, total and mean per label set, for JSON stats"""
+        with self._lock:
+            return {
+                '/'.join(labels): {'count': series[-1], 'sum': series[-2],
+                                   'mean': series[-2] / series[-1] if series[-1] else 0.0}
+                for labels, series in self._series.items()
+            }
+
+    def _bucket_line(self, pairs, bound, count):
+        labels = ','.join(pairs + ['le="%s"' % bound])
+        return f"{self.name}_bucket{{{labels}}} {count}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            for labels, series in items:
+                pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+                for bound, count in zip(self.buckets, series):
+                    lines.append(self._bucket_line(pairs, bound, count))
+                lines.append(self._bucket_line(pairs, '+Inf', series[-1]))
+                label_text = '{' + ','.join(pairs) + '}' if pairs else ''
+                lines.append(f"{self.name}_sum{label_text} {series[-2]}")
+                lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(f'{METRICS_PREFIX}_stage_duration_seconds',
+                          'Time spent in each analysis, generation and storage stage', ('stage',))
+REQUEST_SECONDS = Histogram(f'{METRICS_PREFIX}_http_request_duration_seconds',
+                            'HTTP request latency until the response is returned', ('endpoint', 'method', 'status'))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def record(stage, seconds):
+    """Add one duration of `stage` to the histogram and to the current request's timings"""
+    STAGE_SECONDS.observe(seconds, stage)
+    if _observations is not None:
+        with _observations_lock:
+            _observations.append((stage, seconds))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class timed:
+    """
+    Time a stage, as a context manager or a decorator.
+
+        with timed('hpss'):
+            ...
+
+        @timed('generate_music')
+        def generate_music(...):
+            ...
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # A fresh timer per call, so concurrent calls don't share state
+            with timed(self.stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def collect_observations():
+    """
+    Keep every stage duration observed from now on for drain_observations().
+
+    For worker processes, whose own histograms are never exported: the app
+    records the drained observations into its histograms instead.
+    """
+    global _observations
+    with _observations_lock:
+        if _observations is None:
+            _observations = []
+
+
+def drain_observations():
+    """
+    Returns:
+        list: (stage, seconds) observed since the last call, from any thread
+    """
+    global _observations
+    with _observations_lock:
+        if not _observations:
+            return []
+        drained, _observations = _observations, []
+    return drained
+
+
+def start_request():
+    """Begin collecting stage timings for the current request"""
+    _request_timings.set({'_start': time.perf_counter()})
+
+
+def finish_request(response, endpoint, method):
+    """
+    Record the request latency and, with TIMING_HEADERS, add a Server-Timing header.
+
+    Returns:
+        The response
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        return response
+    _request_timings.set(None)
+    total = time.perf_counter() - timings.pop('_start')
+    REQUEST_SECONDS.observe(total, endpoint or 'unknown', method, str(response.status_code))
+
+    if TIMING_HEADERS:
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+def _stats_lines(group, label, all_stats, lines):
+    """Numeric fields of a stats() dict per component, as gauges or counters"""
+    counters = _COUNTER_KEYS.get(group, set())
+    metrics = {}
+    for component, stats in all_stats.items():
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                continue
+            metrics.setdefault(key, []).append((component, value))
+
+    for key, samples in sorted(metrics.items()):
+        counter = key in counters
+        name = f"{METRICS_PREFIX}_{group}_{key}" + ('_total' if counter else '')
+        lines.append(f"# TYPE {name} {'counter' if counter else 'gauge'}")
+        for component, value in samples:
+            lines.append(f'{name}{{{label}="{_escape(component)}"}} {value}')
+
+
+def render():
+    """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render()
+    _stats_lines('pool', 'pool', all_pool_stats(), lines)
+    _stats_lines('scheduler', 'scheduler', all_scheduler_stats(), lines)
+    _stats_lines('queue', 'queue', all_queue_stats(), lines)
+    _stats_lines('cache', 'cache', all_cache_stats(), lines)
+
+    name = f"{METRICS_PREFIX}_model_ready"
+    lines.append(f"# TYPE {name} gauge")
+    for model, status in Registry.status().items():
+        lines.append(f'{name}{{model="{_escape(model)}"}} {1 if status["status"] == READY else 0}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('ModelPool')
+
+# How long a request waits for a free model before giving up (seconds)
+DEFAULT_TIMEOUT = 10.0
+# How many requests may queue for a model before new ones are rejected
+DEFAULT_MAX_WAITERS = 32
+
+# Share one read-only instance per model between all threads instead of
+# loading a private copy per slot. XGBoost prediction and eval-mode torch
+# inference are thread-safe, so this only trades exclusivity for memory.
+SHARE_MODELS = os.environ.get('SHARE_MODELS', '1') == '1'
+# Intra-op threads each inference call may use (torch.set_num_threads and
+# XGBoost nthread). Request threads/workers already provide parallelism,
+# so keep this low to avoid oversubscribing cores.
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', '1'))
+# torch's thread count is process-wide and would also slow MusicGen, so the
+# app process only applies INFERENCE_THREADS to torch when it is set
+# explicitly; analysis processes always do
+LIMIT_TORCH_THREADS = 'INFERENCE_THREADS' in os.environ
+
+# Every pool created in this process, for stats reporting
+_pools = []
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no model becomes available in time or the wait queue is full"""
+
+
+class ModelPool:
+    """
+    Thread-safe pool of interchangeable model instances.
+
+    Models are checked out with `acquire()`, which is a context manager:
+
+        with pool.acquire() as model:
+            model.predict(features)
+
+    When every model is in use callers block (up to `timeout` seconds) in a
+    bounded wait queue instead of failing immediately.
+
+    In shared mode the pool holds a single instance that every caller gets
+    concurrently; callers only wait while it is still being loaded.
+    """
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT, max_waiters=DEFAULT_MAX_WAITERS, shared=SHARE_MODELS):
+        """
+        Args:
+            name (str): Pool name used in logs and stats
+            timeout (float): Default seconds to wait for a free model
+            max_waiters (int): Maximum number of callers allowed to queue
+            shared (bool): Serve every caller from one read-only instance
+        """
+        self.name = name
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.shared = shared
+
+        self._cond = threading.Condition()
+        self._models = []
+        self._free = []
+        self._in_use = 0
+        self._waiting = 0
+
+        self._stats = {
+            'acquired': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'peak_in_use': 0,
+            'peak_waiting': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        }
+
+        with _pools_lock:
+            _pools.append(self)
+
+    @property
+    def size(self):
+        with self._cond:
+            return len(self._models)
+
+    def target_size(self, num):
+        """Number of instances to load when `num` are requested"""
+        return min(num, 1) if self.shared else num
+
+    def _available(self):
+        return bool(self._models) if self.shared else bool(self._free)
+
+    def add(self, model):
+        """Add a model instance to the pool and wake waiting callers"""
+        with self._cond:
+            self._models.append(model)
+            self._free.append(model)
+            if self.shared:
+                self._cond.notify_all()
+            else:
+                self._cond.notify()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """
+        Check out a model for the duration of the `with` block.
+
+        Args:
+            timeout (float): Seconds to wait for a free model; defaults to the pool timeout
+
+        Raises:
+            PoolTimeout: If the wait queue is full or no model frees up in time
+        """
+        model = self._checkout(self.timeout if timeout is None else timeout)
+        try:
+            yield model
+        finally:
+            self._checkin(model)
+
+    def _checkout(self, timeout):
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            if not self._available():
+                if self._waiting >= self.max_waiters:
+                    self._stats['rejected'] += 1
+                    raise PoolTimeout(f"{self.name} pool wait queue is full ({self._waiting} waiting)")
+
+                self._waiting += 1
+                self._stats['peak_waiting'] = max(self._stats['peak_waiting'], self._waiting)
+                try:
+                    while not self._available():
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['timeouts'] += 1
+                            raise PoolTimeout(f"No {self.name} model available after {timeout:.1f}s")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            model = self._models[0] if self.shared else self._free.pop()
+            self._in_use += 1
+
+            waited = time.monotonic() - start
+            self._stats['acquired'] += 1
+            self._stats['total_wait_seconds'] += waited
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._in_use)
+
+        if waited > 0.1:
+            logger.info(f"Waited {waited:.2f}s for a {self.name} model")
+        return model
+
+    def _checkin(self, model):
+        with self._cond:
+            self._in_use -= 1
+            if not self.shared:
+                self._free.append(model)
+                self._cond.notify()
+
+    def stats(self):
+        """Return a snapshot of pool occupancy and wait statistics"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'name': self.name,
+                'size': len(self._models),
+                'shared': self.shared,
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'max_waiters': self.max_waiters,
+                'timeout': self.timeout,
+            })
+        if stats['acquired']:
+            stats['mean_wait_seconds'] = stats['total_wait_seconds'] / stats['acquired']
+        else:
+            stats['mean_wait_seconds'] = 0.0
+        return stats
+
+
+def all_pool_stats():
+    """Stats for every ModelPool in this process, keyed by pool name"""
+    with _pools_lock:
+        pools = list(_pools)
+    return {pool.name: pool.stats() for pool in pools}
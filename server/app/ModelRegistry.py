@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('ModelRegistry')
+
+# Load every registered model in a background thread once the app is up ('0' = load on first use only)
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1') == '1'
+
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ModelRegistry:
+    """
+    Loads each model once per process, on first use or during warm-up.
+
+    Modules register a loader under a name at import time instead of
+    loading eagerly, so importing the app is cheap. `get()` runs the loader
+    the first time (concurrent callers wait for the same load) and returns
+    the cached value afterwards. A failed load is recorded and retried on
+    the next `get()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # name -> entry, in registration order
+        self._warmup_thread = None
+        self._skipped = set()  # Loaded by other processes, not warmed or awaited here
+
+    def register(self, name, loader):
+        """
+        Args:
+            name (str): Model name used by get() and in the readiness report
+            loader (callable): Takes no arguments and returns the loaded model
+        """
+        with self._lock:
+            if name in self._entries:
+                return
+            self._entries[name] = {
+                'loader': loader,
+                'lock': threading.Lock(),
+                'status': PENDING,
+                'value': None,
+                'error': None,
+                'load_seconds': None,
+            }
+
+    def get(self, name):
+        """
+        Return the loaded model, loading it first if needed.
+
+        Raises:
+            KeyError: If nothing is registered under `name`
+            Exception: Whatever the loader raised
+        """
+        entry = self._entries[name]
+        if entry['status'] == READY:
+            return entry['value']
+
+        with entry['lock']:
+            # Another thread may have finished the load while we waited
+            if entry['status'] == READY:
+                return entry['value']
+
+            entry['status'] = LOADING
+            logger.info(f"Loading model {name}")
+            start = time.perf_counter()
+            try:
+                value = entry['loader']()
+            except Exception as e:
+                entry['status'] = FAILED
+                entry['error'] = str(e)
+                logger.error(f"Failed to load model {name}: {str(e)}")
+                raise
+            entry['value'] = value
+            entry['error'] = None
+            entry['load_seconds'] = time.perf_counter() - start
+            entry['status'] = READY
+            logger.info(f"Loaded model {name} in {entry['load_seconds']:.1f}s")
+            return value
+
+    def warm_up(self, skip=()):
+        """
+        Load every registered model in a background thread; returns immediately.
+
+        Args:
+            skip (iterable of str): Models this process does not use because
+                other processes load them; they are left unloaded and do not
+                count towards ready()
+        """
+        with self._lock:
+            if self._warmup_thread is not None:
+                return
+            self._skipped = set(skip)
+            self._warmup_thread = threading.Thread(target=self._warm_up, name='model-warmup', daemon=True)
+            self._warmup_thread.start()
+
+    def _warm_up(self):
+        for name in list(self._entries):
+            if name in self._skipped:
+                continue
+            try:
+                self.get(name)
+            except Exception:
+                # Recorded in the status; requests retry the load
+                pass
+
+    def status(self):
+        """Load state of every registered model, keyed by name"""
+        return {
+            name: {
+                'status': entry['status'],
+                'load_seconds': entry['load_seconds'],
+                'error': entry['error'],
+            }
+            for name, entry in list(self._entries.items())
+        }
+
+    def ready(self):
+        """True once every registered model this process uses has loaded"""
+        return all(entry['status'] == READY for name, entry in list(self._entries.items())
+                   if name not in self._skipped)
+
+
+# Process-wide registry shared by all analysis and generation modules
+Registry = ModelRegistry()
@@ -1,27 +1,284 @@
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
+from transformers import AutoProcessor, MusicgenForConditionalGeneration, GenerationConfig
+from transformers.generation.streamers import BaseStreamer
 import scipy.io.wavfile
+import soundfile as sf
+import librosa
 import os
+import io
+import math
+import queue
+import logging
+import threading
+import contextlib
+import numpy as np
 import torch
+from JobQueue import JobQueue
+from ModelRegistry import Registry
+import GenerationCache
+from Metrics import timed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('MusicGenerator')
 
 # Create output directory if it doesn't exist
 os.makedirs("out", exist_ok=True)
 
-# Load model and processor (this will happen once when the file is imported)
-processor = AutoProcessor.from_pretrained("facebook/musicgen-small")
-model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small")
+MODEL_NAME = "facebook/musicgen-small"
+
+# CPU inference precision: 'fp32', 'int8' (dynamically quantized decoder
+# Linear layers) or 'bf16' (autocast, where the CPU supports it). Check a
+# change with server/benchmarks/musicgen_precision.py.
+MUSICGEN_PRECISION = os.environ.get('MUSICGEN_PRECISION', 'fp32')
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
 
-def generate_music(prompt, duration, username):
+def bf16_supported():
+    """Whether this CPU has native bfloat16 kernels"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def load_musicgen(precision=MUSICGEN_PRECISION):
     """
-    Generate music based on a text prompt
+    Load the MusicGen processor and model for CPU inference
     
     Args:
-        prompt (str): Text description of the music to generate
-        duration (float): Duration in seconds (approximate)
-        username (str): User identifier for the output file
+        precision (str): One of PRECISIONS; bf16 falls back to fp32 on CPUs without support
         
     Returns:
-        str: Path to the generated audio file
+        tuple: (processor, model); model.inference_precision holds the precision actually used
     """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown MusicGen precision {precision!r}, expected one of {PRECISIONS}")
+    
+    processor = AutoProcessor.from_pretrained(MODEL_NAME)
+    model = MusicgenForConditionalGeneration.from_pretrained(MODEL_NAME)
+    model.eval()
+    
+    if precision == 'int8':
+        # The decoder's Linear layers dominate generation time; the text
+        # encoder runs once per prompt and EnCodec is convolutional
+        torch.quantization.quantize_dynamic(model.decoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif precision == 'bf16' and not bf16_supported():
+        logger.warning("bf16 requested but this CPU has no bfloat16 support; using fp32")
+        precision = 'fp32'
+    
+    model.inference_precision = precision
+    logger.info(f"Loaded {MODEL_NAME} for {precision} inference")
+    return processor, model
+
+
+def precision_context(model):
+    """Autocast context for the model's inference precision (a no-op unless bf16)"""
+    if getattr(model, 'inference_precision', 'fp32') == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+# Loaded once per process, on first use or by the app's warm-up thread
+Registry.register('musicgen', load_musicgen)
+# The sampling settings alone are enough for generation cache lookups
+Registry.register('musicgen_generation_config', lambda: GenerationConfig.from_pretrained(MODEL_NAME))
+
+
+def musicgen():
+    """The shared (processor, model) pair, loading it on first use"""
+    return Registry.get('musicgen')
+
+
+# Generated frames decoded to audio per streamed chunk (EnCodec runs at 50 frames/s)
+STREAM_PLAY_STEPS = int(os.environ.get('STREAM_PLAY_STEPS', '50'))
+# Already streamed frames re-decoded before each window so chunk boundaries stay smooth
+STREAM_CONTEXT_FRAMES = int(os.environ.get('STREAM_CONTEXT_FRAMES', '25'))
+# Queued requests merged into one batched generate call
+GENERATION_MAX_BATCH = int(os.environ.get('GENERATION_MAX_BATCH', '4'))
+# Requests whose durations round up to the same multiple of this are batched together
+GENERATION_BATCH_BUCKET_SECONDS = float(os.environ.get('GENERATION_BATCH_BUCKET_SECONDS', '5'))
+# Seconds at the end of a clip the continuation is conditioned on. Prompt
+# plus new tokens must fit MusicGen's 2048 positions (about 40 s).
+CONTINUE_CONTEXT_SECONDS = float(os.environ.get('CONTINUE_CONTEXT_SECONDS', '10'))
+
+
+class SamplingLock:
+    """
+    Gives seeded generations torch's global RNG to themselves.
+
+    generate() samples from the process-wide RNG and takes no per-call
+    generator, so with several generation workers another job's sampling
+    would draw from a seeded job's stream and change its output. Unseeded
+    generations share the lock and run concurrently; a seeded one waits
+    for them, seeds and samples alone. Waiting seeded jobs hold back new
+    unseeded ones so they are not starved.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    @contextlib.contextmanager
+    def hold(self, seed=None):
+        """Context manager: exclusive for a seeded generation (seeding torch), shared otherwise"""
+        with self._cond:
+            if seed is None:
+                while self._exclusive or self._exclusive_waiting:
+                    self._cond.wait()
+                self._shared += 1
+            else:
+                self._exclusive_waiting += 1
+                while self._exclusive or self._shared:
+                    self._cond.wait()
+                self._exclusive_waiting -= 1
+                self._exclusive = True
+        try:
+            if seed is not None:
+                torch.manual_seed(seed)
+            yield
+        finally:
+            with self._cond:
+                if seed is None:
+                    self._shared -= 1
+                else:
+                    self._exclusive = False
+                self._cond.notify_all()
+
+
+_sampling_lock = SamplingLock()
+
+
+class MusicgenStreamer(BaseStreamer):
+    """
+    Decodes MusicGen audio codes in windows while `model.generate` runs.
+
+    `generate` hands every new step of codebook tokens to `put()`. Every
+    `play_steps` steps the delay pattern is undone and the codes since the
+    last chunk (plus `context_frames` of already streamed codes, so the
+    EnCodec decoder gets some left context) are decoded. The newest
+    `stride` samples are held back until the next window because they
+    still depend on codes that have not been generated yet. Chunks are
+    float32 numpy arrays read with `chunks()`.
+
+    The streamed audio only approximates a decode of the whole clip:
+    EnCodec's decoder has LSTM layers whose state carries over from the
+    start of the clip, and each window starts them from the context frames
+    instead. More context frames bring the chunks closer; the file written
+    at the end of the job is always the full decode.
+    """
+
+    def __init__(self, model, play_steps=STREAM_PLAY_STEPS, context_frames=STREAM_CONTEXT_FRAMES, stride=None):
+        """
+        Args:
+            model (MusicgenForConditionalGeneration): Model whose generate() is being streamed
+            play_steps (int): Generation steps per decoded chunk
+            context_frames (int): Already streamed frames included at the start of each window
+            stride (int): Trailing samples held back per window; defaults to a sixth of a window
+        """
+        self.decoder = model.decoder
+        self.audio_encoder = model.audio_encoder
+        self.generation_config = model.generation_config
+        self.num_codebooks = self.decoder.num_codebooks
+        self.play_steps = max(1, int(play_steps))
+        self.context_frames = max(0, int(context_frames))
+
+        self.hop_length = int(np.prod(self.audio_encoder.config.upsampling_ratios))
+        self.sampling_rate = self.audio_encoder.config.sampling_rate
+        if stride is None:
+            stride = self.hop_length * max(1, self.play_steps - self.num_codebooks) // 6
+        self.stride = stride
+
+        self.token_cache = None
+        self.emitted = 0  # Samples already handed out
+        self._queue = queue.Queue()
+
+    def _decode(self):
+        """Decode the codes from just before the last emitted sample; returns (audio, window start sample)"""
+        codes = self.token_cache
+        _, delay_mask = self.decoder.build_delay_pattern_mask(
+            codes[:, :1],
+            pad_token_id=self.generation_config.decoder_start_token_id,
+            max_length=codes.shape[-1]
+        )
+        codes = self.decoder.apply_delay_pattern_mask(codes, delay_mask)
+        codes = codes[codes != self.generation_config.pad_token_id].reshape(1, self.num_codebooks, -1)
+
+        start_frame = max(0, self.emitted // self.hop_length - self.context_frames)
+        window = codes[None, :, :, start_frame:].to(self.audio_encoder.device)
+        audio = self.audio_encoder.decode(window, audio_scales=[None]).audio_values[0, 0]
+        return audio.cpu().float().numpy(), start_frame * self.hop_length
+
+    def put(self, value):
+        if value.shape[0] // self.num_codebooks > 1:
+            raise ValueError("MusicgenStreamer only supports a batch size of 1")
+
+        if self.token_cache is None:
+            # The initial decoder input ids, (codebooks, steps)
+            self.token_cache = value
+        else:
+            self.token_cache = torch.cat([self.token_cache, value[:, None]], dim=-1)
+
+        if self.token_cache.shape[-1] % self.play_steps == 0:
+            audio, offset = self._decode()
+            chunk = audio[self.emitted - offset:len(audio) - self.stride]
+            if len(chunk):
+                self.emitted += len(chunk)
+                self._queue.put(chunk)
+
+    def end(self):
+        if self.token_cache is not None and self.token_cache.shape[-1] > self.num_codebooks:
+            audio, offset = self._decode()
+            chunk = audio[self.emitted - offset:]
+            if len(chunk):
+                self.emitted += len(chunk)
+                self._queue.put(chunk)
+        self._queue.put(None)
+
+    def replay(self, audio):
+        """Stream an already generated clip (a generation cache hit) as a single chunk"""
+        if len(audio):
+            self.emitted += len(audio)
+            self._queue.put(audio)
+        self._queue.put(None)
+
+    def abort(self):
+        """End the stream without decoding, after generation failed"""
+        self._queue.put(None)
+
+    def chunks(self, poll_interval=1.0, alive=None):
+        """
+        Yield audio chunks as they are decoded, until generation ends.
+
+        Args:
+            poll_interval (float): Seconds between checks of `alive` while no chunk arrives
+            alive (callable): Returns False once the producing job is gone; stops the iteration
+        """
+        while True:
+            try:
+                chunk = self._queue.get(timeout=poll_interval)
+            except queue.Empty:
+                if alive is None or alive():
+                    continue
+                # Drain anything queued just before the job finished
+                try:
+                    chunk = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+            if chunk is None:
+                return
+            yield chunk
+
+
+def create_streamer():
+    """Streamer for one generate_music call"""
+    _, model = musicgen()
+    return MusicgenStreamer(model)
+
+
+def _output_path(username):
+    """Fresh output path in the user's directory, removing the previous clip"""
     # Ensure safe username
     safe_username = "".join(c for c in username if c.isalnum() or c in "._-")
     
@@ -35,6 +292,70 @@ def generate_music(prompt, duration, username):
     # Delete old file if it exists
     if os.path.exists(output_path):
         os.remove(output_path)
+    return output_path
+
+
+def _max_new_tokens(duration):
+    return int(256*(duration/5))
+
+
+def _cache_key(prompt, duration, seed=None):
+    """Generation cache key, including the sampling settings the model generates with"""
+    config = Registry.get('musicgen_generation_config')
+    return GenerationCache.generation_key(
+        prompt, duration, MODEL_NAME, seed=seed,
+        do_sample=config.do_sample,
+        guidance_scale=config.guidance_scale,
+        precision=MUSICGEN_PRECISION,
+        temperature=config.temperature,
+        top_k=config.top_k,
+        top_p=config.top_p
+    )
+
+
+def copy_cached_generation(prompt, duration, username, seed=None):
+    """
+    Serve a request from the generation cache without touching the model
+    
+    Returns:
+        str or None: Path of the user's output file on a hit, None on a miss
+    """
+    cache_key = _cache_key(prompt, duration, seed)
+    # On a miss the user's previous clip stays until the queued job replaces it
+    if not GenerationCache.contains(cache_key):
+        return None
+    output_path = _output_path(username)
+    if GenerationCache.copy_to(cache_key, output_path):
+        return output_path
+    return None
+
+
+@timed('generate_music')
+def generate_music(prompt, duration, username, streamer=None, seed=None):
+    """
+    Generate music based on a text prompt
+    
+    Args:
+        prompt (str): Text description of the music to generate
+        duration (float): Duration in seconds (approximate)
+        username (str): User identifier for the output file
+        streamer (MusicgenStreamer): Receives audio chunks while generating
+        seed (int): Random seed for reproducible sampling
+        
+    Returns:
+        str: Path to the generated audio file
+    """
+    output_path = _output_path(username)
+    
+    # Identical requests reuse the cached clip
+    cache_key = _cache_key(prompt, duration, seed)
+    if GenerationCache.copy_to(cache_key, output_path):
+        if streamer is not None:
+            _, audio = scipy.io.wavfile.read(output_path)
+            streamer.replay(audio)
+        return output_path
+    
+    processor, model = musicgen()
     
     # Process the input
     inputs = processor(
@@ -44,10 +365,17 @@ def generate_music(prompt, duration, username):
     )
 
     # Generate audio values (adjust tokens based on duration)
-    audio_values = model.generate(
-        **inputs, 
-        max_new_tokens=int(256*(duration/5))
-    )
+    try:
+        with _sampling_lock.hold(seed), precision_context(model):
+            audio_values = model.generate(
+                **inputs, 
+                max_new_tokens=_max_new_tokens(duration),
+                streamer=streamer
+            )
+    except Exception:
+        if streamer is not None:
+            streamer.abort()
+        raise
 
     # Get sampling rate from model config
     sampling_rate = model.config.audio_encoder.sampling_rate
@@ -56,7 +384,221 @@ def generate_music(prompt, duration, username):
     scipy.io.wavfile.write(
         output_path, 
         rate=sampling_rate, 
-        data=audio_values[0, 0].cpu().numpy()
+        data=audio_values[0, 0].float().cpu().numpy()
     )
+    GenerationCache.store(cache_key, output_path)
     
-    return output_path
\ No newline at end of file
+    return output_path
+
+
+@timed('generate_music_batch')
+def generate_music_batch(prompts, durations, usernames):
+    """
+    Generate several clips with a single batched model.generate call
+    
+    Clips already in the generation cache are copied; the rest run as one
+    batch for the longest requested duration, and every clip is then
+    trimmed to its own length and written to its user's directory.
+    
+    Args:
+        prompts (list): Text descriptions, one per clip
+        durations (list): Durations in seconds (approximate)
+        usernames (list): User identifiers for the output files
+        
+    Returns:
+        list: Paths to the generated audio files, in input order
+    """
+    output_paths = [_output_path(username) for username in usernames]
+    cache_keys = [_cache_key(prompt, duration) for prompt, duration in zip(prompts, durations)]
+    
+    pending = [i for i, (key, path) in enumerate(zip(cache_keys, output_paths))
+               if not GenerationCache.copy_to(key, path)]
+    if not pending:
+        return output_paths
+    
+    processor, model = musicgen()
+    tokens = [_max_new_tokens(durations[i]) for i in pending]
+    
+    # Prompts of different lengths are padded; the attention mask hides the padding
+    inputs = processor(
+        text=[prompts[i] for i in pending],
+        padding=True,
+        return_tensors="pt",
+    )
+    with _sampling_lock.hold(), precision_context(model):
+        audio_values = model.generate(**inputs, max_new_tokens=max(tokens))
+    
+    sampling_rate = model.config.audio_encoder.sampling_rate
+    # Every generated token adds one EnCodec frame of audio
+    samples_per_token = int(np.prod(model.config.audio_encoder.upsampling_ratios))
+    total = audio_values.shape[-1]
+    
+    for row, i in enumerate(pending):
+        length = total - (max(tokens) - tokens[row]) * samples_per_token
+        scipy.io.wavfile.write(
+            output_paths[i],
+            rate=sampling_rate,
+            data=audio_values[row, 0, :length].float().cpu().numpy()
+        )
+        GenerationCache.store(cache_keys[i], output_paths[i])
+    
+    return output_paths
+
+
+def _clip_codes(processor, model, tail, clip_id):
+    """
+    EnCodec codes of a clip's tail, encoded once and then served from the codes cache
+    
+    Returns:
+        torch.LongTensor: (codebooks, frames) codes, the layout generate() takes as decoder_input_ids
+    """
+    key = GenerationCache.codes_key(
+        clip_id, MODEL_NAME,
+        context_seconds=CONTINUE_CONTEXT_SECONDS,
+        samples=len(tail)
+    )
+    codes = GenerationCache.load_codes(key)
+    if codes is None:
+        inputs = processor(
+            audio=tail,
+            sampling_rate=model.config.audio_encoder.sampling_rate,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            encoded = model.audio_encoder.encode(inputs['input_values'], inputs.get('padding_mask'))
+        # (frames=1, batch=1, codebooks, steps) -> (codebooks, steps)
+        codes = encoded.audio_codes[0, 0].cpu().numpy().astype(np.int16)
+        GenerationCache.store_codes(key, codes)
+    return torch.from_numpy(codes.astype(np.int64))
+
+
+@timed('continue_music')
+def continue_music(prompt, duration, username, clip, clip_id, seed=None):
+    """
+    Extend a previously generated clip by `duration` seconds
+    
+    The last CONTINUE_CONTEXT_SECONDS of the clip are encoded to audio codes
+    (cached per clip) and passed to generate() as decoder input ids, so the
+    clip is only prefilled once and only the new tokens are sampled
+    step by step. The new audio is appended to the untouched head of the clip.
+    
+    Args:
+        prompt (str): Text description of the continuation
+        duration (float): Seconds of new audio (approximate)
+        username (str): User identifier for the output file
+        clip (bytes): The stored clip's file contents
+        clip_id (str): Stable identifier of the clip (its GridFS id), for the codes cache
+        seed (int): Random seed for reproducible sampling
+        
+    Returns:
+        str: Path to the extended audio file
+    """
+    processor, model = musicgen()
+    sampling_rate = model.config.audio_encoder.sampling_rate
+    
+    audio, clip_rate = sf.read(io.BytesIO(clip), dtype='float32', always_2d=True)
+    audio = audio.mean(axis=1)
+    if clip_rate != sampling_rate:
+        audio = librosa.resample(audio, orig_sr=clip_rate, target_sr=sampling_rate)
+    
+    context = min(len(audio), int(CONTINUE_CONTEXT_SECONDS * sampling_rate))
+    head, tail = audio[:len(audio) - context], audio[len(audio) - context:]
+    codes = _clip_codes(processor, model, tail, clip_id)
+    
+    inputs = processor(
+        text=prompt,
+        padding=True,
+        return_tensors="pt",
+    )
+    with _sampling_lock.hold(seed), precision_context(model):
+        audio_values = model.generate(
+            **inputs,
+            decoder_input_ids=codes,
+            max_new_tokens=_max_new_tokens(duration)
+        )
+    
+    # The output starts with the decoded context, followed by the new audio
+    extended = np.concatenate([head, audio_values[0, 0].float().cpu().numpy()])
+    
+    output_path = _output_path(username)
+    scipy.io.wavfile.write(output_path, rate=sampling_rate, data=extended)
+    return output_path
+
+
+def _run_generation(**job):
+    if job.get('clip') is not None:
+        return continue_music(**job)
+    return generate_music(**job)
+
+
+def _run_generation_batch(jobs):
+    return generate_music_batch(
+        [job['prompt'] for job in jobs],
+        [job['duration'] for job in jobs],
+        [job['username'] for job in jobs]
+    )
+
+
+def _generation_batch_key(job):
+    """Duration bucket of a queued job; streamed, seeded and continuation jobs always run alone"""
+    if any(job.get(name) is not None for name in ('streamer', 'seed', 'clip')):
+        return None
+    return math.ceil(job['duration'] / GENERATION_BATCH_BUCKET_SECONDS)
+
+
+# Generation runs on background workers; requests only enqueue and poll.
+# Waiting jobs of different users with similar durations share one generate call.
+GenerationQueue = JobQueue(
+    'generation', _run_generation,
+    run_batch=_run_generation_batch,
+    batch_key=_generation_batch_key,
+    max_batch=GENERATION_MAX_BATCH
+)
+
+
+def submit_generation(prompt, duration, username, seed=None):
+    """
+    Queue a generation job for `username`.
+
+    Returns:
+        str: Job id to poll with GenerationQueue.get
+
+    Raises:
+        JobRejected: If the user already has too many jobs pending or the queue is full
+    """
+    return GenerationQueue.submit(username, prompt=prompt, duration=duration, username=username, seed=seed)
+
+
+def submit_streaming_generation(prompt, duration, username, seed=None):
+    """
+    Queue a generation job whose audio is streamed while it runs.
+
+    The full clip is still written to the user's output file at the end.
+
+    Returns:
+        tuple: (job id, MusicgenStreamer to read chunks from)
+
+    Raises:
+        JobRejected: If the user already has too many jobs pending or the queue is full
+    """
+    streamer = create_streamer()
+    job_id = GenerationQueue.submit(
+        username, prompt=prompt, duration=duration, username=username, streamer=streamer, seed=seed
+    )
+    return job_id, streamer
+
+
+def submit_continuation(prompt, duration, username, clip, clip_id, seed=None):
+    """
+    Queue a job extending a stored clip.
+
+    Returns:
+        str: Job id to poll with GenerationQueue.get
+
+    Raises:
+        JobRejected: If the user already has too many jobs pending or the queue is full
+    """
+    return GenerationQueue.submit(
+        username, prompt=prompt, duration=duration, username=username,
+        clip=clip, clip_id=clip_id, seed=seed
+    )
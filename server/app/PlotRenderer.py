@@ -0,0 +1,304 @@
+import io
+import os
+import re
+import time
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from DiskCache import DiskLRUCache
+import Metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('PlotRenderer')
+
+# Processes drawing plots; the parent only computes envelopes
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '1'))
+PLOT_CACHE_MAX_BYTES = int(os.environ.get('PLOT_CACHE_MAX_MB', '256')) * 1024 * 1024
+# How long a plot request waits for a render that has not finished yet
+PLOT_WAIT_SECONDS = float(os.environ.get('PLOT_WAIT_SECONDS', '30'))
+PLOT_FIGSIZE = (14, 5)
+PLOT_DPI = 100
+
+PLOT_KINDS = ('waveform', 'harmonic')
+
+_store = DiskLRUCache('plots', PLOT_CACHE_MAX_BYTES, suffix='.png')
+_KEY_RE = re.compile(r'^[0-9a-f]{64}-(' + '|'.join(PLOT_KINDS) + r')-\d+$')
+
+_executor = None
+_executor_lock = threading.Lock()
+# Draw in the calling process instead of the render processes
+_in_process = False
+_pending = {}  # key -> Future of the cached path
+# content hash -> queued or running analyses that will draw its plots,
+# possibly in another process
+_expected = {}
+# Notified whenever a render or an expected analysis finishes, for
+# requests waiting on a plot
+_rendered = threading.Condition()
+
+
+def plot_key(content_hash, kind, dpi=PLOT_DPI):
+    """Cache key of one plot of the audio with this content hash"""
+    return f"{content_hash}-{kind}-{dpi}"
+
+
+def plot_urls(content_hash, dpi=PLOT_DPI):
+    """URLs of every plot of the audio with this content hash, keyed by kind"""
+    return {kind: f"/plots/{plot_key(content_hash, kind, dpi)}.png" for kind in PLOT_KINDS}
+
+
+def is_plot_key(key):
+    return bool(_KEY_RE.match(key))
+
+
+def envelope(y, width):
+    """
+    Per-column (min, max) of a signal drawn `width` pixels wide.
+
+    Every sample falls in exactly one column, so peaks are never dropped,
+    and the plot draws `width` points instead of every sample.
+
+    Returns:
+        tuple: (times as a fraction of the length, mins, maxs), float32 arrays;
+            empty for an empty signal
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if len(y) == 0:
+        empty = np.empty(0, dtype=np.float32)
+        return empty, empty.copy(), empty.copy()
+    width = max(1, min(int(width), len(y)))
+    edges = np.linspace(0, len(y), width + 1).astype(np.int64)
+    starts = edges[:-1]
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+    centers = ((starts + edges[1:]) / 2.0 / len(y)).astype(np.float32)
+    return centers, mins, maxs
+
+
+def _render(title, duration, series, figsize, dpi):
+    """
+    Draw envelopes to PNG bytes. Runs in a render process.
+
+    Args:
+        title (str): Axes title
+        duration (float): Signal length in seconds, for the time axis
+        series (list): (centers, mins, maxs, color) per signal; each after
+            the first gets its own y axis
+        figsize (tuple): Figure size in inches
+        dpi (int): Resolution
+
+    Returns:
+        bytes: The PNG
+    """
+    # Object-oriented Agg API: no pyplot global state, safe in any thread
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    alpha = 0.5 if len(series) > 1 else 1.0
+    for i, (centers, mins, maxs, color) in enumerate(series):
+        target = ax if i == 0 else ax.twinx()
+        target.fill_between(centers * duration, mins, maxs, color=color, alpha=alpha, linewidth=0)
+        if duration > 0:
+            target.set_xlim(0, duration)
+    ax.set_title(title)
+    ax.set_xlabel('Time (s)')
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Never fork the app itself: its threads may hold locks the
+            # child would inherit. Workers only touch numpy and matplotlib.
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['PlotRenderer'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=context)
+        return _executor
+
+
+def start():
+    """Start the render processes now rather than on the first plot"""
+    executor = _get_executor()
+    for _ in range(RENDER_WORKERS):
+        executor.submit(int)
+
+
+def render_in_process():
+    """
+    Draw plots in this process from now on.
+
+    For the analysis processes: the app's render processes belong to the
+    app, and an analysis process is already off the app's GIL.
+    """
+    global _in_process
+    _in_process = True
+
+
+def _discard_executor(executor):
+    """Drop a pool whose process died; the next render starts a new one"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _check_broken(executor, future):
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        logger.error("Render process died; restarting the render pool")
+        _discard_executor(executor)
+
+
+def _start_render(title, duration, series, dpi):
+    if not _in_process:
+        executor = _get_executor()
+        try:
+            future = executor.submit(_render, title, duration, series, PLOT_FIGSIZE, dpi)
+        except BrokenProcessPool:
+            # Died since the last render; this plot goes to a fresh pool
+            _discard_executor(executor)
+            executor = _get_executor()
+            future = executor.submit(_render, title, duration, series, PLOT_FIGSIZE, dpi)
+        future.add_done_callback(lambda f: _check_broken(executor, f))
+        return future
+    future = Future()
+    try:
+        future.set_result(_render(title, duration, series, PLOT_FIGSIZE, dpi))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _finish(key, outer, render_future, started):
+    try:
+        png = render_future.result()
+        # Queueing plus drawing in the render process
+        Metrics.record('plot_render', time.perf_counter() - started)
+        with _store.writer(key) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+        outer.set_result(_store.path_for(key))
+    except Exception as e:
+        logger.error(f"Rendering plot {key} failed: {str(e)}")
+        outer.set_exception(e)
+    finally:
+        with _rendered:
+            _pending.pop(key, None)
+            _rendered.notify_all()
+
+
+def _submit(key, title, duration, signals, dpi):
+    """
+    Render a plot unless it is cached or already being rendered.
+
+    Args:
+        signals (list): (samples, color) per signal
+
+    Returns:
+        Future: Resolves to the path of the cached PNG
+    """
+    path = _store.get_path(key)
+    if path is not None:
+        future = Future()
+        future.set_result(path)
+        return future
+
+    with _rendered:
+        if key in _pending:
+            return _pending[key]
+        outer = Future()
+        _pending[key] = outer
+
+    started = time.perf_counter()
+    try:
+        width = int(PLOT_FIGSIZE[0] * dpi)
+        with Metrics.timed('plot_envelope'):
+            series = [envelope(y, width) + (color,) for y, color in signals]
+        render_future = _start_render(title, duration, series, dpi)
+    except Exception as e:
+        with _rendered:
+            _pending.pop(key, None)
+            _rendered.notify_all()
+        outer.set_exception(e)
+        return outer
+    render_future.add_done_callback(lambda f: _finish(key, outer, f, started))
+    return outer
+
+
+def submit_waveform(content_hash, y, sr, dpi=PLOT_DPI):
+    """Queue the waveform plot; returns a Future of the PNG path"""
+    return _submit(plot_key(content_hash, 'waveform', dpi), "Waveform",
+                   len(y) / float(sr), [(y, 'C0')], dpi)
+
+
+def submit_harmonic_percussive(content_hash, y_harmonic, y_percussive, sr, dpi=PLOT_DPI):
+    """Queue the harmonic/percussive overlay; returns a Future of the PNG path"""
+    return _submit(plot_key(content_hash, 'harmonic', dpi), "Harmonic (red) and Percussive (blue) Components",
+                   len(y_harmonic) / float(sr), [(y_harmonic, 'r'), (y_percussive, 'b')], dpi)
+
+
+def expect(content_hash):
+    """Note that a queued analysis will draw the plots of this audio, so requests for them wait"""
+    with _rendered:
+        _expected[content_hash] = _expected.get(content_hash, 0) + 1
+
+
+def done_expecting(content_hash):
+    """The analysis noted with expect() finished, successfully or not"""
+    with _rendered:
+        if _expected.get(content_hash, 0) <= 1:
+            _expected.pop(content_hash, None)
+        else:
+            _expected[content_hash] -= 1
+        _rendered.notify_all()
+
+
+def plots_available(content_hash, dpi=PLOT_DPI):
+    """True if every plot of this audio is cached or an analysis will draw it"""
+    with _rendered:
+        if content_hash in _expected:
+            return True
+    return all(os.path.exists(_store.path_for(plot_key(content_hash, kind, dpi))) for kind in PLOT_KINDS)
+
+
+def _is_pending(key):
+    """Caller holds _rendered"""
+    return key in _pending or key.split('-', 1)[0] in _expected
+
+
+def wait_for(key, timeout=PLOT_WAIT_SECONDS):
+    """
+    Path of a cached plot, waiting up to `timeout` seconds while it is being rendered.
+
+    Returns:
+        str or None: The PNG path, or None if it is neither cached nor
+            pending (e.g. evicted), or did not appear in time
+    """
+    path = _store.get_path(key)
+    if path is not None:
+        return path
+    # Renders in this process notify; ones in the analysis processes only
+    # show up on disk, so also poll
+    deadline = time.monotonic() + timeout
+    with _rendered:
+        while not os.path.exists(_store.path_for(key)) and _is_pending(key):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _rendered.wait(min(remaining, 0.5))
+    return _store.get_path(key)
@@ -0,0 +1,208 @@
+import os
+import logging
+import numpy as np
+import scipy.fft
+import soundfile as sf
+import soxr
+import librosa
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('StreamingExtractor')
+
+# Tracks at least this long are analysed block by block instead of being decoded whole
+STREAMING_MIN_SECONDS = float(os.environ.get('STREAMING_MIN_SECONDS', '600'))
+# Seconds of audio read, resampled and analysed per block
+STREAM_BLOCK_SECONDS = float(os.environ.get('STREAM_BLOCK_SECONDS', '30'))
+
+
+def audio_duration(path):
+    """Duration in seconds from the file header, without decoding; None if unknown"""
+    try:
+        return sf.info(path).duration
+    except Exception:
+        return None
+
+
+def should_stream(path):
+    duration = audio_duration(path)
+    return duration is not None and duration >= STREAMING_MIN_SECONDS
+
+
+class RunningStats:
+    """
+    Running min/max/mean/variance merged block by block (Chan et al.'s
+    parallel form of Welford's algorithm), so the frames never need to be
+    kept in memory.
+    """
+
+    def __init__(self, rows=1, per_row=True):
+        """
+        Args:
+            rows (int): Number of independent feature rows
+            per_row (bool): Reduce each row separately; otherwise every element of a block is pooled
+        """
+        self.per_row = per_row
+        rows = rows if per_row else 1
+        self.n = 0
+        self.mean = np.zeros(rows)
+        self.m2 = np.zeros(rows)
+        self.min = np.full(rows, np.inf)
+        self.max = np.full(rows, -np.inf)
+
+    def update(self, x):
+        """Merge a (rows, frames) block"""
+        x = np.asarray(x, dtype=np.float64)
+        x = x.reshape(len(self.mean), -1) if self.per_row else x.reshape(1, -1)
+        n_block = x.shape[1]
+        if n_block == 0:
+            return
+
+        block_mean = x.mean(axis=1)
+        block_m2 = ((x - block_mean[:, None]) ** 2).sum(axis=1)
+
+        n = self.n + n_block
+        delta = block_mean - self.mean
+        self.mean += delta * n_block / n
+        self.m2 += block_m2 + delta ** 2 * self.n * n_block / n
+        self.n = n
+
+        np.minimum(self.min, x.min(axis=1), out=self.min)
+        np.maximum(self.max, x.max(axis=1), out=self.max)
+
+    def result(self):
+        """(rows, 4) array of min, mean, max, population variance"""
+        var = self.m2 / self.n if self.n else np.zeros_like(self.m2)
+        return np.stack([self.min, self.mean, self.max, var], axis=1)
+
+
+def stream_blocks(path, sr, block_seconds=STREAM_BLOCK_SECONDS):
+    """Yield mono float32 blocks of `path` resampled to `sr`, plus the expected total length"""
+    with sf.SoundFile(path) as f:
+        native_sr = f.samplerate
+        total = int(round(f.frames * sr / native_sr))
+        resampler = soxr.ResampleStream(native_sr, sr, 1, dtype='float32') if native_sr != sr else None
+
+        def read():
+            for block in f.blocks(blocksize=int(native_sr * block_seconds), dtype='float32', always_2d=True):
+                mono = block.mean(axis=1)
+                yield mono if resampler is None else resampler.resample_chunk(mono)
+            if resampler is not None:
+                yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+        yield total
+        yield from read()
+
+
+def stream_features(path, sr=22050, n_fft=2048, hop_length=512, n_mfcc=20,
+                    excerpt_seconds=120, block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Compute the frame-level genre features of a file in constant memory.
+
+    The signal is read in blocks and framed exactly like librosa's centred
+    STFT (hann window, zero padding of n_fft // 2 at both ends), so RMS,
+    spectral centroid/bandwidth/rolloff and zero-crossing rate statistics
+    match the in-memory path apart from the first/last frames of ZCR.
+    Chroma uses the tuning estimated on the first block, and the log-mel
+    top_db floor follows the running maximum rather than the global one.
+
+    Harmonic/percussive separation and tonnetz need long-range context, so
+    the middle `excerpt_seconds` of the track are captured and returned for
+    the caller to analyse in memory.
+
+    Returns:
+        dict: 'stats' (name -> (rows, 4) array) for cstft, frame features
+            (srms, specband, speccent, rolloff, zero_crossing_rate) and mfcc;
+            'tempo'; 'excerpt' (np.ndarray); 'duration' in seconds
+    """
+    pad = n_fft // 2
+    window = librosa.filters.get_window('hann', n_fft, fftbins=True)
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=128)
+
+    chroma_stats = RunningStats(per_row=False)
+    frame_stats = RunningStats(rows=5)
+    mfcc_stats = RunningStats(rows=n_mfcc)
+
+    onset_env = []
+    previous_log_mel = None
+    log_mel_max = -np.inf
+    tuning = None
+
+    blocks = stream_blocks(path, sr, block_seconds)
+    total = next(blocks)
+    excerpt_len = min(total, int(excerpt_seconds * sr)) if excerpt_seconds else total
+    excerpt_start = (total - excerpt_len) // 2
+    excerpt = np.zeros(excerpt_len, dtype=np.float32)
+
+    # Samples not yet consumed by a frame, starting with the centre padding
+    buffer = np.zeros(pad, dtype=np.float32)
+    position = 0
+
+    def process(frames):
+        nonlocal previous_log_mel, log_mel_max, tuning
+
+        spectrum = np.abs(scipy.fft.rfft(frames * window[:, None], axis=0)).astype(np.float32)
+        power = spectrum ** 2
+
+        if tuning is None:
+            tuning = librosa.estimate_tuning(S=power, sr=sr, n_fft=n_fft)
+        chroma_stats.update(librosa.feature.chroma_stft(S=power, sr=sr, tuning=tuning))
+
+        zero_crossings = np.where(np.abs(frames) <= 1e-10, 0, frames)
+        zero_crossings = np.signbit(zero_crossings[1:]) != np.signbit(zero_crossings[:-1])
+        frame_stats.update(np.vstack([
+            np.sqrt(np.mean(frames ** 2, axis=0)),
+            librosa.feature.spectral_bandwidth(S=spectrum, sr=sr, n_fft=n_fft),
+            librosa.feature.spectral_centroid(S=spectrum, sr=sr, n_fft=n_fft),
+            librosa.feature.spectral_rolloff(S=spectrum, sr=sr, n_fft=n_fft),
+            zero_crossings.sum(axis=0, keepdims=True) / n_fft,
+        ]))
+
+        log_mel = 10.0 * np.log10(np.maximum(1e-10, mel_basis.dot(power)))
+        log_mel_max = max(log_mel_max, log_mel.max())
+        log_mel = np.maximum(log_mel, log_mel_max - 80.0)
+        mfcc_stats.update(scipy.fft.dct(log_mel, axis=0, type=2, norm='ortho')[:n_mfcc])
+
+        # Onset strength: mean positive first difference across mel bands
+        if previous_log_mel is not None:
+            log_mel = np.hstack([previous_log_mel, log_mel])
+        onset_env.append(np.maximum(0.0, np.diff(log_mel, axis=1)).mean(axis=0))
+        previous_log_mel = log_mel[:, -1:]
+
+    for block in blocks:
+        # Keep the middle excerpt for separation and tonnetz
+        lo = max(position, excerpt_start)
+        hi = min(position + len(block), excerpt_start + excerpt_len)
+        if lo < hi:
+            excerpt[lo - excerpt_start:hi - excerpt_start] = block[lo - position:hi - position]
+        position += len(block)
+
+        buffer = np.concatenate([buffer, block])
+        n_frames = 1 + (len(buffer) - n_fft) // hop_length if len(buffer) >= n_fft else 0
+        if n_frames > 0:
+            process(librosa.util.frame(buffer, frame_length=n_fft, hop_length=hop_length)[:, :n_frames])
+            buffer = buffer[n_frames * hop_length:]
+
+    # Trailing centre padding flushes the last frames (1 + samples // hop in total)
+    buffer = np.concatenate([buffer, np.zeros(pad, dtype=np.float32)])
+    if len(buffer) >= n_fft:
+        process(librosa.util.frame(buffer, frame_length=n_fft, hop_length=hop_length))
+
+    n_total_frames = 1 + position // hop_length
+    onset = np.concatenate(onset_env) if onset_env else np.zeros(0)
+    # Same lag and centring offset librosa.onset.onset_strength applies
+    onset = np.pad(onset, (1 + n_fft // (2 * hop_length), 0))[:n_total_frames]
+    tempo = librosa.feature.tempo(onset_envelope=onset, sr=sr, hop_length=hop_length)[0]
+
+    logger.info(f"Streamed {position / sr:.1f}s of {path} in {block_seconds:.0f}s blocks")
+
+    return {
+        'stats': {
+            'cstft': chroma_stats.result(),
+            'frame_features': frame_stats.result(),
+            'mfcc': mfcc_stats.result(),
+        },
+        'tempo': float(tempo),
+        'excerpt': excerpt[:max(0, min(excerpt_len, position - excerpt_start))],
+        'duration': position / float(sr),
+    }
@@ -0,0 +1,201 @@
+import os
+import logging
+import numpy as np
+import soundfile as sf
+import BlobCache
+from StreamingExtractor import stream_blocks
+from JobQueue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+from Metrics import timed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('WaveformPeaks')
+
+# Samples per (min, max) pair at the finest zoom level
+PEAKS_BASE_SAMPLES = int(os.environ.get('PEAKS_BASE_SAMPLES', '256'))
+# Levels halve the resolution until one has at most this many peaks
+PEAKS_MIN_PEAKS = int(os.environ.get('PEAKS_MIN_PEAKS', '1024'))
+PEAKS_WORKERS = int(os.environ.get('PEAKS_WORKERS', '1'))
+PEAKS_MAX_PENDING_PER_USER = int(os.environ.get('PEAKS_MAX_PENDING_PER_USER', '16'))
+
+PEAKS_VERSION = 1
+PEAKS_BITS = (8, 16)
+
+
+def _reduce_pairs(mins, maxs):
+    """Halve the resolution of a level; an odd last peak is kept as is"""
+    if len(mins) % 2:
+        mins = np.append(mins, mins[-1])
+        maxs = np.append(maxs, maxs[-1])
+    return mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+
+
+def _quantize(x):
+    return np.round(np.clip(x, -1.0, 1.0) * 32767).astype('<i2')
+
+
+@timed('peaks')
+def compute_peaks(path, samples_per_peak=PEAKS_BASE_SAMPLES, min_peaks=PEAKS_MIN_PEAKS):
+    """
+    Min/max peak pyramid of an audio file, read block by block in constant memory.
+
+    Peaks are taken at the file's native sample rate from the mono downmix.
+    Level 0 has one (min, max) pair per `samples_per_peak` samples; every
+    following level halves the resolution, down to at most `min_peaks` pairs.
+
+    Args:
+        path (str): Audio file
+        samples_per_peak (int): Resolution of level 0
+        min_peaks (int): Peak count at which the pyramid stops
+
+    Returns:
+        tuple: (blob, info). blob holds every level back to back as
+            interleaved little-endian int16 (min, max) pairs; info describes
+            the sample rate, duration and each level's samples_per_peak,
+            length (pairs) and byte offset
+    """
+    sr = sf.info(path).samplerate
+    blocks = stream_blocks(path, sr)
+    next(blocks)  # Expected length; the actual count is taken from the blocks
+
+    mins, maxs = [], []
+    carry = np.zeros(0, dtype=np.float32)
+    samples = 0
+    for block in blocks:
+        samples += len(block)
+        data = np.concatenate([carry, block]) if len(carry) else block
+        whole = len(data) // samples_per_peak * samples_per_peak
+        if whole:
+            frames = data[:whole].reshape(-1, samples_per_peak)
+            mins.append(frames.min(axis=1))
+            maxs.append(frames.max(axis=1))
+        carry = data[whole:]
+    if len(carry):
+        # Partial last peak
+        mins.append(np.array([carry.min()], dtype=np.float32))
+        maxs.append(np.array([carry.max()], dtype=np.float32))
+
+    level_mins = np.concatenate(mins) if mins else np.zeros(0, dtype=np.float32)
+    level_maxs = np.concatenate(maxs) if maxs else np.zeros(0, dtype=np.float32)
+
+    chunks = []
+    levels = []
+    offset = 0
+    spp = samples_per_peak
+    while True:
+        data = np.stack([_quantize(level_mins), _quantize(level_maxs)], axis=1).tobytes()
+        levels.append({'samples_per_peak': spp, 'length': len(level_mins), 'offset': offset})
+        chunks.append(data)
+        offset += len(data)
+        if len(level_mins) <= min_peaks:
+            break
+        level_mins, level_maxs = _reduce_pairs(level_mins, level_maxs)
+        spp *= 2
+
+    info = {
+        'version': PEAKS_VERSION,
+        'sample_rate': sr,
+        'samples': samples,
+        'duration': samples / float(sr),
+        'levels': levels,
+    }
+    return b''.join(chunks), info
+
+
+@timed('peaks_read')
+def read_level(fs, peaks, level, bits=16):
+    """
+    One level of a stored pyramid.
+
+    Args:
+        fs (gridfs.GridFS): GridFS holding the pyramid
+        peaks (dict): The file's 'peaks' record
+        level (int): Index into peaks['levels']
+        bits (int): 16 for int16 pairs, 8 for int8 pairs (top byte only)
+
+    Returns:
+        bytes: Interleaved little-endian (min, max) pairs
+    """
+    entry = peaks['levels'][level]
+    grid_out = fs.get(peaks['gridfs_id'])
+    grid_out.seek(entry['offset'])
+    data = grid_out.read(entry['length'] * 4)
+    if bits == 8:
+        return (np.frombuffer(data, dtype='<i2') >> 8).astype(np.int8).tobytes()
+    return data
+
+
+def level_for_width(peaks, width):
+    """Coarsest level with at least `width` peaks (the finest if none has)"""
+    candidates = [i for i, entry in enumerate(peaks['levels']) if entry['length'] >= width]
+    return candidates[-1] if candidates else 0
+
+
+def _run_peaks(store, fs, user_id, gridfs_id, filename):
+    """Compute a file's pyramid, store it in GridFS and record it on the file's metadata"""
+    try:
+        path = BlobCache.local_path(fs, gridfs_id, filename)
+        blob, info = compute_peaks(path)
+        peaks_id = fs.put(blob, filename=f"{gridfs_id}.peaks", content_type='application/octet-stream',
+                          metadata={'user_id': user_id, 'peaks_of': gridfs_id, 'version': PEAKS_VERSION})
+    except Exception as e:
+        store.update(gridfs_id, {'peaks.status': FAILED, 'peaks.error': str(e)})
+        raise
+
+    fields = {f'peaks.{name}': value for name, value in info.items()}
+    fields.update({'peaks.status': DONE, 'peaks.gridfs_id': peaks_id, 'peaks.error': None})
+    if not store.update(gridfs_id, fields):
+        # The file was deleted while its peaks were computed
+        fs.delete(peaks_id)
+        return None
+    logger.info(f"Stored {len(info['levels'])} peak levels for {gridfs_id} ({len(blob)} bytes)")
+    return None
+
+
+PeaksQueue = JobQueue(
+    'peaks',
+    _run_peaks,
+    workers=PEAKS_WORKERS,
+    max_pending_per_user=PEAKS_MAX_PENDING_PER_USER
+)
+
+
+def submit_peaks(store, fs, file_doc):
+    """
+    Queue the pyramid of a stored file and mark it pending on its metadata.
+
+    Returns:
+        dict: The pending peaks record ('status', 'job_id')
+
+    Raises:
+        JobRejected: If the user or the queue is at its limit
+    """
+    gridfs_id = file_doc['gridfs_id']
+    job_id = PeaksQueue.submit(
+        file_doc['user_id'], store=store, fs=fs, user_id=file_doc['user_id'], gridfs_id=gridfs_id,
+        filename=file_doc.get('filename')
+    )
+    store.update(gridfs_id, {'peaks.status': QUEUED, 'peaks.job_id': job_id}, unless={'peaks.status': DONE})
+    return {'status': QUEUED, 'job_id': job_id}
+
+
+def current_peaks(store, fs, file_doc):
+    """
+    Stored peaks record of a file, queueing the computation when none is done or in flight.
+
+    Returns:
+        dict: The peaks record; complete once status is DONE, otherwise
+            'status' is QUEUED or RUNNING with the 'job_id' to poll
+
+    Raises:
+        JobRejected: If a computation was needed but the queue is at its limit
+    """
+    peaks = file_doc.get('peaks') or {}
+    if peaks.get('status') == DONE:
+        return peaks
+
+    job = PeaksQueue.get(peaks['job_id']) if peaks.get('job_id') else None
+    if job is not None and job['status'] in (QUEUED, RUNNING):
+        return dict(peaks, status=job['status'], position=job.get('position'))
+
+    return submit_peaks(store, fs, file_doc)
@@ -0,0 +1,393 @@
+"""
+Benchmark the analysis and generation hot paths on synthetic audio.
+
+Usage (from the server directory):
+    python benchmarks/hot_paths.py --output results.json
+    python benchmarks/hot_paths.py --benchmarks features genre --durations 5 60 --repeats 5
+    python benchmarks/hot_paths.py --baseline results.json --max-regression 0.2
+
+Sine, noise and percussive clips of every requested duration (5 s to
+10 min by default) are synthesised offline with a fixed seed, so runs on
+the same machine see identical inputs. Every benchmark runs in its own
+subprocess so peak RSS is measured per benchmark; one untimed call per
+benchmark loads its models first.
+
+Benchmarks:
+- features:   DataExtractor.load_file (decode + feature_extract)
+- genre:      AnalyseGenre
+- instrument: InstrumentAnalyzer.analyze_instrument
+- key_tempo:  InstrumentAnalyzer.analyze_key_tempo
+- plots:      the waveform and harmonic/percussive plots (envelopes and
+              the Agg render, in process; decode and HPSS are not timed)
+- generate:   generate_music with a tiny randomly initialised MusicGen,
+              so it runs offline and measures the pipeline, not the model
+
+The feature and generation caches are disabled in the workers. When
+models/InstrumentModel.pth is missing the CNN is randomly initialised;
+its cost does not depend on the weights.
+
+Every (benchmark, clip) reports latency percentiles, throughput in
+seconds of audio per second, and the worker's peak RSS, as JSON. With
+--baseline the p50 latencies are compared against an earlier run and the
+script exits non-zero if any got slower by more than --max-regression.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+BENCHMARKS = ('features', 'genre', 'instrument', 'key_tempo', 'plots', 'generate')
+KINDS = ('sine', 'noise', 'percussive')
+DEFAULT_DURATIONS = [5, 30, 120, 600]
+DEFAULT_PROMPTS = [
+    "Hindustani sitar raga, slow tempo",
+    "Energetic bhangra beat with dhol",
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+# Synthetic audio
+
+def synth_sine(seconds, sr, rng):
+    """A C major melody of harmonic tones, one note every half second"""
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    scale = 261.63 * 2 ** (np.array([0, 2, 4, 5, 7, 9, 11, 12]) / 12)
+    notes = rng.choice(scale, size=int(np.ceil(seconds * 2)) + 1)
+    freq = notes[(t * 2).astype(np.int64)]
+    phase = 2 * np.pi * np.cumsum(freq) / sr
+    y = sum(np.sin(k * phase) / k for k in (1, 2, 3))
+    # Soft attack per note so onsets are detectable
+    y *= 1 - np.exp(-((t * 2) % 1) * 20)
+    return (0.3 * y).astype(np.float32)
+
+
+def synth_noise(seconds, sr, rng):
+    return (0.1 * rng.standard_normal(int(seconds * sr))).astype(np.float32)
+
+
+def synth_percussive(seconds, sr, rng, bpm=120):
+    """Kick on every beat, hi-hat on the off-beats"""
+    n = int(seconds * sr)
+    beat = int(sr * 60 / bpm)
+    t = np.arange(beat) / sr
+    kick = np.sin(2 * np.pi * 60 * t) * np.exp(-t * 30)
+    hat = np.zeros(beat)
+    hat_len = beat // 8
+    hat[beat // 2:beat // 2 + hat_len] = rng.standard_normal(hat_len) * np.exp(-np.arange(hat_len) / sr * 200)
+    pattern = 0.5 * kick + 0.2 * hat
+    y = np.tile(pattern, n // beat + 1)[:n]
+    return (y + 0.005 * rng.standard_normal(n)).astype(np.float32)
+
+
+SYNTHS = {'sine': synth_sine, 'noise': synth_noise, 'percussive': synth_percussive}
+
+
+def make_clips(workdir, kinds, durations, sr, seed):
+    """Write every (kind, duration) clip as 16-bit WAV"""
+    import soundfile as sf
+    clips = []
+    for kind in kinds:
+        for duration in durations:
+            path = os.path.join(workdir, f"{kind}_{duration:g}s.wav")
+            rng = np.random.default_rng(seed)
+            sf.write(path, SYNTHS[kind](duration, sr, rng), sr, subtype='PCM_16')
+            clips.append({'name': f"{kind}_{duration:g}s", 'kind': kind, 'duration': duration, 'path': path})
+    return clips
+
+
+# Workers
+
+def _tiny_musicgen():
+    """A randomly initialised MusicGen a few MB in size, with the real model's frame rate and codebooks"""
+    import torch
+    from transformers import (MusicgenForConditionalGeneration, MusicgenConfig, MusicgenDecoderConfig,
+                              T5Config, EncodecConfig, GenerationConfig)
+
+    class ByteProcessor:
+        """Stands in for the T5 tokenizer (not available offline): one token per UTF-8 byte"""
+
+        def __call__(self, text, padding=True, return_tensors='pt'):
+            texts = [text] if isinstance(text, str) else list(text)
+            encoded = [list(t.encode('utf-8')) or [0] for t in texts]
+            width = max(len(ids) for ids in encoded)
+            input_ids = torch.zeros((len(encoded), width), dtype=torch.long)
+            attention_mask = torch.zeros_like(input_ids)
+            for i, ids in enumerate(encoded):
+                input_ids[i, :len(ids)] = torch.tensor(ids)
+                attention_mask[i, :len(ids)] = 1
+            return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+    codebook_size = 64
+    text = T5Config(vocab_size=256, d_model=32, d_kv=8, d_ff=64, num_layers=1, num_heads=2)
+    # 32 kHz at 50 frames/s with 4 codebooks, like facebook/musicgen-small
+    audio = EncodecConfig(hidden_size=32, num_filters=4, num_residual_layers=1, upsampling_ratios=[8, 5, 4, 4],
+                          codebook_size=codebook_size, codebook_dim=32, target_bandwidths=[1.2],
+                          sampling_rate=32000, audio_channels=1)
+    decoder = MusicgenDecoderConfig(vocab_size=codebook_size, hidden_size=32, num_hidden_layers=2,
+                                    num_attention_heads=2, ffn_dim=64, num_codebooks=4)
+    config = MusicgenConfig(text_encoder=text.to_dict(), audio_encoder=audio.to_dict(), decoder=decoder.to_dict())
+
+    torch.manual_seed(0)
+    model = MusicgenForConditionalGeneration(config)
+    model.eval()
+    model.generation_config = GenerationConfig(
+        decoder_start_token_id=codebook_size, pad_token_id=codebook_size,
+        do_sample=True, guidance_scale=3.0, max_length=1500, top_k=250
+    )
+    model.inference_precision = 'fp32'
+    return ByteProcessor(), model
+
+
+def _random_instrument_pool():
+    from DataExtractor import InstrumentModelPool, InstrumentClassifier
+    model = InstrumentClassifier((141, 216), 5)
+    model.eval()
+    InstrumentModelPool.add(model)
+    return InstrumentModelPool
+
+
+def _path(clip):
+    return clip['path']
+
+
+def _setup(benchmark):
+    """
+    Import what a benchmark needs.
+
+    Returns:
+        tuple: (prepare(clip), call(prepared), info dict); prepare does the
+            untimed per-clip setup and its result is passed to every call
+    """
+    from ModelRegistry import Registry
+    info = {}
+
+    if benchmark == 'features':
+        from DataExtractor import DataExtractor
+        return _path, lambda path: DataExtractor().load_file(path), info
+
+    if benchmark == 'genre':
+        from GenreAnalysis import AnalyseGenre
+        return _path, AnalyseGenre, info
+
+    if benchmark in ('instrument', 'key_tempo'):
+        if benchmark == 'instrument' and not os.path.exists(os.path.join(APP_DIR, '..', 'models', 'InstrumentModel.pth')):
+            # Registered before InstrumentAnalysis registers the real loader
+            Registry.register('instrument', _random_instrument_pool)
+            info['weights'] = 'random'
+        from InstrumentAnalysis import InstrumentAnalyzer
+
+        analyze = getattr(InstrumentAnalyzer, f"analyze_{benchmark}")
+
+        def call(path):
+            result = analyze(path)
+            if not isinstance(result, dict) or result.get('status') != 'success':
+                raise RuntimeError(f"{benchmark} analysis failed: {result}")
+        return _path, call, info
+
+    if benchmark == 'plots':
+        import PlotRenderer
+        from DataExtractor import DataExtractor
+
+        def prepare(clip):
+            # Decode and separation are what the plots are drawn from
+            extractor = DataExtractor()
+            extractor.load_file(clip['path'])
+            return extractor
+
+        def call(extractor):
+            width = int(PlotRenderer.PLOT_FIGSIZE[0] * PlotRenderer.PLOT_DPI)
+            for title, signals in (("Waveform", [(extractor.y, 'C0')]),
+                                   ("Harmonic and Percussive", [(extractor.y_harmonic, 'r'),
+                                                                (extractor.y_percussive, 'b')])):
+                series = [PlotRenderer.envelope(y, width) + (color,) for y, color in signals]
+                PlotRenderer._render(title, len(signals[0][0]) / float(extractor.sr), series,
+                                     PlotRenderer.PLOT_FIGSIZE, PlotRenderer.PLOT_DPI)
+        return prepare, call, info
+
+    if benchmark == 'generate':
+        from transformers import GenerationConfig
+        tiny = _tiny_musicgen()
+        # Registered before MusicGenerator registers the real model
+        Registry.register('musicgen', lambda: tiny)
+        Registry.register('musicgen_generation_config', lambda: GenerationConfig.from_dict(tiny[1].generation_config.to_dict()))
+        from MusicGenerator import generate_music
+        info['model'] = 'tiny-random'
+        seeds = iter(range(1 << 30))
+        return (lambda clip: clip,
+                lambda clip: generate_music(clip['prompt'], clip['duration'], 'benchmark', seed=next(seeds)), info)
+
+    raise ValueError(f"Unknown benchmark {benchmark!r}")
+
+
+def latency_stats(samples):
+    samples = np.asarray(samples)
+    return {
+        'mean': float(samples.mean()),
+        'min': float(samples.min()),
+        'p50': float(np.percentile(samples, 50)),
+        'p90': float(np.percentile(samples, 90)),
+        'p99': float(np.percentile(samples, 99)),
+        'max': float(samples.max()),
+    }
+
+
+def run_worker(benchmark, clips, repeats, output):
+    """Time every clip `repeats` times in this process and write the results"""
+    prepare, call, info = _setup(benchmark)
+
+    # Model loading and first-call costs stay out of the timings
+    start = time.perf_counter()
+    call(prepare(clips[0]))
+    warmup_seconds = time.perf_counter() - start
+
+    results = {}
+    for clip in clips:
+        prepared = prepare(clip)
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call(prepared)
+            samples.append(time.perf_counter() - start)
+        result = {
+            'kind': clip['kind'],
+            'audio_seconds': clip['duration'],
+            'repeats': repeats,
+            'latency_seconds': latency_stats(samples),
+            # Seconds of audio analysed (or generated) per wall-clock second
+            'throughput': clip['duration'] / float(np.mean(samples)),
+        }
+        if benchmark == 'generate':
+            from MusicGenerator import _max_new_tokens
+            result['tokens_per_second'] = _max_new_tokens(clip['duration']) / float(np.mean(samples))
+        results[clip['name']] = result
+
+    with open(output, 'w') as f:
+        json.dump({'info': info, 'warmup_seconds': warmup_seconds, 'peak_rss_mb': peak_rss_mb(),
+                   'clips': results}, f)
+
+
+# Driver
+
+def environment():
+    import librosa
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'librosa': librosa.__version__,
+    }
+
+
+def compare(baseline, report, max_regression):
+    """p50 latency ratios against a baseline report; True if none exceeds 1 + max_regression"""
+    passed = True
+    for benchmark, result in report['benchmarks'].items():
+        old = baseline.get('benchmarks', {}).get(benchmark)
+        if not old or 'clips' not in old or 'clips' not in result:
+            continue
+        for name, clip in result['clips'].items():
+            if name not in old['clips']:
+                continue
+            ratio = clip['latency_seconds']['p50'] / old['clips'][name]['latency_seconds']['p50']
+            clip['p50_vs_baseline'] = round(ratio, 3)
+            if ratio > 1 + max_regression:
+                passed = False
+                print(f"Regression: {benchmark} {name} p50 {ratio:.2f}x baseline", file=sys.stderr)
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=BENCHMARKS)
+    parser.add_argument('--kinds', nargs='+', default=list(KINDS), choices=KINDS)
+    parser.add_argument('--durations', nargs='+', type=float, default=DEFAULT_DURATIONS,
+                        help='Clip lengths in seconds')
+    parser.add_argument('--generation-durations', nargs='+', type=float, default=[5, 10],
+                        help='Lengths of the generated clips in seconds')
+    parser.add_argument('--prompts', nargs='+', default=DEFAULT_PROMPTS)
+    parser.add_argument('--repeats', type=int, default=3, help='Timed calls per clip')
+    parser.add_argument('--sample-rate', type=int, default=44100, help='Sample rate of the synthetic clips')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report here as well as to stdout')
+    parser.add_argument('--baseline', help='Earlier report to compare p50 latencies against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Largest allowed p50 slowdown against the baseline, as a fraction')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--clips', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.clips) as f:
+            run_worker(args.worker, json.load(f), args.repeats, args.result)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='hot_paths_')
+    audio_clips = make_clips(workdir, args.kinds, args.durations, args.sample_rate, args.seed)
+    generation_clips = [
+        {'name': f"prompt{i}_{duration:g}s", 'kind': 'generation', 'duration': duration, 'prompt': prompt}
+        for i, prompt in enumerate(args.prompts) for duration in args.generation_durations
+    ]
+
+    # Fresh caches, and no cache hits inside the timings
+    env = dict(os.environ, CACHE_ROOT=os.path.join(workdir, 'cache'), FEATURE_CACHE='0', GENERATION_CACHE='0',
+               MODEL_WARMUP='0')
+    report = {'environment': environment(), 'repeats': args.repeats, 'sample_rate': args.sample_rate,
+              'seed': args.seed, 'benchmarks': {}}
+    passed = True
+    for benchmark in args.benchmarks:
+        clips = generation_clips if benchmark == 'generate' else audio_clips
+        clips_path = os.path.join(workdir, f"{benchmark}_clips.json")
+        result_path = os.path.join(workdir, f"{benchmark}.json")
+        with open(clips_path, 'w') as f:
+            json.dump(clips, f)
+        print(f"Running {benchmark} on {len(clips)} clips", file=sys.stderr)
+        # MusicGenerator writes its clips under ./out
+        completed = subprocess.run([
+            sys.executable, os.path.abspath(__file__), '--worker', benchmark, '--clips', clips_path,
+            '--result', result_path, '--repeats', str(args.repeats),
+        ], env=env, cwd=workdir)
+        if completed.returncode != 0:
+            report['benchmarks'][benchmark] = {'error': f"worker exited with status {completed.returncode}"}
+            passed = False
+            continue
+        with open(result_path) as f:
+            report['benchmarks'][benchmark] = json.load(f)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            passed = compare(json.load(f), report, args.max_regression) and passed
+    report['passed'] = passed
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
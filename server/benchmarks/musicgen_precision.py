@@ -0,0 +1,156 @@
+"""
+Compare MusicGen CPU inference precisions: speed, memory and output quality.
+
+Usage (from the server directory):
+    python benchmarks/musicgen_precision.py --modes fp32 int8 bf16 --duration 5 --seeds 0 1 2
+
+Every mode runs in its own subprocess so peak RSS is measured per mode.
+Each (prompt, seed) pair is generated with the seed fixed, and the script
+reports generated tokens per second, the model load time and peak RSS.
+
+Sampled token sequences diverge quickly once the numerics differ, so a
+waveform diff would be meaningless. Quality is compared against the fp32
+clip of the same prompt and seed in two ways:
+- the mean absolute difference of the time-averaged log-mel spectra, in dB
+- the loudness ratio
+The script exits non-zero if any mode's spectral distance exceeds
+--max-spectral-distance.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+DEFAULT_PROMPTS = [
+    "Hindustani sitar raga, slow tempo",
+    "Energetic bhangra beat with dhol",
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_worker(mode, prompts, seeds, duration, output):
+    """Generate every (prompt, seed) clip in one precision and save audio plus timings"""
+    import torch
+    from MusicGenerator import load_musicgen, precision_context
+
+    start = time.perf_counter()
+    processor, model = load_musicgen(mode)
+    load_seconds = time.perf_counter() - start
+
+    max_new_tokens = int(256 * (duration / 5))
+    audio = {}
+    runs = []
+    for prompt_index, prompt in enumerate(prompts):
+        inputs = processor(text=prompt, padding=True, return_tensors="pt")
+        for seed in seeds:
+            torch.manual_seed(seed)
+            start = time.perf_counter()
+            with precision_context(model):
+                values = model.generate(**inputs, max_new_tokens=max_new_tokens)
+            elapsed = time.perf_counter() - start
+            audio[f"{prompt_index}_{seed}"] = values[0, 0].float().cpu().numpy()
+            runs.append({'prompt': prompt, 'seed': seed, 'seconds': elapsed,
+                         'tokens_per_second': max_new_tokens / elapsed})
+
+    np.savez(output + '.npz', **audio)
+    with open(output + '.json', 'w') as f:
+        json.dump({
+            'requested': mode,
+            'precision': model.inference_precision,
+            'sampling_rate': model.config.audio_encoder.sampling_rate,
+            'load_seconds': load_seconds,
+            'peak_rss_mb': peak_rss_mb(),
+            'runs': runs,
+        }, f)
+
+
+def mean_log_mel(y, sr):
+    import librosa
+    mel = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=64)
+    return librosa.power_to_db(mel, ref=1.0).mean(axis=1)
+
+
+def compare(reference, candidate, sr):
+    """Spectral distance (dB) and loudness ratio of a candidate clip against the fp32 clip"""
+    n = min(len(reference), len(candidate))
+    reference, candidate = reference[:n], candidate[:n]
+    distance = np.abs(mean_log_mel(reference, sr) - mean_log_mel(candidate, sr)).mean()
+    loudness = np.sqrt(np.mean(candidate ** 2)) / max(np.sqrt(np.mean(reference ** 2)), 1e-8)
+    return float(distance), float(loudness)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['fp32', 'int8', 'bf16'])
+    parser.add_argument('--prompts', nargs='+', default=DEFAULT_PROMPTS)
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--duration', type=float, default=5, help='Clip length in seconds')
+    parser.add_argument('--max-spectral-distance', type=float, default=3.0,
+                        help='Largest allowed mean log-mel difference from fp32, in dB')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.prompts, args.seeds, args.duration, args.output)
+        return
+
+    # fp32 is the quality reference
+    modes = ['fp32'] + [mode for mode in args.modes if mode != 'fp32']
+    workdir = tempfile.mkdtemp(prefix='musicgen_precision_')
+    results = {}
+    for mode in modes:
+        output = os.path.join(workdir, mode)
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), '--worker', mode, '--output', output,
+            '--duration', str(args.duration), '--prompts', *args.prompts,
+            '--seeds', *[str(seed) for seed in args.seeds],
+        ], check=True)
+        with open(output + '.json') as f:
+            results[mode] = json.load(f)
+        with np.load(output + '.npz') as data:
+            results[mode]['audio'] = {name: data[name] for name in data.files}
+
+    reference = results['fp32']
+    sr = reference['sampling_rate']
+    report = {}
+    passed = True
+    for mode, result in results.items():
+        distances = []
+        loudness = []
+        for name, clip in result['audio'].items():
+            distance, ratio = compare(reference['audio'][name], clip, sr)
+            distances.append(distance)
+            loudness.append(ratio)
+        tokens_per_second = [run['tokens_per_second'] for run in result['runs']]
+        report[mode] = {
+            'precision': result['precision'],
+            'tokens_per_second': float(np.mean(tokens_per_second)),
+            'speedup_vs_fp32': float(np.mean(tokens_per_second) /
+                                     np.mean([run['tokens_per_second'] for run in reference['runs']])),
+            'load_seconds': round(result['load_seconds'], 2),
+            'peak_rss_mb': round(result['peak_rss_mb'], 1),
+            'max_spectral_distance_db': max(distances),
+            'mean_loudness_ratio': float(np.mean(loudness)),
+        }
+        passed = passed and max(distances) <= args.max_spectral_distance
+
+    print(json.dumps({'duration': args.duration, 'seeds': args.seeds, 'passed': passed, 'modes': report}, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Check that a cheaper harmonic/percussive separation setting keeps the
+120-feature vector close enough for the genre model.
+
+Usage (from the server directory):
+    python benchmarks/separation_parity.py song1.mp3 song2.mp3 --excerpt 60 --kernel 17
+
+Each file is analysed twice from one decode: once with the reference
+separation (librosa.effects.hpss on the whole track, kernel 31) and once
+with the candidate settings. The script reports the largest per-feature
+deviation and the genre probability shift, and exits non-zero if any file
+changes its predicted genre or moves a class probability by more than
+--prob-tolerance.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+import FeatureCache
+from AnalysisContext import AudioAnalysisContext
+from DataExtractor import DataExtractor
+from xgboost import XGBClassifier
+
+MODEL_PATH = os.path.join(APP_DIR, '..', 'models', 'GenreModel.json')
+
+
+def extract(context, **separation):
+    start = time.perf_counter()
+    extractor = DataExtractor(**separation)
+    extractor.load_context(context)
+    elapsed = time.perf_counter() - start
+    return extractor.features_df, elapsed
+
+
+def compare(path, model, candidate):
+    context = AudioAnalysisContext(path)
+    # Warm the shared STFT so the timings only cover separation-dependent work
+    context.complex_stft()
+
+    reference_df, reference_time = extract(
+        context, separation_mode='full', separation_excerpt=0, separation_kernel=31
+    )
+    candidate_df, candidate_time = extract(context, **candidate)
+
+    reference = reference_df.to_numpy().reshape(1, 120)
+    values = candidate_df.to_numpy().reshape(1, 120)
+
+    relative = np.abs(values - reference) / (np.abs(reference) + 1e-8)
+    worst = np.argsort(relative.ravel())[::-1][:5]
+    names = [f"{row}.{col}" for row in reference_df.index for col in reference_df.columns]
+
+    reference_probs = model.predict_proba(reference)[0]
+    candidate_probs = model.predict_proba(values)[0]
+
+    return {
+        'path': path,
+        'duration_seconds': round(context.duration, 2),
+        'reference_seconds': round(reference_time, 3),
+        'candidate_seconds': round(candidate_time, 3),
+        'max_relative_deviation': float(relative.max()),
+        'worst_features': {names[i]: float(relative.ravel()[i]) for i in worst},
+        'genre_match': int(np.argmax(reference_probs)) == int(np.argmax(candidate_probs)),
+        'max_probability_shift': float(np.abs(reference_probs - candidate_probs).max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='Audio files to check')
+    parser.add_argument('--mode', default='stft', choices=['stft', 'full'])
+    parser.add_argument('--excerpt', type=float, default=120, help='Excerpt length in seconds (0 = whole track)')
+    parser.add_argument('--kernel', type=int, default=31, help='Median filter length')
+    parser.add_argument('--prob-tolerance', type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Both runs must actually compute their features
+    FeatureCache.FEATURE_CACHE_ENABLED = False
+
+    model = XGBClassifier()
+    model.load_model(MODEL_PATH)
+
+    candidate = {
+        'separation_mode': args.mode,
+        'separation_excerpt': args.excerpt,
+        'separation_kernel': args.kernel,
+    }
+
+    results = [compare(path, model, candidate) for path in args.paths]
+    passed = all(r['genre_match'] and r['max_probability_shift'] <= args.prob_tolerance for r in results)
+
+    print(json.dumps({'candidate': candidate, 'passed': passed, 'results': results}, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Move file references out of user documents into the file metadata collections.
+
+Usage (from the server directory):
+    MONGO_URI=mongodb://localhost:27017/Musicgen python migrations/migrate_file_metadata.py
+    python migrations/migrate_file_metadata.py --mongo-uri ... --unset
+
+Copies every entry of the embedded `audio_files` and `generated-audio`
+arrays into the `audio_files` and `generated_audio` collections and
+creates their indexes. The script is idempotent, so it can run before the
+new server is deployed and once more afterwards to pick up files uploaded
+by the old one in between. Pass --unset on the final run to drop the
+arrays from the user documents.
+"""
+import os
+import sys
+import json
+import argparse
+from pymongo import MongoClient
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+from FileMetadata import FileMetadataStore, migrate_embedded_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI'),
+                        help='Connection string including the database name (default: $MONGO_URI)')
+    parser.add_argument('--unset', action='store_true', help='Remove the embedded arrays after copying')
+    args = parser.parse_args()
+    if not args.mongo_uri:
+        parser.error('--mongo-uri or MONGO_URI is required')
+
+    db = MongoClient(args.mongo_uri).get_default_database()
+    copied = migrate_embedded_files(db.users, {
+        'audio_files': FileMetadataStore(db.audio_files, 'uploaded_at'),
+        'generated-audio': FileMetadataStore(db.generated_audio, 'created_at'),
+    }, unset=args.unset)
+    print(json.dumps(copied, indent=2))
+
+
+if __name__ == '__main__':
+    main()
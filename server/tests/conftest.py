@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+# Never reach out to the Hugging Face hub from tests; model loads fail fast instead
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+# On-disk caches write under CACHE_ROOT; keep test runs out of the app's cache
+os.environ.setdefault('CACHE_ROOT', tempfile.mkdtemp(prefix='server-tests-'))
@@ -0,0 +1,90 @@
+import pytest
+import AnalysisPipeline
+import BlobCache
+
+
+@pytest.fixture
+def blob(tmp_path, monkeypatch):
+    """A blob cache that hands out one local file and counts the fetches"""
+    path = tmp_path / 'clip.wav'
+    path.write_bytes(b'audio')
+    fetches = []
+
+    def local_path(fs, gridfs_id, filename=None):
+        fetches.append(gridfs_id)
+        path.write_bytes(b'audio')
+        return str(path)
+
+    monkeypatch.setattr(BlobCache, 'local_path', local_path)
+    return path, fetches
+
+
+def test_refetches_a_copy_evicted_before_it_was_read(blob):
+    path, fetches = blob
+    calls = []
+
+    def analyse(file_path):
+        calls.append(file_path)
+        if len(calls) == 1:
+            # Evicted by another process between local_path() and the decode
+            path.unlink()
+            raise FileNotFoundError(file_path)
+        return {'genre': 'Bengali'}
+
+    assert AnalysisPipeline._with_local_copy(None, 'id1', 'clip.wav', analyse) == {'genre': 'Bengali'}
+    assert fetches == ['id1', 'id1']
+    assert calls == [str(path), str(path)]
+
+
+def test_other_missing_files_are_not_retried(blob):
+    _, fetches = blob
+
+    def analyse(file_path):
+        raise FileNotFoundError('InstrumentModel.pth')
+
+    with pytest.raises(FileNotFoundError):
+        AnalysisPipeline._with_local_copy(None, 'id1', 'clip.wav', analyse)
+    assert fetches == ['id1']
+
+
+def test_evicted_plots_are_redrawn_without_a_new_analysis(tmp_path, monkeypatch):
+    import hashlib
+    import time
+    import numpy as np
+    import soundfile as sf
+    import PlotRenderer
+    from JobQueue import DONE, FAILED
+
+    sr = 22050
+    t = np.arange(2 * sr) / sr
+    path = str(tmp_path / 'clip.wav')
+    sf.write(path, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr)
+    monkeypatch.setattr(BlobCache, 'local_path', lambda fs, gridfs_id, filename=None: path)
+    monkeypatch.setattr(AnalysisPipeline, 'ANALYSIS_PROCESSES', 0)
+    monkeypatch.setattr(PlotRenderer, '_in_process', True)
+
+    def no_analysis(*args):
+        raise AssertionError('redraws must not re-run the analysis')
+
+    monkeypatch.setattr(AnalysisPipeline, 'analyze_file', no_analysis)
+
+    content_hash = hashlib.sha256(b'redraw test').hexdigest()
+    file_doc = {'user_id': 'alice', 'gridfs_id': 'id1', 'filename': 'clip.wav',
+                'analysis': {'status': DONE, 'results': {'genre': 'Bengali', 'content_hash': content_hash}}}
+    analyses = AnalysisPipeline.AnalysisQueue.stats()['submitted']
+    redraws = AnalysisPipeline.RedrawQueue.stats()['submitted']
+
+    assert not PlotRenderer.plots_available(content_hash)
+    assert AnalysisPipeline.current_analysis(None, None, file_doc) is file_doc['analysis']
+    # Already queued: later lookups neither requeue it nor start an analysis
+    AnalysisPipeline.current_analysis(None, None, file_doc)
+
+    deadline = time.monotonic() + 60
+    while content_hash in PlotRenderer._expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert AnalysisPipeline.RedrawQueue.stats()['submitted'] == redraws + 1
+    assert AnalysisPipeline.AnalysisQueue.stats()['submitted'] == analyses
+    assert AnalysisPipeline.RedrawQueue.stats()['failed'] == 0
+    for kind in PlotRenderer.PLOT_KINDS:
+        assert PlotRenderer.wait_for(PlotRenderer.plot_key(content_hash, kind), timeout=0) is not None
@@ -0,0 +1,75 @@
+import time
+import threading
+import pytest
+from BatchScheduler import BatchScheduler
+
+
+def recording_runner(batches):
+    """run_batch that records each batch it is handed and doubles every item"""
+    def run(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+    return run
+
+
+def test_flushes_as_soon_as_the_batch_is_full():
+    batches = []
+    # A long wait means only a full batch can trigger the flush in time
+    scheduler = BatchScheduler('test-size', recording_runner(batches), max_batch=4, max_wait_ms=10_000)
+
+    start = time.monotonic()
+    futures = [scheduler.submit(i) for i in range(4)]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert time.monotonic() - start < 5
+    assert results == [0, 2, 4, 6]
+    assert batches == [[0, 1, 2, 3]]
+    assert scheduler.stats()['batch_size_counts'] == {'4': 1}
+
+
+def test_flushes_a_partial_batch_after_the_wait():
+    batches = []
+    scheduler = BatchScheduler('test-latency', recording_runner(batches), max_batch=100, max_wait_ms=50)
+
+    start = time.monotonic()
+    futures = [scheduler.submit(i) for i in range(3)]
+    results = [future.result(timeout=5) for future in futures]
+    elapsed = time.monotonic() - start
+
+    assert results == [0, 2, 4]
+    assert batches == [[0, 1, 2]]
+    assert 0.04 <= elapsed < 2
+    stats = scheduler.stats()
+    assert stats['batches'] == 1
+    assert stats['mean_batch_size'] == 3
+
+
+def test_concurrent_callers_get_their_own_results():
+    batches = []
+    scheduler = BatchScheduler('test-routing', recording_runner(batches), max_batch=8, max_wait_ms=20)
+    results = {}
+
+    def call(i):
+        results[i] = scheduler.submit(i).result(timeout=5)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: i * 2 for i in range(20)}
+    assert all(len(batch) <= 8 for batch in batches)
+    assert sum(len(batch) for batch in batches) == 20
+
+
+def test_batch_errors_reach_every_caller():
+    def fail(items):
+        raise ValueError("bad batch")
+
+    scheduler = BatchScheduler('test-error', fail, max_batch=2, max_wait_ms=10_000)
+    futures = [scheduler.submit(i) for i in range(2)]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
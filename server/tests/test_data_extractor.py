@@ -0,0 +1,99 @@
+import importlib
+import os
+import subprocess
+import sys
+import textwrap
+import librosa
+import numpy as np
+import pytest
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'app'))
+SKIP_EXIT_CODE = 77
+
+
+def import_or_skip(name):
+    """Import an app module, skipping when its pretrained models can't be loaded offline"""
+    try:
+        return importlib.import_module(name)
+    except OSError as exc:
+        pytest.skip(f'{name} needs pretrained models: {exc}')
+
+
+def synthetic_clip(sr=22050, seconds=4):
+    rng = np.random.default_rng(8)
+    t = np.arange(seconds * sr) / sr
+    tone = 0.4 * np.sin(2 * np.pi * 330 * t) * (1 + np.sin(2 * np.pi * 2 * t)) / 2
+    return (tone + 0.05 * rng.standard_normal(len(t))).astype(np.float32), sr
+
+
+def reductions(x):
+    return np.array([np.min(x), np.mean(x), np.max(x), np.var(x)])
+
+
+def row_reductions(x):
+    return np.stack([np.min(x, axis=1), np.mean(x, axis=1), np.max(x, axis=1), np.var(x, axis=1)], axis=1)
+
+
+def test_features_match_per_feature_reductions():
+    DataExtractor = import_or_skip('DataExtractor')
+    y, sr = synthetic_clip()
+
+    extractor = DataExtractor.DataExtractor()
+    extractor.load_data(y, sr)
+    features = extractor.features
+    context = extractor.context
+
+    assert features.dtype == np.float32
+    assert features.shape == (len(DataExtractor.feature_names()), 4)
+    data = extractor.get_data()
+    assert data.shape == (120, 1)
+    assert data.dtype == np.float32
+
+    close = dict(rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(features[0], [extractor.tempo, extractor.tempo, extractor.tempo, 0], **close)
+    np.testing.assert_allclose(features[1], reductions(extractor.y_harmonic), **close)
+    np.testing.assert_allclose(features[2], reductions(extractor.y_percussive), **close)
+    np.testing.assert_allclose(features[3], reductions(extractor.tonnetz), **close)
+    np.testing.assert_allclose(features[4], reductions(context.chroma()), **close)
+
+    hop_length = context.hop_length
+    np.testing.assert_allclose(features[5], reductions(librosa.feature.rms(y=y, hop_length=hop_length)), **close)
+    np.testing.assert_allclose(features[5:10], row_reductions(extractor._feature_cache['frame_features']), **close)
+    np.testing.assert_allclose(
+        features[9], reductions(librosa.feature.zero_crossing_rate(y=y, hop_length=hop_length)), **close
+    )
+    np.testing.assert_allclose(features[10:], row_reductions(context.mfcc(n_mfcc=extractor.n_mfcc)), **close)
+
+
+def test_extraction_does_not_need_pandas():
+    # xgboost and transformers pull pandas in when it is installed, so block
+    # it outright in a fresh interpreter rather than checking sys.modules
+    script = textwrap.dedent(f"""
+        import sys
+        sys.modules['pandas'] = None
+        sys.path.insert(0, {APP_DIR!r})
+        import numpy as np
+        try:
+            import DataExtractor
+        except OSError:
+            sys.exit({SKIP_EXIT_CODE})
+
+        sr = 22050
+        t = np.arange(2 * sr) / sr
+        extractor = DataExtractor.DataExtractor()
+        extractor.load_data((0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr)
+        assert extractor.get_data().shape == (120, 1)
+        try:
+            extractor.features_df
+        except ImportError:
+            print('features_df needs pandas')
+        else:
+            raise AssertionError('features_df built without pandas')
+    """)
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            env=dict(os.environ), timeout=300)
+
+    if result.returncode == SKIP_EXIT_CODE:
+        pytest.skip('DataExtractor needs pretrained models')
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert 'features_df needs pandas' in result.stdout
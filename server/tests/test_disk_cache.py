@@ -0,0 +1,121 @@
+import os
+from DiskCache import DiskLRUCache
+
+
+def age(cache, key, mtime):
+    os.utime(cache.path_for(key), (mtime, mtime))
+
+
+def test_put_and_get(tmp_path):
+    cache = DiskLRUCache('test', 1000, directory=str(tmp_path), suffix='.bin')
+    assert cache.get_path('ab12') is None
+
+    path = cache.put_bytes('ab12', b'x' * 10)
+    assert path == os.path.join(str(tmp_path), 'ab', 'ab12.bin')
+    assert cache.get_path('ab12') == path
+    with open(path, 'rb') as f:
+        assert f.read() == b'x' * 10
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['writes']) == (1, 1, 1)
+    assert stats['bytes'] == 10
+
+
+def test_overwrite_replaces_size(tmp_path):
+    cache = DiskLRUCache('test', 1000, directory=str(tmp_path))
+    cache.put_bytes('k1', b'x' * 100)
+    cache.put_bytes('k1', b'x' * 40)
+    assert cache.stats()['bytes'] == 40
+
+
+def test_failed_write_leaves_nothing(tmp_path):
+    cache = DiskLRUCache('test', 1000, directory=str(tmp_path))
+    try:
+        with cache.writer('k1') as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(b'partial')
+            raise RuntimeError('interrupted')
+    except RuntimeError:
+        pass
+    assert cache.get_path('k1') is None
+    assert cache.stats()['bytes'] == 0
+    assert os.listdir(os.path.join(str(tmp_path), 'k1')) == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache('test', 250, directory=str(tmp_path))
+    cache.put_bytes('aa', b'a' * 100)
+    cache.put_bytes('bb', b'b' * 100)
+    age(cache, 'aa', 1000)
+    age(cache, 'bb', 2000)
+    # A hit makes 'aa' the most recently used
+    assert cache.get_path('aa') is not None
+
+    cache.put_bytes('cc', b'c' * 100)
+
+    assert cache.get_path('bb') is None
+    assert cache.get_path('aa') is not None
+    assert cache.get_path('cc') is not None
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 200
+
+
+def test_evicts_down_to_ninety_percent(tmp_path):
+    cache = DiskLRUCache('test', 1000, directory=str(tmp_path))
+    for i, key in enumerate(['k0', 'k1', 'k2', 'k3', 'k4']):
+        cache.put_bytes(key, b'x' * 200)
+        age(cache, key, 1000 + i)
+
+    cache.put_bytes('k5', b'x' * 200)
+
+    # 1200 bytes over a 1000 byte limit: the two oldest go, leaving 800 <= 900
+    assert [cache.get_path(key) is None for key in ['k0', 'k1', 'k2', 'k3', 'k4', 'k5']] == \
+        [True, True, False, False, False, False]
+    assert cache.stats()['bytes'] == 800
+
+
+def test_size_survives_restart(tmp_path):
+    cache = DiskLRUCache('test', 1000, directory=str(tmp_path))
+    cache.put_bytes('k1', b'x' * 30)
+    cache.put_bytes('k2', b'x' * 70)
+
+    reopened = DiskLRUCache('test', 1000, directory=str(tmp_path))
+    assert reopened.stats()['bytes'] == 100
+    assert reopened.get_path('k2') is not None
+
+
+def disk_size(directory):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(directory) for f in files)
+
+
+def test_caches_sharing_a_directory_stay_within_the_limit(tmp_path):
+    # Two processes' views of the same cache, each re-counting on every write
+    first = DiskLRUCache('test', 1000, directory=str(tmp_path), rescan_seconds=0)
+    second = DiskLRUCache('test', 1000, directory=str(tmp_path), rescan_seconds=0)
+
+    for i in range(20):
+        cache = first if i % 2 == 0 else second
+        cache.put_bytes(f'k{i:02d}', b'x' * 100)
+        assert disk_size(str(tmp_path)) <= 1000
+
+    assert first.stats()['evictions'] + second.stats()['evictions'] > 0
+    assert second.stats()['bytes'] == disk_size(str(tmp_path))
+
+
+def test_eviction_counts_other_writers_entries(tmp_path):
+    first = DiskLRUCache('test', 1000, directory=str(tmp_path), rescan_seconds=3600)
+    second = DiskLRUCache('test', 1000, directory=str(tmp_path), rescan_seconds=3600)
+    for i in range(6):
+        first.put_bytes(f'a{i}', b'x' * 100)
+        age(first, f'a{i}', 1000 + i)
+    # Without a rescan the second cache only knows about its own writes
+    for i in range(5):
+        second.put_bytes(f'b{i}', b'x' * 100)
+    assert second.stats()['bytes'] == 500
+
+    second.put_bytes('b5', b'x' * 600)
+
+    # Eviction re-counts the directory and removes the other writer's oldest entries
+    assert second.stats()['bytes'] == disk_size(str(tmp_path)) <= 900
+    assert first.get_path('a0') is None
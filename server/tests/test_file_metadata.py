@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+
+mongomock = pytest.importorskip('mongomock')
+
+import FileMetadata
+from FileMetadata import FileMetadataStore, InvalidCursor, migrate_embedded_files
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def store():
+    store = FileMetadataStore(mongomock.MongoClient().db.uploaded_files, 'uploaded_at')
+    store.ensure_indexes()
+    return store
+
+
+def add_files(store, user_id, count, same_time=False):
+    """Add `count` files one second apart (or all at START); returns their GridFS ids oldest first"""
+    ids = []
+    for i in range(count):
+        gridfs_id = ObjectId()
+        when = START if same_time else START + timedelta(seconds=i)
+        store.add(user_id, gridfs_id, f'{user_id}-{i}.wav', 'audio/wav', uploaded_at=when)
+        ids.append(gridfs_id)
+    return ids
+
+
+def all_pages(store, user_id, limit):
+    ids, cursor, pages = [], None, 0
+    while True:
+        files, cursor = store.page(user_id, limit=limit, cursor=cursor)
+        ids += [f['gridfs_id'] for f in files]
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+def test_pages_cover_every_file_newest_first(store):
+    ids = add_files(store, 'alice', 7)
+    add_files(store, 'bob', 3)
+
+    paged, pages = all_pages(store, 'alice', limit=3)
+
+    assert paged == ids[::-1]
+    assert pages == 3
+    files, _ = store.page('alice', limit=3)
+    assert '_id' not in files[0]
+    assert store.latest('alice')['gridfs_id'] == ids[-1]
+
+
+def test_files_with_the_same_timestamp_page_without_gaps(store):
+    ids = add_files(store, 'alice', 5, same_time=True)
+
+    paged, _ = all_pages(store, 'alice', limit=2)
+
+    assert sorted(paged) == sorted(ids)
+    assert len(set(paged)) == 5
+
+
+def test_cursor_is_stable_across_new_uploads(store):
+    ids = add_files(store, 'alice', 6)
+
+    first, cursor = store.page('alice', limit=3)
+    # A newer upload lands between two page requests
+    store.add('alice', ObjectId(), 'new.wav', 'audio/wav', uploaded_at=START + timedelta(hours=1))
+    second, cursor = store.page('alice', limit=3, cursor=cursor)
+
+    assert [f['gridfs_id'] for f in first + second] == ids[::-1]
+    assert cursor is None
+
+
+def test_invalid_cursor_is_rejected(store):
+    add_files(store, 'alice', 2)
+    with pytest.raises(InvalidCursor):
+        store.page('alice', cursor='not-a-cursor')
+
+
+def test_page_size_is_capped(store, monkeypatch):
+    monkeypatch.setattr(FileMetadata, 'FILE_PAGE_MAX', 4)
+    add_files(store, 'alice', 6)
+
+    files, cursor = store.page('alice', limit=1000)
+
+    assert len(files) == 4
+    assert cursor is not None
+
+
+def test_migration_copies_embedded_files_once(store):
+    users = mongomock.MongoClient().db.users
+    gridfs_ids = [ObjectId(), ObjectId()]
+    users.insert_one({'id': 'alice', 'uploaded_files': [
+        {'gridfs_id': gridfs_id, 'filename': f'{i}.wav', 'content_type': 'audio/wav'}
+        for i, gridfs_id in enumerate(gridfs_ids)
+    ]})
+    stores = {'uploaded_files': store}
+
+    assert migrate_embedded_files(users, stores) == {'uploaded_files': 2}
+    assert migrate_embedded_files(users, stores, unset=True) == {'uploaded_files': 0}
+
+    paged, _ = all_pages(store, 'alice', limit=10)
+    assert sorted(paged) == sorted(gridfs_ids)
+    assert 'uploaded_files' not in users.find_one({'id': 'alice'})
@@ -0,0 +1,55 @@
+import pytest
+from GridFSStreaming import parse_range
+
+LENGTH = 1000
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=999-999', (999, 999)),
+    (' bytes=10-20 ', (10, 20)),
+    # End past the file is clamped
+    ('bytes=900-5000', (900, 999)),
+])
+def test_byte_ranges(header, expected):
+    assert parse_range(header, LENGTH) == expected
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=-100', (900, 999)),
+    ('bytes=-1', (999, 999)),
+    # Longer than the file: the whole file
+    ('bytes=-5000', (0, 999)),
+])
+def test_suffix_ranges(header, expected):
+    assert parse_range(header, LENGTH) == expected
+
+
+@pytest.mark.parametrize('header', [
+    'bytes=1000-',
+    'bytes=1000-1100',
+    'bytes=500-100',
+    'bytes=-0',
+])
+def test_unsatisfiable_ranges(header):
+    assert parse_range(header, LENGTH) is False
+
+
+@pytest.mark.parametrize('header', [
+    None,
+    '',
+    'bytes=-',
+    # Multiple ranges may be ignored, serving the whole file
+    'bytes=0-99,200-299',
+    'bytes=0-99, -100',
+    'items=0-99',
+    'bytes=a-b',
+])
+def test_ignored_headers(header):
+    assert parse_range(header, LENGTH) is None
+
+
+def test_empty_file_has_no_satisfiable_range():
+    assert parse_range('bytes=0-', 0) is False
+    assert parse_range('bytes=-100', 0) is False
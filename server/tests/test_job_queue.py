@@ -0,0 +1,157 @@
+import time
+import threading
+import pytest
+from JobQueue import JobQueue, JobRejected, DONE, RUNNING
+
+
+def wait_for_status(queue, job_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if queue.get(job_id)['status'] == status:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+
+class Recorder:
+    """Job runner that logs job names and blocks jobs named 'gate' until released"""
+
+    def __init__(self):
+        self.order = []
+        self.batches = []
+        self.release = threading.Event()
+
+    def run(self, name, **params):
+        if name == 'gate':
+            self.release.wait(5)
+        self.order.append(name)
+        return name
+
+    def run_batch(self, jobs):
+        self.batches.append([job['name'] for job in jobs])
+        return [self.run(**job) for job in jobs]
+
+
+def blocked_queue(recorder, **kwargs):
+    """Queue with its only worker busy on a gate job, so submissions stay queued"""
+    kwargs.setdefault('workers', 1)
+    queue = JobQueue('test', recorder.run, **kwargs)
+    gate = queue.submit('gatekeeper', name='gate')
+    wait_for_status(queue, gate, RUNNING)
+    return queue
+
+
+def test_round_robin_across_users():
+    recorder = Recorder()
+    queue = blocked_queue(recorder, max_pending_per_user=10)
+    jobs = [queue.submit('a', name=f'a{i}') for i in range(3)]
+    jobs += [queue.submit('b', name=f'b{i}') for i in range(2)]
+
+    recorder.release.set()
+    for job_id in jobs:
+        wait_for_status(queue, job_id, DONE)
+
+    # One user's backlog doesn't hold the other back
+    assert recorder.order == ['gate', 'a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_running_job_counts_towards_user_limit():
+    recorder = Recorder()
+    queue = JobQueue('test', recorder.run, workers=1, max_pending_per_user=2)
+    gate = queue.submit('a', name='gate')
+    wait_for_status(queue, gate, RUNNING)
+    queue.submit('a', name='a1')
+
+    with pytest.raises(JobRejected):
+        queue.submit('a', name='a2')
+    # Other users are unaffected
+    queue.submit('b', name='b1')
+    assert queue.stats()['rejected'] == 1
+    recorder.release.set()
+
+
+def test_global_queue_limit():
+    recorder = Recorder()
+    queue = blocked_queue(recorder, max_pending_per_user=10, max_queued=2)
+    queue.submit('a', name='a1')
+    queue.submit('b', name='b1')
+
+    with pytest.raises(JobRejected):
+        queue.submit('c', name='c1')
+    recorder.release.set()
+
+
+def test_rejection_clears_once_jobs_finish():
+    recorder = Recorder()
+    queue = blocked_queue(recorder, max_pending_per_user=1)
+    first = queue.submit('a', name='a1')
+    with pytest.raises(JobRejected):
+        queue.submit('a', name='a2')
+
+    recorder.release.set()
+    wait_for_status(queue, first, DONE)
+    queue.submit('a', name='a2')
+
+
+def test_batches_waiting_jobs_with_the_same_key():
+    recorder = Recorder()
+    queue = JobQueue('test', recorder.run, workers=1, max_pending_per_user=10,
+                     run_batch=recorder.run_batch, batch_key=lambda params: params.get('bucket'),
+                     max_batch=3)
+    gate = queue.submit('gatekeeper', name='gate')
+    wait_for_status(queue, gate, RUNNING)
+    jobs = [
+        queue.submit('a', name='a1', bucket=1),
+        queue.submit('b', name='b1', bucket=1),
+        queue.submit('c', name='c1', bucket=2),
+        queue.submit('d', name='d1', bucket=1),
+        queue.submit('e', name='e1', bucket=1),
+    ]
+
+    recorder.release.set()
+    for job_id in jobs:
+        wait_for_status(queue, job_id, DONE)
+
+    # Capped at max_batch; other buckets wait for their own turn
+    assert recorder.batches == [['a1', 'b1', 'd1']]
+    assert recorder.order == ['gate', 'a1', 'b1', 'd1', 'c1', 'e1']
+    assert [queue.get(job_id)['result'] for job_id in jobs] == ['a1', 'b1', 'c1', 'd1', 'e1']
+    stats = queue.stats()
+    assert stats['batches'] == 1
+    assert stats['batched_jobs'] == 3
+
+
+def test_jobs_without_a_batch_key_run_alone():
+    recorder = Recorder()
+    queue = JobQueue('test', recorder.run, workers=1, max_pending_per_user=10,
+                     run_batch=recorder.run_batch, batch_key=lambda params: None, max_batch=4)
+    gate = queue.submit('gatekeeper', name='gate')
+    wait_for_status(queue, gate, RUNNING)
+    jobs = [queue.submit(user, name=user) for user in ('a', 'b')]
+
+    recorder.release.set()
+    for job_id in jobs:
+        wait_for_status(queue, job_id, DONE)
+    assert recorder.batches == []
+
+
+def test_a_batch_takes_one_job_per_user():
+    recorder = Recorder()
+    queue = JobQueue('test', recorder.run, workers=1, max_running_per_user=3, max_pending_per_user=10,
+                     run_batch=recorder.run_batch, batch_key=lambda params: params.get('bucket'),
+                     max_batch=4)
+    gate = queue.submit('gatekeeper', name='gate')
+    wait_for_status(queue, gate, RUNNING)
+    jobs = [
+        queue.submit('a', name='a1', bucket=1),
+        queue.submit('a', name='a2', bucket=1),
+        queue.submit('b', name='b1', bucket=1),
+    ]
+
+    recorder.release.set()
+    for job_id in jobs:
+        wait_for_status(queue, job_id, DONE)
+
+    # a2 waits for a's next turn even though a may run several jobs at once
+    assert recorder.batches == [['a1', 'b1']]
+    assert recorder.order == ['gate', 'a1', 'b1', 'a2']
@@ -0,0 +1,138 @@
+import importlib
+import time
+import threading
+import numpy as np
+import pytest
+import soundfile as sf
+from ModelPool import ModelPool, PoolTimeout
+
+
+def import_or_skip(name):
+    """Import an app module, skipping when its pretrained models can't be loaded offline"""
+    try:
+        return importlib.import_module(name)
+    except OSError as exc:
+        pytest.skip(f'{name} needs pretrained models: {exc}')
+
+
+def hold(pool, seconds):
+    """Check a model out on another thread for `seconds`; returns once it is held"""
+    held = threading.Event()
+
+    def run():
+        with pool.acquire():
+            held.set()
+            time.sleep(seconds)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    held.wait(5)
+    return thread
+
+
+def test_models_are_checked_out_exclusively():
+    pool = ModelPool('test', shared=False)
+    pool.add('m1')
+    pool.add('m2')
+
+    with pool.acquire() as first, pool.acquire() as second:
+        assert {first, second} == {'m1', 'm2'}
+        assert pool.stats()['in_use'] == 2
+    assert pool.stats()['in_use'] == 0
+
+
+def test_waits_for_a_model_to_be_returned():
+    pool = ModelPool('test', timeout=5, shared=False)
+    pool.add('m1')
+    thread = hold(pool, 0.2)
+
+    start = time.monotonic()
+    with pool.acquire() as model:
+        waited = time.monotonic() - start
+        assert model == 'm1'
+    thread.join()
+
+    assert waited >= 0.1
+    stats = pool.stats()
+    assert stats['acquired'] == 2
+    assert stats['peak_waiting'] == 1
+    assert stats['max_wait_seconds'] >= 0.1
+
+
+def test_times_out_when_no_model_frees_up():
+    pool = ModelPool('test', timeout=5, shared=False)
+    pool.add('m1')
+    thread = hold(pool, 0.5)
+
+    start = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        with pool.acquire(timeout=0.05):
+            pass
+    assert time.monotonic() - start < 0.4
+    thread.join()
+
+    assert pool.stats()['timeouts'] == 1
+    # The pool is usable again once the model is back
+    with pool.acquire(timeout=0.05) as model:
+        assert model == 'm1'
+
+
+def test_rejects_callers_beyond_the_wait_queue():
+    pool = ModelPool('test', timeout=5, max_waiters=1, shared=False)
+    pool.add('m1')
+    holder = hold(pool, 0.5)
+
+    def wait():
+        with pool.acquire():
+            pass
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while pool.stats()['waiting'] < 1:
+        time.sleep(0.01)
+
+    with pytest.raises(PoolTimeout):
+        with pool.acquire():
+            pass
+    assert pool.stats()['rejected'] == 1
+    holder.join()
+    waiter.join()
+
+
+def test_shared_pool_serves_every_caller_the_same_instance():
+    pool = ModelPool('test', timeout=0.05, shared=True)
+    pool.add('m1')
+
+    with pool.acquire() as first, pool.acquire() as second:
+        assert first == second == 'm1'
+        assert pool.stats()['in_use'] == 2
+    assert pool.stats()['timeouts'] == 0
+    assert pool.target_size(4) == 1
+
+
+def test_shared_pool_waits_for_the_first_load():
+    pool = ModelPool('test', timeout=5, shared=True)
+    timer = threading.Timer(0.1, pool.add, args=('m1',))
+    timer.start()
+
+    with pool.acquire() as model:
+        assert model == 'm1'
+    timer.join()
+
+    with pytest.raises(PoolTimeout):
+        with ModelPool('empty', shared=True).acquire(timeout=0.05):
+            pass
+
+
+def test_genre_analysis_returns_minus_one_on_pool_timeout(tmp_path, monkeypatch):
+    GenreAnalysis = import_or_skip('GenreAnalysis')
+
+    # No genre model ever becomes available
+    monkeypatch.setattr(GenreAnalysis, 'ModelsPool', ModelPool('genre-test', timeout=0.05, shared=False))
+    monkeypatch.setattr(GenreAnalysis, '_load_models', lambda missing: None)
+    sr = 22050
+    t = np.arange(3 * sr) / sr
+    path = str(tmp_path / 'clip.wav')
+    sf.write(path, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr)
+
+    assert GenreAnalysis.AnalyseGenre(path) == -1
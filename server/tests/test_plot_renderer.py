@@ -0,0 +1,38 @@
+import numpy as np
+import PlotRenderer
+
+
+def test_envelope_keeps_every_peak():
+    y = np.zeros(1000, dtype=np.float32)
+    y[3] = 1.0
+    y[997] = -1.0
+
+    centers, mins, maxs = PlotRenderer.envelope(y, 10)
+
+    assert len(centers) == len(mins) == len(maxs) == 10
+    assert maxs[0] == 1.0
+    assert mins[-1] == -1.0
+    assert all(a.dtype == np.float32 for a in (centers, mins, maxs))
+    assert 0 < centers[0] < centers[-1] < 1
+
+
+def test_envelope_is_no_wider_than_the_signal():
+    centers, mins, maxs = PlotRenderer.envelope(np.arange(5, dtype=np.float32), 100)
+
+    assert len(centers) == 5
+    np.testing.assert_array_equal(mins, maxs)
+
+
+def test_envelope_of_an_empty_signal_is_empty():
+    centers, mins, maxs = PlotRenderer.envelope(np.zeros(0, dtype=np.float32), 1400)
+
+    assert len(centers) == len(mins) == len(maxs) == 0
+    assert all(a.dtype == np.float32 for a in (centers, mins, maxs))
+
+
+def test_empty_signal_still_renders(tmp_path):
+    series = [PlotRenderer.envelope(np.zeros(0, dtype=np.float32), 1400) + ('C0',)]
+
+    png = PlotRenderer._render("Waveform", 0.0, series, (2, 1), 50)
+
+    assert png.startswith(b'\x89PNG')
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import soundfile as sf
+import librosa
+from StreamingExtractor import RunningStats, stream_features
+
+
+def numpy_stats(x):
+    return np.stack([x.min(axis=1), x.mean(axis=1), x.max(axis=1), x.var(axis=1)], axis=1)
+
+
+def merge(stats, data, sizes):
+    start = 0
+    for size in sizes:
+        stats.update(data[:, start:start + size])
+        start += size
+    return stats.result()
+
+
+@pytest.mark.parametrize('sizes', [
+    [1000],
+    [1] * 50 + [950],
+    [333, 0, 334, 333],
+    [999, 1],
+])
+def test_running_stats_match_numpy(sizes):
+    rng = np.random.default_rng(0)
+    # Large offset: a naive sum-of-squares variance would lose precision here
+    data = rng.normal(1e4, 3.0, size=(5, sum(sizes)))
+
+    np.testing.assert_allclose(merge(RunningStats(rows=5), data, sizes), numpy_stats(data), rtol=1e-9)
+
+
+def test_pooled_running_stats_match_numpy():
+    rng = np.random.default_rng(1)
+    data = rng.uniform(-1, 1, size=(12, 600))
+
+    result = merge(RunningStats(per_row=False), data, [100, 250, 250])
+
+    np.testing.assert_allclose(result, numpy_stats(data.reshape(1, -1)), rtol=1e-9)
+
+
+def test_empty_running_stats():
+    result = RunningStats(rows=2).result()
+    assert result.shape == (2, 4)
+    assert np.all(result[:, 3] == 0)
+
+
+def test_streamed_frame_features_match_in_memory(tmp_path):
+    sr = 22050
+    rng = np.random.default_rng(2)
+    t = np.arange(12 * sr) / sr
+    y = (0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 0.5 * t))
+         + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+    path = str(tmp_path / 'clip.wav')
+    sf.write(path, y, sr, subtype='FLOAT')
+
+    # Blocks that don't line up with the hop, so frames span block edges
+    streamed = stream_features(path, sr=sr, block_seconds=1.37)
+
+    y, _ = librosa.load(path, sr=sr)
+    spectrum = np.abs(librosa.stft(y, n_fft=2048, hop_length=512))
+    in_memory = np.vstack([
+        librosa.feature.rms(y=y, frame_length=2048, hop_length=512),
+        librosa.feature.spectral_bandwidth(S=spectrum, sr=sr),
+        librosa.feature.spectral_centroid(S=spectrum, sr=sr),
+        librosa.feature.spectral_rolloff(S=spectrum, sr=sr),
+    ])
+    # RMS, bandwidth, centroid and rolloff; ZCR differs at the edges by design
+    np.testing.assert_allclose(streamed['stats']['frame_features'][:4], numpy_stats(in_memory),
+                               rtol=1e-3, atol=1e-6)
+    assert streamed['duration'] == pytest.approx(12.0, abs=0.01)